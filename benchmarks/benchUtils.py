@@ -0,0 +1,107 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Callable, List
+from datetime import datetime
+from random import Random
+from time import perf_counter
+from rtp import RTP
+from rtpPayload_ttml import RTPPayload_TTML, utfEncode
+from rtpPayload_ttml.utfUtils import ENCODING_ALIASES
+from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlTransmitter import MAX_SEQ_NUM
+from rtpTTML.sampleText import sampleText
+
+
+def makeDoc(size: int, script: str, seed: int = 0) -> str:
+    '''
+    Generate a pseudo-random document of `size` characters drawn from one of
+    the SCRIPTS alphabets.
+    '''
+    return sampleText(size, script, Random(seed))
+
+
+def shrinkingFragmentDoc(
+       doc: str, maxLen: int, encoding: str, bom: bool) -> List[str]:
+    '''
+    The original shrink-by-one fragmenter. Kept as the reference that the
+    transmitter's fragmenting is tested and benchmarked against.
+    '''
+    fragments: List[str] = []
+    thisStart = 0
+
+    if doc == "":
+        return fragments
+
+    while True:
+        thisEnd = thisStart + maxLen
+        while len(utfEncode(doc[thisStart:thisEnd], encoding, bom)) > maxLen:
+            thisEnd -= 1
+
+        fragments.append(doc[thisStart:thisEnd])
+
+        if thisEnd >= len(doc):
+            break
+
+        thisStart = thisEnd
+
+    return fragments
+
+
+def timeCall(func: Callable[[], object], minTime: float = 0.2) -> float:
+    '''
+    Return the mean time in seconds of a call to `func`, repeating the call
+    until at least `minTime` seconds have elapsed.
+    '''
+    calls = 0
+    start = perf_counter()
+
+    while True:
+        func()
+        calls += 1
+        elapsed = perf_counter() - start
+        if elapsed >= minTime:
+            return elapsed / calls
+
+
+def rtpPacketiseDoc(
+       transmitter: TTMLTransmitter, doc: str, time: datetime) -> List[RTP]:
+    '''
+    Packetise `doc` the way the transmitter originally did, decoding each
+    fragment and building an RTP object for it, for comparison and for
+    benchmarks that need RTP objects.
+    '''
+    encoded = transmitter._encodeDoc(doc)
+    codec = ENCODING_ALIASES[transmitter._encoding]
+    fragments = [
+        encoded[start:end].decode(codec)
+        for start, end in transmitter._fragmentEncoded(
+            encoded, transmitter._maxFragmentSize)]
+    rtpTs = transmitter._datetimeToRTPTs(time)
+
+    packets = []
+    for x in range(len(fragments)):
+        packets.append(RTP(
+            timestamp=rtpTs,
+            sequenceNumber=transmitter._nextSeqNum,
+            payload=RTPPayload_TTML(
+                userDataWords=fragments[x], encoding=transmitter._encoding,
+                bom=transmitter._bom and (x == 0)).toBytearray(),
+            marker=(x == len(fragments) - 1),
+            payloadType=transmitter._payloadType,
+            ssrc=transmitter.ssrc))
+        transmitter._nextSeqNum = (
+            transmitter._nextSeqNum + 1) % (MAX_SEQ_NUM + 1)
+
+    return packets
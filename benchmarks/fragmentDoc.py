@@ -0,0 +1,74 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+from rtpPayload_ttml import SUPPORTED_ENCODINGS
+from rtpTTML import TTMLTransmitter
+from rtpTTML.sampleText import SCRIPTS
+from benchUtils import makeDoc, shrinkingFragmentDoc, timeCall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark document fragmenting against document size '
+                    'and script mix.')
+    parser.add_argument(
+        '-s',
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[100, 1000, 10000],
+        help='document sizes in characters (default: 100 1000 10000)')
+    parser.add_argument(
+        '-e',
+        '--encoding',
+        type=str,
+        default="UTF-8",
+        choices=SUPPORTED_ENCODINGS,
+        help='Character encoding of document (default: UTF-8)')
+    parser.add_argument(
+        '-m',
+        '--max_fragment_size',
+        type=int,
+        default=1200,
+        help='maximum fragment size in bytes (default: 1200)')
+    parser.add_argument(
+        '--skip_reference',
+        action='store_true',
+        help="Don't time the original shrink-by-one fragmenter")
+    args = parser.parse_args()
+
+    transmitter = TTMLTransmitter("", 0, encoding=args.encoding)
+
+    print("{:>8} {:>8} {:>12} {:>12} {:>8}".format(
+        "script", "chars", "linear (us)", "shrink (us)", "speedup"))
+    for script in SCRIPTS:
+        for size in args.sizes:
+            doc = makeDoc(size, script)
+
+            linear = timeCall(
+                lambda: transmitter._fragmentEncoded(
+                    transmitter._encodeDoc(doc), args.max_fragment_size))
+
+            if args.skip_reference:
+                print("{:>8} {:>8} {:>12.1f}".format(
+                    script, size, linear * 1e6))
+                continue
+
+            shrink = timeCall(
+                lambda: shrinkingFragmentDoc(
+                    doc, args.max_fragment_size, args.encoding, False))
+
+            print("{:>8} {:>8} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+                script, size, linear * 1e6, shrink * 1e6, shrink / linear))
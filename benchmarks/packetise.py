@@ -0,0 +1,93 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+from datetime import datetime
+from rtp import RTP
+from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlTransmitter import RTP_HEADER_LEN
+from rtpTTML.packetisationCache import PacketisationCache
+from rtpTTML.sampleText import SCRIPTS
+from benchUtils import makeDoc, rtpPacketiseDoc, timeCall
+
+
+def rtpClassHeaders(transmitter: TTMLTransmitter, count: int) -> None:
+    buffer = bytearray(RTP_HEADER_LEN)
+    for x in range(count):
+        buffer[:] = RTP(
+            timestamp=x,
+            sequenceNumber=x,
+            marker=False,
+            payloadType=transmitter._payloadType,
+            ssrc=transmitter.ssrc).toBytearray()
+
+
+def templateHeaders(transmitter: TTMLTransmitter, count: int) -> None:
+    buffer = bytearray(RTP_HEADER_LEN)
+    for x in range(count):
+        transmitter._writeRTPHeader(buffer, 0, x, False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark RTP header generation and document '
+                    'packetisation in packets per second.')
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=20000,
+        help='document size in characters (default: 20000)')
+    parser.add_argument(
+        '-m',
+        '--max_fragment_size',
+        type=int,
+        default=1200,
+        help='maximum fragment size in bytes (default: 1200)')
+    args = parser.parse_args()
+
+    transmitter = TTMLTransmitter(
+        "", 0, maxFragmentSize=args.max_fragment_size)
+    count = 1000
+
+    rtpClass = timeCall(lambda: rtpClassHeaders(transmitter, count))
+    template = timeCall(lambda: templateHeaders(transmitter, count))
+    print("Headers only")
+    print("  RTP class: {:>12.0f} packets/s".format(count / rtpClass))
+    print("  template:  {:>12.0f} packets/s".format(count / template))
+    print()
+
+    cachedTransmitter = TTMLTransmitter(
+        "", 0, maxFragmentSize=args.max_fragment_size,
+        cache=PacketisationCache())
+
+    now = datetime.now()
+    print("{:>8} {:>8} {:>16} {:>16} {:>16}".format(
+        "script", "packets", "RTP (pkts/s)", "buffer (pkts/s)",
+        "cached (pkts/s)"))
+    for script in SCRIPTS:
+        doc = makeDoc(args.size, script)
+        packets = len(transmitter._packetiseDocBuffer(doc, now))
+
+        legacy = timeCall(
+            lambda: [
+                p.toBytes() for p in rtpPacketiseDoc(transmitter, doc, now)])
+        buffered = timeCall(
+            lambda: transmitter._packetiseDocBuffer(doc, now))
+        cached = timeCall(
+            lambda: cachedTransmitter._packetiseDocBuffer(doc, now))
+
+        print("{:>8} {:>8} {:>16.0f} {:>16.0f} {:>16.0f}".format(
+            script, packets, packets / legacy, packets / buffered,
+            packets / cached))
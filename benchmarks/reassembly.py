@@ -0,0 +1,138 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+from datetime import datetime
+from typing import List, Optional, cast
+from rtp import RTP
+from rtpPayload_ttml import RTPPayload_TTML, SUPPORTED_ENCODINGS
+from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlReceiver import TTMLStream
+from rtpTTML.rtpView import Packet
+from rtpTTML.sampleText import SCRIPTS
+from benchUtils import makeDoc, rtpPacketiseDoc, timeCall
+
+
+class LegacyStream(TTMLStream):
+    # The original per-fragment decode and O(n) bounds checks, for comparison
+    def _keysComplete(self) -> bool:
+        if len(self._fragments) == 0:
+            return False
+
+        minKey = min(self._fragments)
+        maxKey = max(self._fragments)
+
+        return len(self._fragments) == maxKey - minKey + 1
+
+    def _processFragments(self) -> Optional[str]:
+        if not self._keysComplete():
+            self._fragments.clear()
+            return None
+
+        doc = ""
+        for k, v in self._fragments.items():
+            doc += v  # type: ignore
+
+        self._fragments.clear()
+
+        return doc
+
+    def _processPacket(self, packet: Packet, now: float = 0.0) -> None:
+        if self._curTimestamp != packet.timestamp:
+            self._fragments.clear()
+            self._curTimestamp = packet.timestamp
+
+        seqNumber = packet.sequenceNumber
+        if len(self._fragments) > 0:
+            seqNumber = self._unloopSeqNum(
+                max(self._fragments), packet.sequenceNumber)
+
+        payload = RTPPayload_TTML(encoding=self._encoding, bom=self._bom)
+        payload.fromBytearray(cast(bytearray, packet.payload))
+        self._fragments[seqNumber] = payload.userDataWords  # type: ignore
+
+
+def makePackets(
+       fragments: int, script: str, encoding: str,
+       maxFragmentSize: int) -> List[RTP]:
+    transmitter = TTMLTransmitter(
+        "", 0, maxFragmentSize=maxFragmentSize, encoding=encoding)
+
+    # Grow the document until it packetises to at least the requested
+    # fragment count
+    size = max(1, fragments * maxFragmentSize // 8)
+    while True:
+        packets = rtpPacketiseDoc(
+            transmitter, makeDoc(size, script), datetime.now())
+        if len(packets) >= fragments:
+            return packets
+        size += max(1, size // 8)
+
+
+def reassemble(stream: TTMLStream, packets: List[RTP]) -> None:
+    # Each document needs a new timestamp, or it is treated as a repeat
+    stream._curTimestamp = -1
+
+    for packet in packets:
+        stream._processPacket(packet)
+    stream._processFragments()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark document reassembly against fragments per '
+                    'document.')
+    parser.add_argument(
+        '-f',
+        '--fragments',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100, 1000],
+        help='fragments per document (default: 1 10 100 1000)')
+    parser.add_argument(
+        '-s',
+        '--script',
+        type=str,
+        default="mixed",
+        choices=sorted(SCRIPTS),
+        help='script of the document text (default: mixed)')
+    parser.add_argument(
+        '-e',
+        '--encoding',
+        type=str,
+        default="UTF-8",
+        choices=SUPPORTED_ENCODINGS,
+        help='Character encoding of document (default: UTF-8)')
+    parser.add_argument(
+        '-m',
+        '--max_fragment_size',
+        type=int,
+        default=1200,
+        help='maximum fragment size in bytes (default: 1200)')
+    args = parser.parse_args()
+
+    print("{:>10} {:>12} {:>12} {:>8}".format(
+        "fragments", "new (us)", "legacy (us)", "speedup"))
+    for fragments in args.fragments:
+        packets = makePackets(
+            fragments, args.script, args.encoding, args.max_fragment_size)
+
+        new = timeCall(
+            lambda: reassemble(TTMLStream(encoding=args.encoding), packets))
+        legacy = timeCall(
+            lambda: reassemble(LegacyStream(encoding=args.encoding), packets))
+
+        print("{:>10} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+            len(packets), new * 1e6, legacy * 1e6, legacy / new))
@@ -0,0 +1,131 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import socket
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List, Tuple
+from rtp import RTP
+from rtpTTML import TTMLTransmitter
+from rtpTTML.bufferPool import BufferPool
+from rtpTTML.rtpView import RTPView
+from rtpTTML.ttmlReceiver import TTMLStream
+from benchUtils import makeDoc
+
+RECV_BUF_SIZE = 2**16
+
+
+def legacyReceive(sock: socket.socket, stream: TTMLStream) -> None:
+    # The original path: recvfrom allocates, and parsing copies twice
+    data, addr = sock.recvfrom(RECV_BUF_SIZE)
+    stream.processPacket(RTP().fromBytearray(bytearray(data)), 0.0)
+
+
+def pooledReceive(
+       sock: socket.socket, stream: TTMLStream, pool: BufferPool) -> None:
+    length, addr = sock.recvfrom_into(pool.reserve())
+    stream.processPacket(RTPView(pool.commit(length)), 0.0)
+
+
+def measure(
+       packets: List[bytes],
+       receive: Callable[[socket.socket], None]
+       ) -> Tuple[float, float, float]:
+    '''
+    Send `packets` over loopback and receive them, returning the median and
+    mean peak bytes allocated per packet, and the mean bytes retained.
+    '''
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**24)
+    rx.bind(("127.0.0.1", 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    peaks = []
+    retained = 0
+    for packet in packets:
+        tx.sendto(packet, rx.getsockname())
+
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        receive(rx)
+        current, packetPeak = tracemalloc.get_traced_memory()
+
+        peaks.append(packetPeak - before)
+        retained += current - before
+
+    rx.close()
+    tx.close()
+
+    # The mean includes joining and decoding each document on its last
+    # packet, the median only the cost of receiving a packet
+    peaks.sort()
+
+    return (
+        peaks[len(peaks) // 2], sum(peaks) / len(peaks),
+        retained / len(packets))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Measure memory allocated per packet received, with and '
+                    'without pooled buffers and in-place RTP parsing.')
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=20000,
+        help='document size in characters (default: 20000)')
+    parser.add_argument(
+        '-n',
+        '--docs',
+        type=int,
+        default=20,
+        help='documents to receive (default: 20)')
+    parser.add_argument(
+        '-m',
+        '--max_fragment_size',
+        type=int,
+        default=1200,
+        help='maximum fragment size in bytes (default: 1200)')
+    args = parser.parse_args()
+
+    transmitter = TTMLTransmitter(
+        "", 0, maxFragmentSize=args.max_fragment_size)
+    doc = makeDoc(args.size, "mixed")
+    packets = []
+    for x in range(args.docs):
+        packets += [
+            bytes(p) for p in transmitter._packetiseDocBuffer(
+                doc, datetime.fromtimestamp(x))]
+
+    # Set up outside tracing, so that only per-packet allocations are counted
+    legacyStream = TTMLStream()
+    pooledStream = TTMLStream()
+    pool = BufferPool(RECV_BUF_SIZE)
+
+    tracemalloc.start()
+    legacy = measure(packets, lambda sock: legacyReceive(sock, legacyStream))
+    pooled = measure(
+        packets, lambda sock: pooledReceive(sock, pooledStream, pool))
+    tracemalloc.stop()
+
+    print("{} packets, {} per document".format(
+        len(packets), len(packets) // args.docs))
+    print("{:>8} {:>20} {:>18} {:>20}".format(
+        "path", "median peak (B/pkt)", "mean peak (B/pkt)",
+        "retained (B/pkt)"))
+    print("{:>8} {:>20.0f} {:>18.0f} {:>20.1f}".format("legacy", *legacy))
+    print("{:>8} {:>20.0f} {:>18.0f} {:>20.1f}".format("pooled", *pooled))
+    print("Slabs allocated beyond the pool: {}".format(pool.allocated))
@@ -0,0 +1,111 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import multiprocessing
+import os
+import socket
+from datetime import datetime
+from time import perf_counter, sleep
+from typing import List, Tuple
+from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlReceiverPool import TTMLReceiverPool
+from benchUtils import makeDoc
+
+
+def discard(doc: str, timestamp: int, streamID: object) -> None:
+    pass
+
+
+def freePort() -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def sendDocs(port: int, ssrc: int, doc: str, count: int) -> None:
+    with TTMLTransmitter(
+            "127.0.0.1", port, ssrc=ssrc, batchSend=True) as tx:
+        for _ in range(count // 10):
+            tx.sendDocs([(doc, datetime.now())] * 10)
+            sleep(0.001)
+
+
+def run(
+       workers: int, senders: int, doc: str,
+       docsPerSender: int) -> Tuple[int, float]:
+    port = freePort()
+
+    with TTMLReceiverPool(
+            port, workers=workers, workerCallback=discard,
+            demuxSSRC=True) as pool:
+        procs: List[multiprocessing.Process] = [
+            multiprocessing.Process(
+                target=sendDocs, args=(port, ssrc, doc, docsPerSender))
+            for ssrc in range(senders)]
+
+        start = perf_counter()
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+        # Wait for the workers to catch up
+        lastDocs = -1
+        while pool.stats()["docs"] != lastDocs:
+            lastDocs = pool.stats()["docs"]
+            end = perf_counter()
+            sleep(0.2)
+
+    return lastDocs, lastDocs / (end - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark SO_REUSEPORT receiver pool scaling with '
+                    'worker count over loopback.')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4],
+        help='worker counts to test (default: 1 2 4)')
+    parser.add_argument(
+        '-s',
+        '--senders',
+        type=int,
+        default=8,
+        help='number of sending processes, one stream each (default: 8)')
+    parser.add_argument(
+        '-n',
+        '--docs',
+        type=int,
+        default=2000,
+        help='documents sent by each sender (default: 2000)')
+    args = parser.parse_args()
+
+    doc = makeDoc(500, "latin")
+    sent = args.senders * args.docs
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:>8} {:>10} {:>8} {:>12}".format(
+        "workers", "received", "loss", "docs/s"))
+    for workers in args.workers:
+        received, rate = run(workers, args.senders, doc, args.docs)
+        print("{:>8} {:>10} {:>7.1f}% {:>12.0f}".format(
+            workers, received, 100 * (sent - received) / sent, rate))
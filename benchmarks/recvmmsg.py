@@ -0,0 +1,120 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import multiprocessing
+import socket
+from datetime import datetime
+from time import perf_counter, process_time, sleep
+from typing import List, Optional
+import rtpTTML.ttmlReceiver
+from rtpTTML import TTMLReceiver, TTMLTransmitter
+from benchUtils import makeDoc
+
+
+def freePort() -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def sendDocs(port: int, doc: str, count: int) -> None:
+    sleep(0.2)
+    with TTMLTransmitter(
+            "127.0.0.1", port, maxFragmentSize=200, batchSend=True) as tx:
+        for _ in range(count // 10):
+            tx.sendDocs([(doc, datetime.now())] * 10)
+            # Don't overrun the receiver's socket buffer too badly
+            sleep(0.005)
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.docs = 0
+        self.first: Optional[float] = None
+        self.last = 0.0
+        self.firstCPU = 0.0
+        self.lastCPU = 0.0
+
+    def callback(self, doc: str, timestamp: int) -> None:
+        now = perf_counter()
+        if self.first is None:
+            self.first = now
+            self.firstCPU = process_time()
+        self.last = now
+        self.lastCPU = process_time()
+        self.docs += 1
+
+
+def run(
+       doc: str, count: int, batchSize: Optional[int],
+       useRecvmmsg: bool) -> List[float]:
+    port = freePort()
+    counter = Counter()
+    receiver = TTMLReceiver(
+        port, counter.callback, timeout=0.5, recvBatchSize=batchSize)
+
+    available = rtpTTML.ttmlReceiver.recvmmsgAvailable
+    if not useRecvmmsg:
+        rtpTTML.ttmlReceiver.recvmmsgAvailable = lambda: False
+
+    sender = multiprocessing.Process(target=sendDocs, args=(port, doc, count))
+    sender.start()
+    try:
+        receiver.run()
+    except socket.timeout:
+        pass
+    finally:
+        rtpTTML.ttmlReceiver.recvmmsgAvailable = available
+    sender.join()
+
+    elapsed = counter.last - (counter.first or counter.last)
+    cpu = counter.lastCPU - counter.firstCPU
+    docs = max(counter.docs - 1, 1)
+
+    return [counter.docs, docs / elapsed if elapsed > 0 else 0.0,
+            cpu * 1e6 / docs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark receive loops over loopback.')
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=1000,
+        help='document size in characters (default: 1000)')
+    parser.add_argument(
+        '-n',
+        '--docs',
+        type=int,
+        default=5000,
+        help='number of documents to send (default: 5000)')
+    args = parser.parse_args()
+
+    doc = makeDoc(args.size, "latin")
+
+    print("{:>16} {:>10} {:>12} {:>14}".format(
+        "mode", "received", "docs/s", "CPU us/doc"))
+    for name, batchSize, useRecvmmsg in [
+            ("recv", None, False),
+            ("recv_into", 32, False),
+            ("recvmmsg x32", 32, True)]:
+        received, rate, cpu = run(doc, args.docs, batchSize, useRecvmmsg)
+        print("{:>16} {:>10.0f} {:>12.0f} {:>14.1f}".format(
+            name, received, rate, cpu))
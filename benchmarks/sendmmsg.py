@@ -0,0 +1,116 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import socket
+import threading
+from datetime import datetime
+from time import perf_counter, sleep
+from typing import Tuple
+from rtpTTML import TTMLTransmitter
+from rtpTTML.mmsg import sendmmsgAvailable
+from benchUtils import makeDoc
+
+
+class LoopbackSink:
+    '''
+    Counts the datagrams arriving on a loopback socket in a background thread.
+    '''
+
+    def __init__(self) -> None:
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**24)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.settimeout(0.5)
+        self.address = self._socket.getsockname()
+        self.received = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        buffer = bytearray(2**16)
+        while True:
+            try:
+                self._socket.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.received += 1
+
+    def close(self) -> None:
+        self._socket.close()
+        self._thread.join()
+
+
+def run(
+       sink: LoopbackSink, doc: str, docCount: int, batchSend: bool,
+       docsPerCall: int) -> Tuple[float, int]:
+    address, port = sink.address
+    now = datetime.now()
+
+    with TTMLTransmitter(
+            address, port, batchSend=batchSend) as transmitter:
+        start = perf_counter()
+        for _ in range(docCount // docsPerCall):
+            if docsPerCall == 1:
+                transmitter.sendDoc(doc, now)
+            else:
+                transmitter.sendDocs([(doc, now)] * docsPerCall)
+        elapsed = perf_counter() - start
+
+        return elapsed, transmitter.sendCalls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark per-packet sendto against batched sendmmsg '
+                    'over loopback.')
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=20000,
+        help='document size in characters (default: 20000)')
+    parser.add_argument(
+        '-n',
+        '--docs',
+        type=int,
+        default=2000,
+        help='number of documents to send (default: 2000)')
+    args = parser.parse_args()
+
+    if not sendmmsgAvailable():
+        print("sendmmsg not available, batched runs use the fallback path")
+
+    doc = makeDoc(args.size, "latin")
+    sizer = TTMLTransmitter("", 0)
+    packets = len(
+        sizer._fragmentEncoded(sizer._encodeDoc(doc), 1200))
+    sink = LoopbackSink()
+
+    print("{:>24} {:>10} {:>12} {:>12} {:>10}".format(
+        "mode", "syscalls", "docs/s", "packets/s", "received"))
+    for name, batchSend, docsPerCall in [
+            ("sendto per packet", False, 1),
+            ("sendmmsg per doc", True, 1),
+            ("sendmmsg per 10 docs", True, 10)]:
+        sink.received = 0
+        elapsed, calls = run(sink, doc, args.docs, batchSend, docsPerCall)
+        sleep(0.5)
+        print("{:>24} {:>10} {:>12.0f} {:>12.0f} {:>10}".format(
+            name, calls, args.docs / elapsed,
+            packets * args.docs / elapsed, sink.received))
+
+    sink.close()
@@ -0,0 +1,395 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import itertools
+import json
+import platform
+import socket
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from rtp import RTP
+from rtpTTML import TTMLReceiver, TTMLTransmitter
+from rtpTTML.ttmlReceiver import OrderedBuffer, StreamID, TTMLStream
+from benchUtils import makeDoc, timeCall
+
+Params = Dict[str, Any]
+Metrics = Dict[str, float]
+
+# Encodings as (encoding, bom)
+ENCODINGS = [
+    ("UTF-8", False), ("UTF-8", True), ("UTF-16", False), ("UTF-16", True)]
+EPOCH = datetime(2020, 1, 1)
+
+
+def grid(**axes: List[Any]) -> Iterator[Params]:
+    '''
+    Yield every combination of the values of each axis.
+    '''
+    names = list(axes)
+    for values in itertools.product(*(axes[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def impair(
+       packets: List[bytes], reorder: float, loss: float,
+       seed: int = 0) -> List[bytes]:
+    '''
+    Drop packets with probability `loss`, and swap neighbouring packets with
+    probability `reorder`.
+    '''
+    rand = Random(seed)
+    impaired = [p for p in packets if rand.random() >= loss]
+
+    x = 0
+    while x < len(impaired) - 1:
+        if rand.random() < reorder:
+            impaired[x], impaired[x + 1] = impaired[x + 1], impaired[x]
+            x += 1
+        x += 1
+
+    return impaired
+
+
+def makeDocPackets(
+       docs: int, params: Params) -> List[bytes]:
+    encoding, bom = params["encoding"]
+    tx = TTMLTransmitter(
+        "", 0, maxFragmentSize=params["fragment"], encoding=encoding,
+        bom=bom, initialSeqNum=0, tsOffset=0)
+    doc = makeDoc(params["size"], params["script"])
+
+    packets = []
+    for x in range(docs):
+        packets += [
+            bytes(p) for p in tx._packetiseDocBuffer(
+                doc, EPOCH + timedelta(milliseconds=x))]
+
+    return packets
+
+
+def benchFragment(params: Params, minTime: float) -> Metrics:
+    encoding, bom = params["encoding"]
+    tx = TTMLTransmitter("", 0, encoding=encoding, bom=bom)
+    doc = makeDoc(params["size"], params["script"])
+
+    perDoc = timeCall(
+        lambda: tx._fragmentEncoded(tx._encodeDoc(doc), params["fragment"]),
+        minTime)
+
+    return {"docsPerSec": 1 / perDoc}
+
+
+def benchPacketise(params: Params, minTime: float) -> Metrics:
+    encoding, bom = params["encoding"]
+    tx = TTMLTransmitter(
+        "", 0, maxFragmentSize=params["fragment"], encoding=encoding,
+        bom=bom)
+    doc = makeDoc(params["size"], params["script"])
+    now = datetime.now()
+    packets = len(tx._packetiseDocBuffer(doc, now))
+
+    perDoc = timeCall(lambda: tx._packetiseDocBuffer(doc, now), minTime)
+
+    return {"docsPerSec": 1 / perDoc, "packetsPerSec": packets / perDoc}
+
+
+def benchOrderedBuffer(params: Params, minTime: float) -> Metrics:
+    count = 1000
+    rand = Random(0)
+    keys = list(range(count))
+    for x in range(count - 1):
+        if rand.random() < params["reorder"]:
+            keys[x], keys[x + 1] = keys[x + 1], keys[x]
+    packets = [RTP(sequenceNumber=k) for k in keys]
+
+    def run() -> None:
+        buffer = OrderedBuffer()
+        for packet in packets:
+            buffer.pushGet(packet.sequenceNumber, packet)
+
+    return {"packetsPerSec": count / timeCall(run, minTime)}
+
+
+def benchReassemble(params: Params, minTime: float) -> Metrics:
+    # Through TTMLStream, including its OrderedBuffer, from parsed packets
+    encoding, bom = params["encoding"]
+    docs = 20
+    packets = [
+        RTP().fromBytearray(bytearray(p)) for p in impair(
+            makeDocPackets(docs, params), params["reorder"], params["loss"])]
+
+    def run() -> None:
+        stream = TTMLStream(StreamID(None, None), encoding, bom)
+        for packet in packets:
+            stream.processPacket(packet, 0.0)
+
+    perRun = timeCall(run, minTime)
+
+    return {
+        "docsPerSec": docs / perRun,
+        "packetsPerSec": len(packets) / perRun}
+
+
+def benchProcessData(params: Params, minTime: float) -> Metrics:
+    # TTMLReceiver._processData from serialised datagrams
+    encoding, bom = params["encoding"]
+    docs = 20
+    datagrams = impair(
+        makeDocPackets(docs, params), params["reorder"], params["loss"])
+
+    def run() -> None:
+        receiver = TTMLReceiver(
+            0, lambda doc, ts: None, encoding=encoding, bom=bom)
+        for data in datagrams:
+            receiver._processData(data)
+
+    perRun = timeCall(run, minTime)
+
+    return {
+        "docsPerSec": docs / perRun,
+        "packetsPerSec": len(datagrams) / perRun}
+
+
+def freePort() -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchLoopback(params: Params, minTime: float) -> Metrics:
+    # Send over UDP loopback to a receiver thread, timing each document from
+    # send to delivery
+    encoding, bom = params["encoding"]
+    docs = params["docs"]
+    doc = makeDoc(params["size"], params["script"])
+    port = freePort()
+
+    sent: Dict[int, float] = {}
+    latencies: List[float] = []
+    lastDelivery = [0.0]
+
+    def callback(doc: str, timestamp: int) -> None:
+        now = perf_counter()
+        lastDelivery[0] = now
+        if timestamp in sent:
+            latencies.append(now - sent[timestamp])
+
+    receiver = TTMLReceiver(
+        port, callback, timeout=0.5, encoding=encoding, bom=bom,
+        recvBufSize=2**16)
+
+    def receive() -> None:
+        try:
+            receiver.run()
+        except socket.timeout:
+            pass
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    sleep(0.1)
+
+    tx = TTMLTransmitter(
+        "127.0.0.1", port, maxFragmentSize=params["fragment"],
+        encoding=encoding, bom=bom, tsOffset=0)
+
+    with tx as conn:
+        start = perf_counter()
+        unpaced = 0
+        for x in range(docs):
+            time = EPOCH + timedelta(milliseconds=x)
+            sent[tx._datetimeToRTPTs(time)] = perf_counter()
+            conn.sendDoc(doc, time)
+
+            # Don't overrun the socket buffer
+            unpaced += len(tx._packetBuffer)
+            if unpaced >= 10:
+                sleep(0.0005)
+                unpaced = 0
+
+    thread.join()
+    if receiver._socket is not None:
+        receiver._socket.close()
+
+    if len(latencies) == 0:
+        return {"docsPerSec": 0.0, "delivered": 0.0}
+
+    return {
+        "docsPerSec": len(latencies) / (lastDelivery[0] - start),
+        "delivered": len(latencies) / docs,
+        "latencyMeanUs": 1e6 * sum(latencies) / len(latencies),
+        "latencyP50Us": 1e6 * percentile(latencies, 0.5),
+        "latencyP99Us": 1e6 * percentile(latencies, 0.99)}
+
+
+BENCHMARKS: Dict[
+        str, Tuple[Callable[[Params, float], Metrics], List[Params]]] = {
+    "fragment": (benchFragment, list(grid(
+        size=[100, 10000], script=["latin", "cjk", "emoji"],
+        encoding=ENCODINGS, fragment=[500, 1200]))),
+    "packetise": (benchPacketise, list(grid(
+        size=[100, 10000], script=["latin", "cjk", "emoji"],
+        encoding=ENCODINGS, fragment=[500, 1200]))),
+    "orderedBuffer": (benchOrderedBuffer, list(grid(
+        reorder=[0.0, 0.05, 0.2]))),
+    "reassemble": (benchReassemble, list(grid(
+        size=[100, 10000], script=["latin", "cjk"], encoding=ENCODINGS,
+        fragment=[1200], reorder=[0.0, 0.05], loss=[0.0, 0.01]))),
+    "processData": (benchProcessData, list(grid(
+        size=[100, 10000], script=["mixed"], encoding=ENCODINGS[:1],
+        fragment=[1200], reorder=[0.0, 0.05], loss=[0.0, 0.01]))),
+    "loopback": (benchLoopback, list(grid(
+        size=[100, 10000], script=["mixed"], encoding=ENCODINGS[:1],
+        fragment=[1200], docs=[2000]))),
+}
+
+
+def gitCommit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resultKey(result: Dict[str, Any]) -> str:
+    return result["benchmark"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(
+       baseline: Dict[str, Any], results: Dict[str, Any],
+       threshold: float) -> int:
+    '''
+    Print the change in each metric against a baseline run, and return the
+    number of regressions beyond `threshold`.
+    '''
+    baselineResults = {resultKey(r): r for r in baseline["results"]}
+    regressions = 0
+
+    for result in results["results"]:
+        old = baselineResults.get(resultKey(result))
+        if old is None:
+            continue
+
+        for metric, value in result["metrics"].items():
+            oldValue = old["metrics"].get(metric)
+            if not oldValue or not value:
+                continue
+
+            # Rates are better higher, times better lower
+            if metric.endswith("PerSec") or metric == "delivered":
+                change = value / oldValue
+            else:
+                change = oldValue / value
+
+            flag = ""
+            if change < 1 - threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+
+            print("{:<14} {:<60} {:<14} {:>7.2f}x{}".format(
+                result["benchmark"],
+                json.dumps(result["params"], sort_keys=True)[:60],
+                metric, change, flag))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run the benchmark suite, writing results as JSON and '
+                    'optionally comparing them against an earlier run.')
+    parser.add_argument(
+        '-b',
+        '--benchmarks',
+        type=str,
+        nargs='+',
+        default=sorted(BENCHMARKS),
+        choices=sorted(BENCHMARKS),
+        help='benchmarks to run (default: all)')
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help='file to write JSON results to')
+    parser.add_argument(
+        '-c',
+        '--compare',
+        type=str,
+        default=None,
+        help='JSON results of an earlier run to compare against')
+    parser.add_argument(
+        '-t',
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='fractional slowdown reported as a regression (default: 0.1)')
+    parser.add_argument(
+        '--min_time',
+        type=float,
+        default=0.2,
+        help='minimum time in seconds to repeat each case for (default: 0.2)')
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "commit": gitCommit(),
+            "time": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine()},
+        "results": []}
+
+    for name in args.benchmarks:
+        bench, cases = BENCHMARKS[name]
+        for params in cases:
+            metrics = bench(params, args.min_time)
+            results["results"].append(
+                {"benchmark": name, "params": params, "metrics": metrics})
+            print("{:<14} {} {}".format(
+                name,
+                json.dumps(params, sort_keys=True),
+                " ".join(
+                    "{}={:.4g}".format(k, v) for k, v in metrics.items())))
+
+    if args.output is not None:
+        with open(args.output, "w") as outFile:
+            json.dump(results, outFile, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+
+        # Round trip so that tuple params match the JSON baseline
+        results = json.loads(json.dumps(results))
+
+        print()
+        if compare(baseline, results, args.threshold) > 0:
+            sys.exit(1)
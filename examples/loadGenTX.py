@@ -0,0 +1,347 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import ExitStack
+from datetime import datetime
+from random import Random
+from time import perf_counter, process_time, sleep
+from typing import List, NamedTuple
+from uuid import uuid4
+import argparse
+import heapq
+import multiprocessing
+import resource
+from rtpTTML import TTMLTransmitter
+from rtpTTML.metrics import Histogram
+from rtpTTML.sampleText import SCRIPTS, sampleText
+from rtpTTML.ttmlTransmitter import SyncTTMLTransmitterConnection
+from exampleTX import DocGen
+
+# Documents generated per stream, and cycled through when sending
+DOCS_PER_STREAM = 4
+
+# Upper bounds of the send lag histogram buckets, in seconds
+LAG_BUCKETS = (
+    0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+    0.5, 1.0)
+
+
+class LoadConfig(NamedTuple):
+    address: str
+    port: int
+    rate: float
+    sizes: List[int]
+    scripts: List[str]
+    maxFragmentSize: int
+    encoding: str
+    bom: bool
+    burst: int
+    duration: float
+
+
+class LoadStats:
+    '''
+    Totals for a run of the load generator.
+
+    Attributes:
+        docs (int): Documents sent
+        packets (int): Packets sent
+        bytes (int): Bytes sent
+        cpu (float): CPU seconds used while sending
+        elapsed (float): Wall clock seconds
+        lag (Histogram): Seconds each burst was sent after it was due
+        maxLag (float): Largest lag seen
+    '''
+
+    def __init__(self) -> None:
+        self.docs = 0
+        self.packets = 0
+        self.bytes = 0
+        self.cpu = 0.0
+        self.elapsed = 0.0
+        self.lag = Histogram(LAG_BUCKETS)
+        self.maxLag = 0.0
+
+    def observeLag(self, lag: float) -> None:
+        self.lag.observe(lag)
+        self.maxLag = max(self.maxLag, lag)
+
+    def merge(self, other: "LoadStats") -> None:
+        self.docs += other.docs
+        self.packets += other.packets
+        self.bytes += other.bytes
+        self.cpu += other.cpu
+        self.elapsed = max(self.elapsed, other.elapsed)
+        self.lag.merge(other.lag.snapshot())
+        self.maxLag = max(self.maxLag, other.maxLag)
+
+    def lagPercentile(self, fraction: float) -> float:
+        # The upper bound of the bucket holding the percentile, or the
+        # largest lag seen if that is lower
+        lag = self.lag.snapshot()
+        rank = fraction * lag.samples
+        cumulative = 0
+
+        for bound, count in zip(lag.bounds, lag.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.maxLag)
+
+        return self.maxLag
+
+    def report(self, streams: int, rate: float) -> str:
+        elapsed = max(self.elapsed, 1e-9)
+        lag = self.lag.snapshot()
+
+        return (
+            "{:>8.0f} docs/s ({:.0f} target) {:>9.0f} pkts/s "
+            "{:>7.2f} Mbit/s {:>6.1f} us CPU/pkt | lag mean {:.2f} ms "
+            "p99 <= {:.2f} ms max {:.2f} ms".format(
+                self.docs / elapsed,
+                streams * rate,
+                self.packets / elapsed,
+                8 * self.bytes / elapsed / 1e6,
+                1e6 * self.cpu / max(self.packets, 1),
+                1e3 * lag.sum / max(lag.samples, 1),
+                1e3 * self.lagPercentile(0.99),
+                1e3 * self.maxLag))
+
+
+def raiseFileLimit(files: int) -> None:
+    # Each stream has its own socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < files:
+        if hard != resource.RLIM_INFINITY:
+            files = min(files, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (files, hard))
+
+
+def runStreams(
+       config: LoadConfig, firstSSRC: int, streams: int,
+       progress: bool = False) -> LoadStats:
+    '''
+    Send from `streams` transmitters, each with its own SSRC, sequence
+    numbers and socket.
+    '''
+    rand = Random(firstSSRC)
+    raiseFileLimit(streams + 64)
+
+    transmitters = []
+    docs = []
+    for x in range(streams):
+        transmitters.append(TTMLTransmitter(
+            config.address, config.port, ssrc=firstSSRC + x,
+            maxFragmentSize=config.maxFragmentSize,
+            encoding=config.encoding, bom=config.bom))
+
+        docGen = DocGen(uuid4())
+        docs.append([
+            docGen.generateDoc(seqNum, sampleText(
+                rand.choice(config.sizes), rand.choice(config.scripts), rand))
+            for seqNum in range(DOCS_PER_STREAM)])
+
+    with ExitStack() as stack:
+        connections = [
+            stack.enter_context(transmitter) for transmitter in transmitters]
+
+        return sendStreams(config, transmitters, connections, docs, progress)
+
+
+def sendStreams(
+       config: LoadConfig, transmitters: List[TTMLTransmitter],
+       connections: List[SyncTTMLTransmitterConnection],
+       docs: List[List[str]],
+       progress: bool) -> LoadStats:
+    streams = len(transmitters)
+
+    # Each stream sends a burst every `interval`, with streams staggered
+    # evenly across it
+    interval = config.burst / config.rate
+    start = perf_counter()
+    schedule = [(start + interval * x / streams, x) for x in range(streams)]
+    heapq.heapify(schedule)
+
+    stats = LoadStats()
+    interim = LoadStats()
+    sent = [0] * streams
+    cpuStart = process_time()
+    end = start + config.duration
+    intervalStart = start
+
+    while True:
+        due, stream = schedule[0]
+        if due >= end:
+            break
+
+        now = perf_counter()
+        if due > now:
+            sleep(due - now)
+            now = perf_counter()
+
+        heapq.heapreplace(schedule, (due + interval, stream))
+        interim.observeLag(now - due)
+
+        burst = []
+        for _ in range(config.burst):
+            burst.append((
+                docs[stream][sent[stream] % DOCS_PER_STREAM], datetime.now()))
+            sent[stream] += 1
+
+        # The transmitter counts the packets and bytes it generates
+        metrics = transmitters[stream].metrics
+        packets = metrics.packets
+        sentBytes = metrics.bytes
+
+        connections[stream].sendDocs(burst)
+
+        interim.docs += len(burst)
+        interim.packets += metrics.packets - packets
+        interim.bytes += metrics.bytes - sentBytes
+
+        if now >= intervalStart + 1.0:
+            interim.cpu = process_time() - cpuStart
+            interim.elapsed = now - intervalStart
+            if progress:
+                print(interim.report(streams, config.rate))
+
+            stats.merge(interim)
+            interim = LoadStats()
+            cpuStart = process_time()
+            intervalStart = now
+
+    interim.cpu = process_time() - cpuStart
+    stats.merge(interim)
+    stats.elapsed = perf_counter() - start
+
+    return stats
+
+
+def runWorker(
+       config: LoadConfig, firstSSRC: int, streams: int,
+       results: "multiprocessing.Queue[LoadStats]") -> None:
+    results.put(runStreams(config, firstSSRC, streams))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Synthetic TTML RTP load generator, sending from many '
+                    'streams at once.')
+    parser.add_argument(
+        '-i',
+        '--ip_address',
+        type=str,
+        help='receiver ip address',
+        required=True)
+    parser.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        help='receiver port',
+        required=True)
+    parser.add_argument(
+        '-n',
+        '--streams',
+        type=int,
+        default=100,
+        help='number of streams, each with its own SSRC (default: 100)')
+    parser.add_argument(
+        '-r',
+        '--rate',
+        type=float,
+        default=1.0,
+        help='documents per second per stream (default: 1)')
+    parser.add_argument(
+        '-s',
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[100],
+        help='subtitle text sizes in characters, chosen between at random '
+             '(default: 100)')
+    parser.add_argument(
+        '--scripts',
+        type=str,
+        nargs='+',
+        default=["latin"],
+        choices=sorted(SCRIPTS),
+        help='scripts of the subtitle text, chosen between at random '
+             '(default: latin)')
+    parser.add_argument(
+        '-m',
+        '--max_fragment_size',
+        type=int,
+        default=1200,
+        help='maximum fragment size in bytes (default: 1200)')
+    parser.add_argument(
+        '-e',
+        '--encoding',
+        type=str,
+        default="UTF-8",
+        help='Character encoding of document. One of UTF-8, UTF-16, UTF-16LE, '
+             'and UTF-16BE (default: UTF-8)')
+    parser.add_argument(
+        '-b',
+        action='store_true',
+        help='Include Byte Order Mark at start of of document')
+    parser.add_argument(
+        '--burst',
+        type=int,
+        default=1,
+        help='documents sent back to back by a stream each time it is due, '
+             'keeping the same average rate (default: 1)')
+    parser.add_argument(
+        '-d',
+        '--duration',
+        type=float,
+        default=10.0,
+        help='seconds to run for (default: 10)')
+    parser.add_argument(
+        '-w',
+        '--processes',
+        type=int,
+        default=1,
+        help='processes to divide the streams between (default: 1)')
+    args = parser.parse_args()
+
+    config = LoadConfig(
+        args.ip_address, args.port, args.rate, args.sizes, args.scripts,
+        args.max_fragment_size, args.encoding, args.b, args.burst,
+        args.duration)
+
+    if args.processes == 1:
+        total = runStreams(config, 0, args.streams, progress=True)
+    else:
+        results: "multiprocessing.Queue[LoadStats]" = multiprocessing.Queue()
+        share = -(-args.streams // args.processes)
+        procs = [
+            multiprocessing.Process(
+                target=runWorker,
+                args=(
+                    config, first, min(share, args.streams - first),
+                    results))
+            for first in range(0, args.streams, share)]
+
+        for proc in procs:
+            proc.start()
+
+        total = LoadStats()
+        for _ in procs:
+            total.merge(results.get())
+
+        for proc in procs:
+            proc.join()
+
+    print()
+    print("Total over {:.1f} s:".format(total.elapsed))
+    print(total.report(args.streams, args.rate))
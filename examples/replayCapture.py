@@ -0,0 +1,119 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import perf_counter
+import argparse
+import os
+from typing import Dict
+from rtpTTML.capture import CaptureFlow, replay
+
+
+def flowName(flow: CaptureFlow) -> str:
+    return "{}_{}-{}_{}-{:08x}".format(*flow.src, *flow.dst, flow.ssrc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Replay the TTML streams in a pcap, pcapng or rtpdump '
+                    'capture through reassembly.')
+    parser.add_argument(
+        'capture',
+        type=str,
+        help='capture file')
+    parser.add_argument(
+        '-p',
+        '--ports',
+        type=int,
+        nargs='+',
+        help='destination ports to replay (default: all)')
+    parser.add_argument(
+        '--ssrcs',
+        type=lambda ssrc: int(ssrc, 0),
+        nargs='+',
+        help='SSRCs to replay (default: all)')
+    parser.add_argument(
+        '-e',
+        '--encoding',
+        type=str,
+        default="UTF-8",
+        help='Character encoding of document. One of UTF-8, UTF-16, UTF-16LE, '
+             'and UTF-16BE (default: UTF-8)')
+    parser.add_argument(
+        '-b',
+        action='store_true',
+        help='Expect Byte Order Mark at start of of document')
+    parser.add_argument(
+        '--reorder_depth',
+        type=int,
+        default=5,
+        help='packets held while waiting for a missing packet (default: 5)')
+    parser.add_argument(
+        '-r',
+        '--real_time',
+        action='store_true',
+        help='replay at the original timing rather than as fast as possible')
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=1.0,
+        help='speed up of original timing with -r (default: 1)')
+    parser.add_argument(
+        '-w',
+        '--processes',
+        type=int,
+        default=1,
+        help='processes to divide the flows between (default: 1)')
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        help='directory to write each document to, named by flow and RTP '
+             'timestamp, rather than printing them')
+    args = parser.parse_args()
+
+    counts: Dict[str, int] = {}
+
+    def write(doc: str, timestamp: int, flow: CaptureFlow) -> None:
+        if args.output is None:
+            print("{} {}:".format(flowName(flow), timestamp))
+            print(doc)
+            return
+
+        # Documents repeated with the same timestamp get a suffix
+        name = "{}-{}".format(flowName(flow), timestamp)
+        count = counts.get(name, 0)
+        counts[name] = count + 1
+        if count > 0:
+            name += "-{}".format(count)
+
+        path = os.path.join(args.output, name + ".ttml")
+        with open(path, "w", encoding="utf-8") as docFile:
+            docFile.write(doc)
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+
+    start = perf_counter()
+    stats = replay(
+        args.capture, write, ports=args.ports, ssrcs=args.ssrcs,
+        realTime=args.real_time, speed=args.speed, workers=args.processes,
+        encoding=args.encoding, bom=args.b, reorderDepth=args.reorder_depth)
+    elapsed = perf_counter() - start
+
+    print(
+        "{} datagrams, {} matched in {} flows, {} errors ({} not RTP), {} "
+        "documents in {:.2f} s ({:.0f} datagrams/s)".format(
+            stats.datagrams, stats.matched, stats.flows, stats.errors,
+            stats.parseErrors, stats.docs, elapsed,
+            stats.datagrams / max(elapsed, 1e-9)))
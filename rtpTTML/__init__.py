@@ -20,7 +20,16 @@ High level python library for transmitting/receiving TTML over RTP.
 
 from .ttmlTransmitter import TTMLTransmitter
 from .ttmlReceiver import TTMLReceiver
+from .ttmlFanoutTransmitter import TTMLFanoutTransmitter
+from .ttmlReceiverServer import TTMLReceiverServer
+from .dispatch import CallbackDispatcher
+from .metrics import MetricsExporter
+from .tracing import HistogramTracer, ChromeTraceWriter
+from .recorder import RTPDumpRecorder
 
-__all__ = ["TTMLTransmitter", "TTMLReceiver"]
+__all__ = [
+    "TTMLTransmitter", "TTMLReceiver", "TTMLFanoutTransmitter",
+    "TTMLReceiverServer", "CallbackDispatcher", "MetricsExporter",
+    "HistogramTracer", "ChromeTraceWriter", "RTPDumpRecorder"]
 
 template = True
@@ -0,0 +1,129 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import List, Optional, Union
+import sys
+
+# References to a free slab while it is checked: the pool's list, the local
+# variable and getrefcount's argument
+FREE_REFS = 3
+
+
+class BufferPool:
+    '''
+    Receive buffers packed back to back into preallocated slabs, so that
+    datagrams can be received without allocating or copying.
+
+    reserve() returns a view with room for the largest datagram, to receive
+    into, and commit() the part of it that was used. Committed views can be
+    held for as long as needed: a slab is reused once no views onto it
+    remain, such as when the documents it holds payloads of have been
+    delivered or discarded. That is judged by reference count, so there is
+    no need to return buffers explicitly. Where reference counts aren't
+    available, a new slab is allocated whenever one fills.
+
+    Any view onto a slab keeps the whole slab from being reused, so data
+    held for long, such as a fragment of a document still being received,
+    should be copied out rather than held as a view.
+
+    Attributes:
+        maxDatagram (int): Room reserved for each datagram
+        slabSize (int): Size of each slab
+        count (int): Slabs to preallocate
+        maxSlabs (int): Limit on slabs kept in the pool. Beyond it, slabs are
+            allocated and left to the garbage collector
+    '''
+
+    def __init__(
+       self,
+       maxDatagram: int = 2**16,
+       slabSize: int = 2**20,
+       count: int = 4,
+       maxSlabs: Optional[int] = 256) -> None:
+        self._maxDatagram = maxDatagram
+        self._slabSize = max(slabSize, maxDatagram)
+        self._maxSlabs = maxSlabs
+        self._refCounted = hasattr(sys, "getrefcount")
+
+        self._slabs: List[bytearray] = [
+            bytearray(self._slabSize) for _ in range(max(count, 1))]
+        self._next = 1 % len(self._slabs)
+        self._view = memoryview(self._slabs[0])
+        self._offset = 0
+        self._allocated = 0
+
+    def __len__(self) -> int:
+        return len(self._slabs)
+
+    @property
+    def allocated(self) -> int:
+        '''
+        Slabs allocated because none in the pool were free.
+        '''
+        return self._allocated
+
+    def _nextSlab(self) -> bytearray:
+        slabs = self._slabs
+
+        if self._refCounted:
+            # Slabs are usually freed in the order they were filled, so the
+            # next one along is usually free
+            for _ in range(len(slabs)):
+                slab = slabs[self._next]
+                self._next = (self._next + 1) % len(slabs)
+
+                if sys.getrefcount(slab) <= FREE_REFS:
+                    return slab
+
+        self._allocated += 1
+        slab = bytearray(self._slabSize)
+
+        if self._refCounted and (
+           (self._maxSlabs is None) or (len(slabs) < self._maxSlabs)):
+            slabs.insert(self._next, slab)
+            self._next = (self._next + 1) % len(slabs)
+
+        return slab
+
+    def reserve(self) -> memoryview:
+        '''
+        Return a view with room for the largest datagram.
+        '''
+        if self._offset + self._maxDatagram > self._slabSize:
+            # Drop our view first, so that it doesn't hold the slab in use
+            self._view.release()
+            self._view = memoryview(self._nextSlab())
+            self._offset = 0
+
+        return self._view[self._offset:self._offset + self._maxDatagram]
+
+    def commit(self, length: int) -> memoryview:
+        '''
+        Keep the first `length` bytes of the last reservation, and return a
+        view of them.
+        '''
+        start = self._offset
+        self._offset += length
+
+        return self._view[start:self._offset]
+
+    def copy(self, data: Union[bytes, bytearray, memoryview]) -> memoryview:
+        '''
+        Copy a datagram received elsewhere into the pool.
+        '''
+        length = len(data)
+        self.reserve()[:length] = data
+
+        return self.commit(length)
@@ -0,0 +1,688 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Reading UDP datagrams from pcap, pcapng and rtpdump captures, and replaying
+the TTML streams in them through reassembly.
+"""
+
+from __future__ import annotations
+from typing import (
+    Callable, Collection, Dict, Iterator, List, NamedTuple, Optional, Tuple,
+    cast)
+from time import perf_counter, sleep
+import mmap
+import multiprocessing
+import pickle
+import queue
+import socket
+import struct
+import zlib
+from rtpPayload_ttml import LengthError
+from .recorder import RTPDUMP_HEADER, RTPDUMP_MAGIC, RTPDUMP_RECORD
+from .rtpView import RTPView
+from .ttmlReceiver import StreamID, TTMLStream
+
+Address = Tuple[str, int]
+
+# pcap magic numbers, as (byte order, timestamp units per second)
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e9)}
+PCAPNG_SHB = b"\x0a\x0d\x0d\x0a"
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# Link types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLANS = (0x8100, 0x88A8)
+IPPROTO_UDP = 17
+# IPv6 extension headers that can be skipped to reach UDP
+IPV6_EXTENSIONS = (0, 43, 60)
+
+UINT16 = struct.Struct("!H")
+# Source port, destination port, length, checksum
+UDP_HEADER = struct.Struct("!HHHH")
+
+# Seconds between checks that parallel replay workers are still running
+WORKER_POLL_INTERVAL = 0.5
+# Datagrams or documents passed between parallel replay processes at once
+REPLAY_BATCH_SIZE = 100
+# Batches of datagrams queued for each parallel replay worker
+WORKER_QUEUE_BATCHES = 16
+
+
+class CaptureDatagram(NamedTuple):
+    '''
+    A UDP datagram read from a capture. data is a view onto the mapped file.
+    '''
+    time: float
+    src: Address
+    dst: Address
+    data: memoryview
+
+
+class CaptureFlow(NamedTuple):
+    '''
+    An RTP stream in a capture.
+    '''
+    src: Address
+    dst: Address
+    ssrc: int
+
+
+class ReplayStats(NamedTuple):
+    datagrams: int
+    matched: int
+    # Including the parse errors of datagrams that aren't RTP
+    errors: int
+    docs: int
+    flows: int
+    parseErrors: int
+
+
+def _parseUDP(
+       packet: memoryview, offset: int, src: str,
+       dst: str) -> Optional[Tuple[Address, Address, memoryview]]:
+    if len(packet) < offset + UDP_HEADER.size:
+        return None
+
+    srcPort, dstPort, length, _ = UDP_HEADER.unpack_from(packet, offset)
+
+    return (
+        (src, srcPort), (dst, dstPort),
+        packet[offset + UDP_HEADER.size:offset + length])
+
+
+def _parseIP(
+       packet: memoryview,
+       offset: int) -> Optional[Tuple[Address, Address, memoryview]]:
+    if len(packet) <= offset:
+        return None
+
+    version = packet[offset] >> 4
+
+    if version == 4:
+        if len(packet) < offset + 20:
+            return None
+
+        headerLen = 4 * (packet[offset] & 0x0f)
+        totalLen = UINT16.unpack_from(packet, offset + 2)[0]
+        fragment = UINT16.unpack_from(packet, offset + 6)[0]
+
+        # Fragmented datagrams aren't reassembled
+        if (packet[offset + 9] != IPPROTO_UDP) or (fragment & 0x3fff):
+            return None
+
+        # Trim any link layer padding
+        packet = packet[:offset + totalLen]
+
+        return _parseUDP(
+            packet, offset + headerLen,
+            socket.inet_ntop(
+                socket.AF_INET, bytes(packet[offset + 12:offset + 16])),
+            socket.inet_ntop(
+                socket.AF_INET, bytes(packet[offset + 16:offset + 20])))
+
+    if version == 6:
+        if len(packet) < offset + 40:
+            return None
+
+        payloadLen = UINT16.unpack_from(packet, offset + 4)[0]
+        nextHeader = packet[offset + 6]
+        src = socket.inet_ntop(
+            socket.AF_INET6, bytes(packet[offset + 8:offset + 24]))
+        dst = socket.inet_ntop(
+            socket.AF_INET6, bytes(packet[offset + 24:offset + 40]))
+        packet = packet[:offset + 40 + payloadLen]
+        offset += 40
+
+        while nextHeader in IPV6_EXTENSIONS:
+            if len(packet) < offset + 2:
+                return None
+            nextHeader = packet[offset]
+            offset += 8 * (packet[offset + 1] + 1)
+
+        if nextHeader != IPPROTO_UDP:
+            return None
+
+        return _parseUDP(packet, offset, src, dst)
+
+    return None
+
+
+def _parseFrame(
+       frame: memoryview,
+       linkType: int) -> Optional[Tuple[Address, Address, memoryview]]:
+    if linkType == LINKTYPE_ETHERNET:
+        offset = 12
+        if len(frame) < offset + 2:
+            return None
+
+        etherType = UINT16.unpack_from(frame, offset)[0]
+        while etherType in ETHERTYPE_VLANS and len(frame) >= offset + 6:
+            offset += 4
+            etherType = UINT16.unpack_from(frame, offset)[0]
+
+        if etherType not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+
+        return _parseIP(frame, offset + 2)
+
+    if linkType in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return _parseIP(frame, 0)
+
+    if linkType in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        return _parseIP(frame, 4)
+
+    if linkType == LINKTYPE_LINUX_SLL:
+        return _parseIP(frame, 16)
+
+    if linkType == LINKTYPE_LINUX_SLL2:
+        return _parseIP(frame, 20)
+
+    return None
+
+
+def _readPcap(view: memoryview) -> Iterator[CaptureDatagram]:
+    byteOrder, units = PCAP_MAGICS[bytes(view[:4])]
+    linkType = struct.unpack_from(byteOrder + "I", view, 20)[0] & 0x0fffffff
+    recordHeader = struct.Struct(byteOrder + "IIII")
+
+    offset = 24
+    end = len(view)
+    while offset + recordHeader.size <= end:
+        seconds, fraction, captured, _ = recordHeader.unpack_from(
+            view, offset)
+        offset += recordHeader.size
+
+        parsed = _parseFrame(view[offset:offset + captured], linkType)
+        offset += captured
+
+        if parsed is not None:
+            yield CaptureDatagram(seconds + fraction / units, *parsed)
+
+
+def _tsResolution(options: memoryview, byteOrder: str) -> float:
+    # Units per second of timestamps from an interface, from if_tsresol
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(byteOrder + "HH", options, offset)
+        if code == 0:
+            break
+
+        if (code == 9) and (length >= 1):
+            value = options[offset + 4]
+            if value & 0x80:
+                return float(2 ** (value & 0x7f))
+            return float(10 ** value)
+
+        offset += 4 + ((length + 3) & ~3)
+
+    return 1e6
+
+
+def _readPcapng(view: memoryview) -> Iterator[CaptureDatagram]:
+    byteOrder = "<"
+    # (link type, timestamp units per second) of each interface
+    interfaces: List[Tuple[int, float]] = []
+
+    offset = 0
+    end = len(view)
+    while offset + 12 <= end:
+        if bytes(view[offset:offset + 4]) == PCAPNG_SHB:
+            magic = struct.unpack_from("<I", view, offset + 8)[0]
+            byteOrder = "<" if magic == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            interfaces = []
+
+        blockType, blockLen = struct.unpack_from(
+            byteOrder + "II", view, offset)
+        if blockLen < 12:
+            raise ValueError("Invalid pcapng block length")
+        block = view[offset:offset + blockLen]
+        offset += blockLen
+
+        if blockType == 1:
+            # Interface description
+            linkType = struct.unpack_from(byteOrder + "H", block, 8)[0]
+            interfaces.append(
+                (linkType, _tsResolution(block[16:-4], byteOrder)))
+
+        elif blockType == 6:
+            # Enhanced packet
+            interface, high, low, captured = struct.unpack_from(
+                byteOrder + "IIII", block, 8)
+            linkType, units = interfaces[interface]
+
+            parsed = _parseFrame(block[28:28 + captured], linkType)
+            if parsed is not None:
+                yield CaptureDatagram(((high << 32) | low) / units, *parsed)
+
+        elif blockType == 3:
+            # Simple packet, which has no timestamp
+            original = struct.unpack_from(byteOrder + "I", block, 8)[0]
+            captured = min(original, blockLen - 16)
+            linkType, _ = interfaces[0]
+
+            parsed = _parseFrame(block[12:12 + captured], linkType)
+            if parsed is not None:
+                yield CaptureDatagram(0.0, *parsed)
+
+
+def _readRtpdump(view: memoryview) -> Iterator[CaptureDatagram]:
+    # A text line giving the address recorded from, then a binary header
+    lineEnd = bytes(view[:1024]).index(b"\n")
+    address, port = bytes(
+        view[len(RTPDUMP_MAGIC):lineEnd]).decode("ascii").strip().split("/")
+    dst = (address, int(port))
+
+    offset = lineEnd + 1
+    startSec, startUsec, source, sourcePort, _ = RTPDUMP_HEADER.unpack_from(
+        view, offset)
+    src = (socket.inet_ntoa(struct.pack("!I", source)), sourcePort)
+    start = startSec + startUsec / 1e6
+    offset += RTPDUMP_HEADER.size
+
+    end = len(view)
+    while offset + RTPDUMP_RECORD.size <= end:
+        length, packetLen, ms = RTPDUMP_RECORD.unpack_from(view, offset)
+        if length < RTPDUMP_RECORD.size:
+            raise ValueError("Invalid rtpdump record length")
+        data = view[offset + RTPDUMP_RECORD.size:offset + length]
+        offset += length
+
+        # RTCP packets are recorded with a packet length of 0
+        if packetLen > 0:
+            yield CaptureDatagram(start + ms / 1000, src, dst, data)
+
+
+def readCapture(path: str) -> Iterator[CaptureDatagram]:
+    '''
+    Memory-map a pcap, pcapng or rtpdump file, and yield the UDP datagrams in
+    it. IPv4 fragments and non-UDP traffic are skipped.
+    '''
+    with open(path, "rb") as captureFile:
+        # The mapping stays open for as long as views onto it are held
+        mapped = mmap.mmap(captureFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+    magic = bytes(view[:len(RTPDUMP_MAGIC)])
+
+    if magic[:4] in PCAP_MAGICS:
+        return _readPcap(view)
+    if magic[:4] == PCAPNG_SHB:
+        return _readPcapng(view)
+    if magic == RTPDUMP_MAGIC:
+        return _readRtpdump(view)
+
+    raise ValueError("{} is not a pcap, pcapng or rtpdump file".format(path))
+
+
+class Replayer:
+    '''
+    Reassembles documents from captured datagrams, one TTMLStream per flow,
+    using capture times in place of the clock. Documents are passed to
+    callback(doc, timestamp, flow).
+
+    Attributes:
+        callback (Callable): Called for each document completed
+        ports (Collection[int]): Destination ports to keep, or None for all
+        ssrcs (Collection[int]): SSRCs to keep, or None for all
+        owns (Callable[[CaptureFlow], bool]): Which flows to reassemble, for
+            dividing flows between processes
+        encoding, bom, reorderDepth, maxHold, docTimeout, maxDocSize: As for
+            TTMLReceiver
+    '''
+
+    def __init__(
+       self,
+       callback: Callable[[str, int, CaptureFlow], None],
+       ports: Optional[Collection[int]] = None,
+       ssrcs: Optional[Collection[int]] = None,
+       owns: Optional[Callable[[CaptureFlow], bool]] = None,
+       encoding: str = "UTF-8",
+       bom: bool = False,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None) -> None:
+        self._callback = callback
+        self._ports = None if ports is None else frozenset(ports)
+        self._ssrcs = None if ssrcs is None else frozenset(ssrcs)
+        self._owns = owns
+        self._encoding = encoding
+        self._bom = bom
+        self._reorderDepth = reorderDepth
+        self._maxHold = maxHold
+        self._docTimeout = docTimeout
+        self._maxDocSize = maxDocSize
+
+        # None for flows that aren't ours
+        self._streams: Dict[CaptureFlow, Optional[TTMLStream]] = {}
+
+        self._datagrams = 0
+        self._matched = 0
+        self._parseErrors = 0
+        self._streamErrors = 0
+        self._docs = 0
+
+    @property
+    def stats(self) -> ReplayStats:
+        return ReplayStats(
+            self._datagrams, self._matched,
+            self._parseErrors + self._streamErrors, self._docs,
+            sum(1 for s in self._streams.values() if s is not None),
+            self._parseErrors)
+
+    def _deliver(
+       self, flow: CaptureFlow, docs: List[Tuple[str, int]]) -> None:
+        for doc, timestamp in docs:
+            self._docs += 1
+            self._callback(doc, timestamp, flow)
+
+    def _getStream(self, flow: CaptureFlow) -> Optional[TTMLStream]:
+        if flow in self._streams:
+            return self._streams[flow]
+
+        stream = None
+        if (self._owns is None) or self._owns(flow):
+            stream = TTMLStream(
+                StreamID(flow.ssrc, flow.src), self._encoding, self._bom,
+                self._reorderDepth, self._maxHold, False, self._docTimeout,
+                self._maxDocSize)
+
+        self._streams[flow] = stream
+
+        return stream
+
+    def feed(self, datagram: CaptureDatagram) -> None:
+        self._datagrams += 1
+
+        if (self._ports is not None) and (datagram.dst[1] not in self._ports):
+            return
+
+        try:
+            packet = RTPView(datagram.data)
+        except ValueError:
+            self._parseErrors += 1
+            return
+
+        if (self._ssrcs is not None) and (packet.ssrc not in self._ssrcs):
+            return
+
+        flow = CaptureFlow(datagram.src, datagram.dst, packet.ssrc)
+        stream = self._getStream(flow)
+        if stream is None:
+            return
+
+        self._matched += 1
+        now = datagram.time
+
+        try:
+            deadline = stream.deadline
+            if (deadline is not None) and (deadline <= now):
+                self._deliver(flow, stream.expire(now))
+
+            self._deliver(flow, stream.processPacket(packet, now))
+        except (ValueError, LengthError):
+            self._streamErrors += 1
+
+    def finish(self) -> ReplayStats:
+        '''
+        Release any packets still held for reordering, at the end of the
+        capture.
+        '''
+        for flow, stream in self._streams.items():
+            if stream is not None:
+                self._deliver(flow, stream.expire(float("inf")))
+
+        return self.stats
+
+
+def _flowOwner(flow: CaptureFlow, workers: int) -> int:
+    # Stable across processes, unlike hash()
+    return zlib.crc32(repr(flow).encode()) % workers
+
+
+def _replayWorker(
+       inputs: "multiprocessing.Queue", options: dict,
+       results: "multiprocessing.Queue") -> None:
+    batch: List[Tuple[str, int, CaptureFlow]] = []
+
+    def collect(doc: str, timestamp: int, flow: CaptureFlow) -> None:
+        batch.append((doc, timestamp, flow))
+        if len(batch) >= REPLAY_BATCH_SIZE:
+            results.put(list(batch))
+            batch.clear()
+
+    try:
+        replayer = Replayer(collect, **options)
+
+        # Batches of this worker's datagrams, then None
+        while True:
+            datagrams = inputs.get()
+            if datagrams is None:
+                break
+
+            for time, src, dst, data in datagrams:
+                replayer.feed(
+                    CaptureDatagram(time, src, dst, memoryview(data)))
+
+        stats = replayer.finish()
+    except Exception as e:
+        # Passed back for the parent to raise. Exceptions that can't be sent
+        # are described instead.
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError("Replay worker failed: {!r}".format(e))
+        results.put(e)
+        return
+
+    if len(batch) > 0:
+        results.put(batch)
+    results.put(stats)
+
+
+def replay(
+       path: str,
+       callback: Callable[[str, int, CaptureFlow], None],
+       ports: Optional[Collection[int]] = None,
+       ssrcs: Optional[Collection[int]] = None,
+       realTime: bool = False,
+       speed: float = 1.0,
+       workers: int = 1,
+       **options) -> ReplayStats:
+    '''
+    Replay the TTML streams in a capture through reassembly, calling
+    callback(doc, timestamp, flow) for each document.
+
+    By default datagrams are processed as fast as they can be read. If
+    realTime is set, they are processed at their original timing, sped up by
+    `speed`. With several workers, the capture is read once and its flows
+    divided between processes. Documents are in order within a flow, but not
+    between flows. Other options are passed to Replayer.
+    '''
+    if speed <= 0:
+        raise ValueError("speed must be greater than 0")
+
+    if workers > 1:
+        if realTime:
+            raise ValueError("Original timing needs a single worker")
+
+        return _replayParallel(path, callback, ports, ssrcs, workers, options)
+
+    replayer = Replayer(callback, ports, ssrcs, **options)
+    datagrams = readCapture(path)
+
+    if not realTime:
+        for datagram in datagrams:
+            replayer.feed(datagram)
+
+        return replayer.finish()
+
+    start = perf_counter()
+    firstTime: Optional[float] = None
+    for datagram in datagrams:
+        if firstTime is None:
+            firstTime = datagram.time
+
+        wait = start + (datagram.time - firstTime) / speed - perf_counter()
+        if wait > 0:
+            sleep(wait)
+
+        replayer.feed(datagram)
+
+    return replayer.finish()
+
+
+def _replayParallel(
+       path: str,
+       callback: Callable[[str, int, CaptureFlow], None],
+       ports: Optional[Collection[int]],
+       ssrcs: Optional[Collection[int]],
+       workers: int,
+       options: dict) -> ReplayStats:
+    results: "multiprocessing.Queue" = multiprocessing.Queue()
+    inputs: List["multiprocessing.Queue"] = [
+        multiprocessing.Queue(WORKER_QUEUE_BATCHES) for _ in range(workers)]
+    procs = [
+        multiprocessing.Process(
+            target=_replayWorker, args=(inputs[worker], options, results))
+        for worker in range(workers)]
+
+    for proc in procs:
+        proc.start()
+
+    # Each worker sends batches of documents, then its stats or the exception
+    # that stopped it
+    totals = [0] * len(ReplayStats._fields)
+    finished = 0
+
+    def handle(item: object) -> None:
+        nonlocal totals, finished
+
+        if isinstance(item, Exception):
+            raise item
+
+        if isinstance(item, ReplayStats):
+            finished += 1
+            totals = [a + b for a, b in zip(totals, item)]
+            return
+
+        for doc, timestamp, flow in cast(list, item):
+            callback(doc, timestamp, flow)
+
+    def checkWorkers() -> None:
+        # Workers that fail send an exception, unless they were killed
+        for proc in procs:
+            if proc.exitcode not in (None, 0):
+                raise RuntimeError(
+                    "Replay worker exited with code {}".format(proc.exitcode))
+
+    def drain() -> None:
+        while True:
+            try:
+                item = results.get_nowait()
+            except queue.Empty:
+                return
+            handle(item)
+
+    def send(worker: int, batch: Optional[list]) -> None:
+        # Deliver documents while waiting for a worker to catch up
+        while True:
+            try:
+                inputs[worker].put(batch, timeout=WORKER_POLL_INTERVAL)
+                return
+            except queue.Full:
+                drain()
+                checkWorkers()
+
+    # The capture is parsed once, here, and each flow's datagrams are copied
+    # to the worker that owns it
+    datagrams = 0
+    parseErrors = 0
+    owners: Dict[CaptureFlow, int] = {}
+    batches: List[list] = [[] for _ in range(workers)]
+
+    try:
+        for datagram in readCapture(path):
+            datagrams += 1
+
+            if (ports is not None) and (datagram.dst[1] not in ports):
+                continue
+
+            try:
+                ssrc = RTPView(datagram.data).ssrc
+            except ValueError:
+                parseErrors += 1
+                continue
+
+            if (ssrcs is not None) and (ssrc not in ssrcs):
+                continue
+
+            flow = CaptureFlow(datagram.src, datagram.dst, ssrc)
+            owner = owners.get(flow)
+            if owner is None:
+                owner = owners[flow] = _flowOwner(flow, workers)
+
+            batch = batches[owner]
+            batch.append((
+                datagram.time, datagram.src, datagram.dst,
+                bytes(datagram.data)))
+            if len(batch) >= REPLAY_BATCH_SIZE:
+                send(owner, batch)
+                batches[owner] = []
+                drain()
+
+        for worker, batch in enumerate(batches):
+            if len(batch) > 0:
+                send(worker, batch)
+            send(worker, None)
+
+        while finished < workers:
+            try:
+                item = results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                checkWorkers()
+                continue
+            handle(item)
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+
+        # Batches a failed worker didn't read are discarded
+        for inputQueue in inputs:
+            inputQueue.cancel_join_thread()
+            inputQueue.close()
+
+    # Datagrams that aren't RTP are counted here, as workers only see those
+    # that parsed
+    _, matched, errors, docs, flows, _ = totals
+
+    return ReplayStats(
+        datagrams, matched, errors + parseErrors, docs, flows, parseErrors)
@@ -0,0 +1,326 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Off-loop dispatch of received documents to slow consumers.
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Deque, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Executor
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class CallbackDispatcher:
+    '''
+    Queues calls to `callback` and makes them from worker threads, so that a
+    slow consumer doesn't stall packet reception.
+
+    A dispatcher is itself callable, so can be passed as a receiver's
+    callback in place of the consumer:
+
+        dispatcher = CallbackDispatcher(processDoc, maxQueue=100)
+        receiver = TTMLReceiver(port, dispatcher)
+
+    When the queue is full, the overflow policy either blocks the caller
+    until there is space, drops the oldest queued call, or drops the new call.
+
+    If an executor is given, such as a ProcessPoolExecutor, each call is run
+    on it, with `workers` calls in flight at once. Otherwise calls are made
+    directly on the worker threads.
+
+    Attributes:
+        callback (Callable): The consumer
+        maxQueue (int): Maximum number of calls waiting
+        overflow (str): One of "block", "drop-oldest" and "drop-newest"
+        workers (int): Number of worker threads
+        executor (Executor): Optional executor to run calls on
+    '''
+
+    def __init__(
+       self,
+       callback: Callable[..., Any],
+       maxQueue: int = 1024,
+       overflow: str = OVERFLOW_BLOCK,
+       workers: int = 1,
+       executor: Optional[Executor] = None) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+
+        if maxQueue < 1:
+            raise ValueError("maxQueue must be at least 1")
+
+        self._callback = callback
+        self._maxQueue = maxQueue
+        self._overflow = overflow
+        self._executor = executor
+        self._queue: Deque[Tuple[Any, ...]] = deque()
+        self._lock = threading.Lock()
+        self._notEmpty = threading.Condition(self._lock)
+        self._notFull = threading.Condition(self._lock)
+        self._closed = False
+
+        self._maxQueueDepth = 0
+        self._dropped = 0
+        self._dispatched = 0
+        self._errors = 0
+
+        self._threads: List[threading.Thread] = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def queueDepth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def maxQueueDepth(self) -> int:
+        return self._maxQueueDepth
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def dispatched(self) -> int:
+        return self._dispatched
+
+    @property
+    def errors(self) -> int:
+        return self._errors
+
+    def __call__(self, *args: Any) -> None:
+        self.submit(*args)
+
+    def submit(self, *args: Any) -> bool:
+        '''
+        Queue a call to the callback. Returns False if a call was dropped to
+        make room. Raises RuntimeError if the dispatcher is closed, including
+        while waiting for space.
+        '''
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Dispatcher is closed")
+
+            accepted = True
+
+            if len(self._queue) >= self._maxQueue:
+                if self._overflow == OVERFLOW_DROP_NEWEST:
+                    self._dropped += 1
+                    return False
+                elif self._overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                    accepted = False
+                else:
+                    while (len(self._queue) >= self._maxQueue) and (
+                       not self._closed):
+                        self._notFull.wait()
+
+                    if self._closed:
+                        raise RuntimeError("Dispatcher is closed")
+
+            self._queue.append(args)
+            self._maxQueueDepth = max(self._maxQueueDepth, len(self._queue))
+            self._notEmpty.notify()
+
+            return accepted
+
+    def close(self, wait: bool = True) -> None:
+        '''
+        Stop accepting calls. If wait is True, make the queued calls before
+        returning, otherwise discard them.
+        '''
+        with self._lock:
+            self._closed = True
+            if not wait:
+                self._dropped += len(self._queue)
+                self._queue.clear()
+            self._notEmpty.notify_all()
+            # Release producers blocked waiting for space
+            self._notFull.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while (len(self._queue) == 0) and not self._closed:
+                    self._notEmpty.wait()
+
+                if len(self._queue) == 0:
+                    return
+
+                args = self._queue.popleft()
+                self._notFull.notify()
+
+            try:
+                if self._executor is not None:
+                    self._executor.submit(self._callback, *args).result()
+                else:
+                    self._callback(*args)
+            except Exception:
+                logger.exception("Document callback failed")
+                with self._lock:
+                    self._errors += 1
+            finally:
+                with self._lock:
+                    self._dispatched += 1
+
+
+class DocumentQueue:
+    '''
+    A bounded queue of received documents for an asyncio consumer, read with
+    `async for` one at a time, or with getBatch() all at once.
+
+    Documents are put from the receive path, which can't wait for the
+    consumer, so when the queue is full the overflow policy drops either the
+    oldest queued document or the new one. Documents may be put from another
+    thread, such as one running TTMLReceiver.run(), and are passed to the
+    queue's event loop.
+
+    The queue belongs to the event loop running when it is created, so it
+    must be created from the coroutine, or at least the loop, that consumes
+    it. Creating it with no loop running raises RuntimeError.
+
+    Attributes:
+        maxQueue (int): Maximum number of documents waiting
+        overflow (str): One of "drop-oldest" and "drop-newest"
+    '''
+
+    def __init__(
+       self,
+       maxQueue: int = 1024,
+       overflow: str = OVERFLOW_DROP_OLDEST) -> None:
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("overflow must be one of {}, {}".format(
+                OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST))
+
+        if maxQueue < 1:
+            raise ValueError("maxQueue must be at least 1")
+
+        self._maxQueue = maxQueue
+        self._overflow = overflow
+        self._queue: Deque[Tuple[Any, ...]] = deque()
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        self._waiter: Optional[asyncio.Future] = None
+        self._closed = False
+
+        self._maxQueueDepth = 0
+        self._dropped = 0
+
+    @property
+    def queueDepth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def maxQueueDepth(self) -> int:
+        return self._maxQueueDepth
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, item: Tuple[Any, ...]) -> None:
+        if threading.get_ident() != self._thread:
+            self._loop.call_soon_threadsafe(self._put, item)
+        else:
+            self._put(item)
+
+    def _put(self, item: Tuple[Any, ...]) -> None:
+        if self._closed:
+            return
+
+        if len(self._queue) >= self._maxQueue:
+            self._dropped += 1
+            if self._overflow == OVERFLOW_DROP_NEWEST:
+                return
+            self._queue.popleft()
+
+        self._queue.append(item)
+        self._maxQueueDepth = max(self._maxQueueDepth, len(self._queue))
+        self._wake()
+
+    def _wake(self) -> None:
+        if (self._waiter is not None) and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self) -> None:
+        '''
+        Stop accepting documents. Those already queued can still be read.
+        '''
+        if threading.get_ident() != self._thread:
+            self._loop.call_soon_threadsafe(self.close)
+            return
+
+        self._closed = True
+        self._wake()
+
+    async def _wait(self) -> None:
+        while (len(self._queue) == 0) and not self._closed:
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    async def get(self) -> Tuple[Any, ...]:
+        '''
+        Wait for the next document. Raises StopAsyncIteration once the queue
+        is closed and empty.
+        '''
+        await self._wait()
+
+        if len(self._queue) == 0:
+            raise StopAsyncIteration
+
+        return self._queue.popleft()
+
+    async def getBatch(self) -> List[Tuple[Any, ...]]:
+        '''
+        Wait for a document, then return every document queued. Returns an
+        empty list once the queue is closed and empty.
+        '''
+        await self._wait()
+
+        batch = list(self._queue)
+        self._queue.clear()
+
+        return batch
+
+    def __aiter__(self) -> DocumentQueue:
+        return self
+
+    async def __anext__(self) -> Tuple[Any, ...]:
+        return await self.get()
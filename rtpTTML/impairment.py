@@ -0,0 +1,404 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Seeded network impairments (loss, burst loss, reordering, duplication and
+delay) for testing receivers without netem, either simulated in memory or
+applied by a UDP relay.
+"""
+
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from datetime import datetime, timedelta
+from random import Random
+from time import monotonic
+import heapq
+import socket
+import threading
+from .rtpView import RTPView
+from .ttmlReceiver import StreamID, TTMLStream
+from .ttmlTransmitter import TTMLTransmitter
+
+JITTER_DISTRIBUTIONS = ("uniform", "normal", "exponential")
+
+# Simulated documents are timestamped from here
+SIMULATION_EPOCH = datetime(2020, 1, 1)
+
+
+class Impairment:
+    '''
+    Applies seeded impairments to datagrams passing through it. Datagrams are
+    sent in with send() and come out of receive() once their delivery time
+    has passed.
+
+    Attributes:
+        loss (float): Probability of each datagram being dropped
+        burstLoss (float): Probability of a burst of losses starting at each
+            datagram
+        burstLength (float): Mean length of a loss burst in datagrams
+        reorder (float): Probability of a datagram being held back
+        reorderDepth (int): Datagrams sent before one held back is released
+        duplicate (float): Probability of a datagram being delivered twice
+        delay (float): Fixed delay in seconds
+        jitter (float): Scale of a random delay added to each datagram, in
+            seconds
+        jitterDistribution (str): One of "uniform", "normal" (jitter is the
+            standard deviation) and "exponential" (jitter is the mean)
+        seed (int): Seed for the random number generator
+    '''
+
+    def __init__(
+       self,
+       loss: float = 0.0,
+       burstLoss: float = 0.0,
+       burstLength: float = 1.0,
+       reorder: float = 0.0,
+       reorderDepth: int = 3,
+       duplicate: float = 0.0,
+       delay: float = 0.0,
+       jitter: float = 0.0,
+       jitterDistribution: str = "uniform",
+       seed: int = 0) -> None:
+        if jitterDistribution not in JITTER_DISTRIBUTIONS:
+            raise ValueError(
+                "jitterDistribution must be one of {}".format(
+                    ", ".join(JITTER_DISTRIBUTIONS)))
+
+        if burstLength < 1.0:
+            raise ValueError("burstLength must be at least 1")
+
+        self._loss = loss
+        self._burstLoss = burstLoss
+        self._burstLength = burstLength
+        self._reorder = reorder
+        self._reorderDepth = reorderDepth
+        self._duplicate = duplicate
+        self._delay = delay
+        self._jitter = jitter
+        self._jitterDistribution = jitterDistribution
+        self._random = Random(seed)
+
+        self._inBurst = False
+        # Heap of (delivery time, order sent, datagram)
+        self._queue: List[Tuple[float, int, bytes]] = []
+        # Held back datagrams as [datagrams until release, delivery time,
+        # datagram]
+        self._held: List[list] = []
+        self._order = 0
+
+        self.sent = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def __len__(self) -> int:
+        return len(self._queue) + len(self._held)
+
+    def _lost(self) -> bool:
+        # Gilbert model: a burst continues until it ends with probability
+        # 1/burstLength per datagram
+        if self._inBurst:
+            if self._random.random() < 1 / self._burstLength:
+                self._inBurst = False
+            return True
+
+        if (self._burstLoss > 0) and (self._random.random() < self._burstLoss):
+            self._inBurst = self._burstLength > 1
+            return True
+
+        return (self._loss > 0) and (self._random.random() < self._loss)
+
+    def _sampleDelay(self) -> float:
+        if self._jitter <= 0:
+            return self._delay
+
+        if self._jitterDistribution == "uniform":
+            jitter = self._random.uniform(0, self._jitter)
+        elif self._jitterDistribution == "normal":
+            jitter = abs(self._random.gauss(0, self._jitter))
+        else:
+            jitter = self._random.expovariate(1 / self._jitter)
+
+        return self._delay + jitter
+
+    def _enqueue(self, deliverAt: float, data: bytes) -> None:
+        heapq.heappush(self._queue, (deliverAt, self._order, data))
+        self._order += 1
+
+    def send(self, data: bytes, now: float) -> None:
+        self.sent += 1
+
+        if self._lost():
+            self.dropped += 1
+            return
+
+        deliverAt = now + self._sampleDelay()
+
+        # Release datagrams held back for long enough, after this one
+        released = []
+        for held in self._held:
+            held[0] -= 1
+            if held[0] <= 0:
+                released.append(held)
+        self._held = [held for held in self._held if held[0] > 0]
+
+        if (self._reorder > 0) and (self._random.random() < self._reorder):
+            self.reordered += 1
+            self._held.append([self._reorderDepth, deliverAt, data])
+        else:
+            self._enqueue(deliverAt, data)
+
+        for _, heldDeliverAt, heldData in released:
+            self._enqueue(max(heldDeliverAt, deliverAt), heldData)
+
+        if (self._duplicate > 0) and (self._random.random() < self._duplicate):
+            self.duplicated += 1
+            self._enqueue(now + self._sampleDelay(), data)
+
+    def flush(self, now: float) -> None:
+        '''
+        Release any datagrams still held back, as if enough had followed them.
+        '''
+        for _, deliverAt, data in self._held:
+            self._enqueue(max(deliverAt, now), data)
+        self._held.clear()
+
+    def nextDelivery(self) -> Optional[float]:
+        if len(self._queue) == 0:
+            return None
+
+        return self._queue[0][0]
+
+    def receive(self, now: float) -> List[bytes]:
+        '''
+        Return the datagrams due for delivery by `now`, in delivery order.
+        '''
+        delivered = []
+        while (len(self._queue) > 0) and (self._queue[0][0] <= now):
+            delivered.append(heapq.heappop(self._queue)[2])
+
+        return delivered
+
+
+class ImpairmentReport(NamedTuple):
+    '''
+    The outcome of sending documents through an Impairment. Latencies are
+    seconds from a document being sent to it being completed.
+    '''
+    docsSent: int
+    docsCompleted: int
+    docsCorrupt: int
+    completionRate: float
+    latencyMean: float
+    latencyP99: float
+    latencyMax: float
+    packetsSent: int
+    packetsDropped: int
+    packetsDuplicated: int
+    packetsReordered: int
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if len(ordered) == 0:
+        return 0.0
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def simulate(
+       docs: Sequence[str],
+       impairment: Impairment,
+       transmitter: Optional[TTMLTransmitter] = None,
+       interval: float = 0.04,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       adaptiveReorder: bool = False,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None) -> ImpairmentReport:
+    '''
+    Send `docs` through `impairment` to the per-stream reassembly used by
+    TTMLReceiver, one every `interval` seconds on a simulated clock. The
+    result depends only on the arguments, so can be used in regression
+    tests.
+
+    The remaining arguments are as for TTMLReceiver.
+    '''
+    if transmitter is None:
+        transmitter = TTMLTransmitter("", 0)
+
+    stream = TTMLStream(
+        StreamID(None, None), transmitter._encoding, transmitter._bom,
+        reorderDepth, maxHold, adaptiveReorder, docTimeout, maxDocSize)
+
+    sent: Dict[int, Tuple[float, str]] = {}
+    latencies: List[float] = []
+    corrupt = [0]
+
+    def complete(completed: List[Tuple[str, int]], now: float) -> None:
+        for doc, timestamp in completed:
+            sentAt, sentDoc = sent[timestamp]
+            if doc != sentDoc:
+                corrupt[0] += 1
+                continue
+
+            latencies.append(now - sentAt)
+            # Count repeats of a document once
+            sent[timestamp] = (sentAt, "")
+
+    def runUntil(until: float) -> None:
+        while True:
+            delivery = impairment.nextDelivery()
+            deadline = stream.deadline
+
+            if (deadline is not None) and (
+               (delivery is None) or (deadline < delivery)):
+                if deadline > until:
+                    return
+                complete(stream.expire(deadline), deadline)
+                continue
+
+            if (delivery is None) or (delivery > until):
+                return
+
+            for data in impairment.receive(delivery):
+                packet = RTPView(data)
+                complete(stream.processPacket(packet, delivery), delivery)
+
+    now = 0.0
+    for x in range(len(docs)):
+        now = x * interval
+        runUntil(now)
+
+        time = SIMULATION_EPOCH + timedelta(seconds=now)
+        sent[transmitter._datetimeToRTPTs(time)] = (now, docs[x])
+        for packet in transmitter._packetiseDocBuffer(docs[x], time):
+            impairment.send(bytes(packet), now)
+
+    impairment.flush(now)
+    runUntil(float("inf"))
+
+    latencies.sort()
+
+    return ImpairmentReport(
+        docsSent=len(docs),
+        docsCompleted=len(latencies),
+        docsCorrupt=corrupt[0],
+        completionRate=len(latencies) / max(len(docs), 1),
+        latencyMean=sum(latencies) / max(len(latencies), 1),
+        latencyP99=_percentile(latencies, 0.99),
+        latencyMax=_percentile(latencies, 1.0),
+        packetsSent=impairment.sent,
+        packetsDropped=impairment.dropped,
+        packetsDuplicated=impairment.duplicated,
+        packetsReordered=impairment.reordered)
+
+
+class ImpairmentRelay:
+    '''
+    A UDP relay that applies an Impairment to datagrams in real time, from a
+    background thread. Point a TTMLTransmitter at the relay's port, and the
+    relay at a TTMLReceiver.
+
+        with ImpairmentRelay(("127.0.0.1", 12345), Impairment(loss=0.01)):
+            ...
+
+    Attributes:
+        destination (Tuple[str, int]): Address to relay datagrams to
+        impairment (Impairment): Impairments to apply
+        port (int): Port to listen on. 0 binds an ephemeral port
+        address (str): Address to listen on
+        idleFlush (float): Seconds without a datagram after which held back
+            datagrams are released
+    '''
+
+    def __init__(
+       self,
+       destination: Tuple[str, int],
+       impairment: Impairment,
+       port: int = 0,
+       address: str = "127.0.0.1",
+       idleFlush: float = 0.1) -> None:
+        self._destination = destination
+        self._impairment = impairment
+        self._address = address
+        self._port = port
+        self._idleFlush = idleFlush
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def port(self) -> int:
+        if self._socket is not None:
+            return self._socket.getsockname()[1]
+
+        return self._port
+
+    @property
+    def impairment(self) -> Impairment:
+        return self._impairment
+
+    def _run(self, sock: socket.socket) -> None:
+        impairment = self._impairment
+        lastReceived = monotonic()
+
+        while self._running:
+            now = monotonic()
+            for data in impairment.receive(now):
+                sock.sendto(data, self._destination)
+
+            if (now - lastReceived) >= self._idleFlush:
+                impairment.flush(now)
+
+            wait = self._idleFlush
+            delivery = impairment.nextDelivery()
+            if delivery is not None:
+                wait = min(wait, delivery - now)
+            sock.settimeout(max(wait, 1e-4))
+
+            try:
+                data = sock.recv(2**16)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            lastReceived = monotonic()
+            impairment.send(data, lastReceived)
+
+    def start(self) -> None:
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((self._address, self._port))
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, args=(self._socket,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self) -> ImpairmentRelay:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
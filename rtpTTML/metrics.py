@@ -0,0 +1,292 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Counters and histograms for monitoring transmitters and receivers, with an
+optional Prometheus exporter.
+"""
+
+from __future__ import annotations
+from typing import (
+    AbstractSet, Callable, Dict, List, Mapping, NamedTuple, Optional,
+    Sequence, Tuple, Union)
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+FRAGMENT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+LATENCY_BUCKETS = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Snapshot values that are current levels rather than running totals
+GAUGES = frozenset(("streams",))
+
+
+class HistogramSnapshot(NamedTuple):
+    '''
+    The state of a Histogram. counts has one more entry than bounds, for
+    values above the last bound.
+    '''
+    bounds: Tuple[float, ...]
+    counts: Tuple[int, ...]
+    sum: float
+    samples: int
+
+
+Snapshot = Dict[str, Union[int, float, HistogramSnapshot]]
+
+
+class Histogram:
+    '''
+    Counts observed values into fixed buckets.
+
+    Attributes:
+        bounds (Sequence[float]): Upper bounds of the buckets, inclusive
+    '''
+
+    __slots__ = ("_bounds", "_counts", "_sum", "_count")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self._bounds = tuple(sorted(bounds))
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def merge(self, other: HistogramSnapshot) -> None:
+        '''
+        Add the counts of another histogram with the same bounds, such as one
+        from another process.
+        '''
+        if tuple(other.bounds) != self._bounds:
+            raise ValueError("Histogram bounds differ")
+
+        for index, count in enumerate(other.counts):
+            self._counts[index] += count
+        self._sum += other.sum
+        self._count += other.samples
+
+    def snapshot(self) -> HistogramSnapshot:
+        return HistogramSnapshot(
+            self._bounds, tuple(self._counts), self._sum, self._count)
+
+
+class ReceiverMetrics:
+    '''
+    Receive-side counters updated on the hot path. Counts kept per stream,
+    such as loss and reordering, are added when a receiver is snapshotted.
+
+    Attributes:
+        packets (int): Datagrams received
+        bytes (int): Bytes received
+        docs (int): Documents completed
+        fragmentsPerDoc (Histogram): Fragments in each completed document
+        reassemblyLatency (Histogram): Seconds from the first fragment of a
+            document being processed to its completion
+    '''
+
+    __slots__ = (
+        "packets", "bytes", "docs", "fragmentsPerDoc", "reassemblyLatency")
+
+    def __init__(self) -> None:
+        self.packets = 0
+        self.bytes = 0
+        self.docs = 0
+        self.fragmentsPerDoc = Histogram(FRAGMENT_BUCKETS)
+        self.reassemblyLatency = Histogram(LATENCY_BUCKETS)
+
+    def observeDocument(self, fragments: int, latency: float) -> None:
+        self.docs += 1
+        self.fragmentsPerDoc.observe(fragments)
+        self.reassemblyLatency.observe(latency)
+
+    def snapshot(self) -> Snapshot:
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "docs": self.docs,
+            "fragmentsPerDoc": self.fragmentsPerDoc.snapshot(),
+            "reassemblyLatency": self.reassemblyLatency.snapshot()}
+
+
+class TransmitterMetrics:
+    '''
+    Transmit-side counters.
+
+    Attributes:
+        packets (int): Packets generated
+        bytes (int): Bytes generated, including headers
+        docs (int): Documents packetised
+        fragmentsPerDoc (Histogram): Fragments in each document
+        docBytes (Histogram): Encoded size of each document
+    '''
+
+    __slots__ = ("packets", "bytes", "docs", "fragmentsPerDoc", "docBytes")
+
+    def __init__(self) -> None:
+        self.packets = 0
+        self.bytes = 0
+        self.docs = 0
+        self.fragmentsPerDoc = Histogram(FRAGMENT_BUCKETS)
+        self.docBytes = Histogram(SIZE_BUCKETS)
+
+    def observeDocument(
+       self, packets: int, packetBytes: int, docBytes: int) -> None:
+        self.docs += 1
+        self.packets += packets
+        self.bytes += packetBytes
+        self.fragmentsPerDoc.observe(packets)
+        self.docBytes.observe(docBytes)
+
+    def snapshot(self) -> Snapshot:
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "docs": self.docs,
+            "fragmentsPerDoc": self.fragmentsPerDoc.snapshot(),
+            "docBytes": self.docBytes.snapshot()}
+
+
+def _formatValue(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(value)
+
+
+def formatPrometheus(
+       sources: Mapping[str, Callable[[], Snapshot]],
+       prefix: str = "rtpttml",
+       gauges: AbstractSet[str] = GAUGES) -> str:
+    '''
+    Format snapshots in the Prometheus text exposition format. Each source is
+    a function returning a snapshot, and its name is given as the `source`
+    label. Plain values are exported as counters, with a `_total` suffix,
+    unless their key is in `gauges`.
+    '''
+    families: Dict[str, Tuple[str, List[str]]] = {}
+
+    for sourceName, source in sources.items():
+        label = 'source="{}"'.format(sourceName)
+
+        for key, value in source().items():
+            name = "{}_{}".format(prefix, key)
+
+            if isinstance(value, HistogramSnapshot):
+                _, lines = families.setdefault(name, ("histogram", []))
+                cumulative = 0
+                for bound, count in zip(
+                   value.bounds + (float("inf"),), value.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, label, _formatValue(bound), cumulative))
+                lines.append("{}_sum{{{}}} {}".format(
+                    name, label, _formatValue(value.sum)))
+                lines.append("{}_count{{{}}} {}".format(
+                    name, label, value.samples))
+            else:
+                if key in gauges:
+                    metricType = "gauge"
+                else:
+                    metricType = "counter"
+                    name += "_total"
+                _, lines = families.setdefault(name, (metricType, []))
+                lines.append("{}{{{}}} {}".format(
+                    name, label, _formatValue(value)))
+
+    output = []
+    for name, (metricType, lines) in families.items():
+        output.append("# TYPE {} {}".format(name, metricType))
+        output.extend(lines)
+
+    return "\n".join(output) + "\n"
+
+
+class MetricsExporter:
+    '''
+    Serves snapshots in the Prometheus text format over HTTP, from a
+    background thread.
+
+        exporter = MetricsExporter({"rx": receiver.metricsSnapshot}, 9100)
+        exporter.start()
+
+    Attributes:
+        sources (Mapping[str, Callable]): Functions returning snapshots, by
+            source name
+        port (int): Port to listen on. 0 binds an ephemeral port
+        address (str): Address to listen on
+        gauges (AbstractSet[str]): Snapshot keys to export as gauges rather
+            than counters
+    '''
+
+    def __init__(
+       self,
+       sources: Mapping[str, Callable[[], Snapshot]],
+       port: int = 9100,
+       address: str = "127.0.0.1",
+       gauges: AbstractSet[str] = GAUGES) -> None:
+        self._sources = dict(sources)
+        self._gauges = gauges
+        self._address = address
+        self._port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        if self._server is not None:
+            return self._server.server_address[1]
+
+        return self._port
+
+    def start(self) -> None:
+        sources = self._sources
+        gauges = self._gauges
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = formatPrometheus(
+                    sources, gauges=gauges).encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((self._address, self._port), Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> MetricsExporter:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
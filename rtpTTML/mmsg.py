@@ -0,0 +1,292 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Batched datagram transmission and reception using the Linux sendmmsg and
+recvmmsg syscalls via ctypes.
+"""
+
+from __future__ import annotations
+from typing import Callable, List, Optional, Sequence, Tuple
+import ctypes
+import errno
+import os
+import select
+import socket
+import sys
+
+# Linux limits the number of messages per call to UIO_MAXIOV
+MAX_BATCH = 1024
+
+# Block for the first datagram only
+MSG_WAITFORONE = 0x10000
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint8 * 2),  # Network byte order
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+def _loadMMsgFunc(name: str) -> Optional[Callable[..., int]]:
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+
+    func.restype = ctypes.c_int
+
+    return func
+
+
+_sendmmsg = _loadMMsgFunc("sendmmsg")
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [  # type: ignore
+        ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+
+_recvmmsg = _loadMMsgFunc("recvmmsg")
+if _recvmmsg is not None:
+    _recvmmsg.argtypes = [  # type: ignore
+        ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int,
+        ctypes.c_void_p]
+
+
+def sendmmsgAvailable() -> bool:
+    return _sendmmsg is not None
+
+
+def recvmmsgAvailable() -> bool:
+    return _recvmmsg is not None
+
+
+class MMsgSender:
+    '''
+    Sends many datagrams from a single buffer to one IPv4 destination with as
+    few sendmmsg calls as possible.
+
+    Attributes:
+        sock (socket.socket): An AF_INET datagram socket
+        address (Tuple[str, int]): The destination address and port
+    '''
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int]) -> None:
+        if _sendmmsg is None:
+            raise OSError(
+                errno.ENOSYS, "sendmmsg is not available on this platform")
+
+        self._sock = sock
+        self._sockAddr = _SockAddrIn()
+        self._msgs = (_MMsgHdr * 0)()
+        self._iovecs = (_IOVec * 0)()
+        self.address = address
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._address
+
+    @address.setter
+    def address(self, address: Tuple[str, int]) -> None:
+        host, port = address
+        self._sockAddr.sin_family = socket.AF_INET
+        self._sockAddr.sin_port[:] = port.to_bytes(2, byteorder='big')
+        self._sockAddr.sin_addr[:] = socket.inet_aton(
+            socket.gethostbyname(host))
+        self._address = address
+
+    def _reserve(self, count: int) -> None:
+        if len(self._msgs) >= count:
+            return
+
+        self._msgs = (_MMsgHdr * count)()
+        self._iovecs = (_IOVec * count)()
+        nameAddr = ctypes.addressof(self._sockAddr)
+
+        for x in range(count):
+            hdr = self._msgs[x].msg_hdr
+            hdr.msg_name = nameAddr
+            hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[x])
+            hdr.msg_iovlen = 1
+
+    def send(
+       self, buffer: bytearray, packets: Sequence[Tuple[int, int]]) -> int:
+        '''
+        Send each (offset, length) slice of `buffer` as a datagram, and
+        return the number of syscalls made.
+        '''
+        assert _sendmmsg is not None
+
+        if len(packets) == 0:
+            return 0
+
+        batchLen = min(len(packets), MAX_BATCH)
+        self._reserve(batchLen)
+
+        # Holds an export of the buffer for the duration of the sends
+        bufferObj = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+        baseAddr = ctypes.addressof(bufferObj)
+        fd = self._sock.fileno()
+        calls = 0
+        sent = 0
+
+        try:
+            while sent < len(packets):
+                thisBatch = packets[sent:sent+batchLen]
+                for x in range(len(thisBatch)):
+                    offset, length = thisBatch[x]
+                    self._iovecs[x].iov_base = baseAddr + offset
+                    self._iovecs[x].iov_len = length
+
+                ret = _sendmmsg(fd, self._msgs, len(thisBatch), 0)
+                calls += 1
+
+                if ret < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    raise OSError(err, os.strerror(err))
+
+                sent += ret
+        finally:
+            del bufferObj
+
+        return calls
+
+
+class MMsgReceiver:
+    '''
+    Receives up to `batchSize` datagrams per recvmmsg call into a
+    preallocated pool of buffers.
+
+    Honours the socket's timeout, raising socket.timeout if no datagram
+    arrives in time.
+
+    Attributes:
+        sock (socket.socket): A bound datagram socket
+        batchSize (int): Maximum datagrams received per call
+        bufSize (int): Size of each buffer in the pool
+    '''
+
+    def __init__(
+       self, sock: socket.socket, batchSize: int = 32,
+       bufSize: int = 2**16) -> None:
+        if _recvmmsg is None:
+            raise OSError(
+                errno.ENOSYS, "recvmmsg is not available on this platform")
+
+        self._sock = sock
+        self._batchSize = min(batchSize, MAX_BATCH)
+        self._bufSize = bufSize
+        self._pool = bytearray(self._batchSize * bufSize)
+        self._poolView = memoryview(self._pool)
+        self._poolObj = (ctypes.c_char * len(self._pool)).from_buffer(
+            self._pool)
+        self._msgs = (_MMsgHdr * self._batchSize)()
+        self._iovecs = (_IOVec * self._batchSize)()
+        self._names = (_SockAddrIn * self._batchSize)()
+        self._syscalls = 0
+
+        baseAddr = ctypes.addressof(self._poolObj)
+        for x in range(self._batchSize):
+            self._iovecs[x].iov_base = baseAddr + (x * bufSize)
+            self._iovecs[x].iov_len = bufSize
+            hdr = self._msgs[x].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._names[x])
+            hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[x])
+            hdr.msg_iovlen = 1
+
+    @property
+    def syscalls(self) -> int:
+        return self._syscalls
+
+    def recv(self) -> List[memoryview]:
+        '''
+        Wait for at least one datagram, and return all of the datagrams that
+        are ready, up to batchSize. The returned views are only valid until
+        the next call.
+        '''
+        count = self._recvmmsg()
+
+        return [
+            self._poolView[
+                x * self._bufSize:(x * self._bufSize) + self._msgs[x].msg_len]
+            for x in range(count)]
+
+    def recvFrom(self) -> List[Tuple[memoryview, Tuple[str, int]]]:
+        '''
+        As recv, but also return the source address of each datagram.
+        '''
+        datagrams = self.recv()
+        addrs = []
+
+        for x in range(len(datagrams)):
+            name = self._names[x]
+            addrs.append((
+                socket.inet_ntoa(bytes(name.sin_addr)),
+                int.from_bytes(bytes(name.sin_port), byteorder='big')))
+
+        return list(zip(datagrams, addrs))
+
+    def _recvmmsg(self) -> int:
+        assert _recvmmsg is not None
+        fd = self._sock.fileno()
+        timeout = self._sock.gettimeout()
+
+        while True:
+            # Python sockets with a timeout are non-blocking, so wait first
+            if timeout is not None:
+                readable, _, _ = select.select([fd], [], [], timeout)
+                if len(readable) == 0:
+                    raise socket.timeout("timed out")
+
+            ret = _recvmmsg(
+                fd, self._msgs, self._batchSize, MSG_WAITFORONE, None)
+            self._syscalls += 1
+
+            if ret >= 0:
+                return ret
+
+            err = ctypes.get_errno()
+            if err not in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
+                raise OSError(err, os.strerror(err))
@@ -0,0 +1,221 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Token bucket pacing of outgoing packets for asyncio transports.
+"""
+
+from __future__ import annotations
+from typing import Callable, Deque, Iterable, Optional, Tuple
+from collections import deque
+import asyncio
+
+
+class TokenBucket:
+    '''
+    A token bucket. Tokens accrue at `rate` per second up to `capacity`.
+
+    A cost larger than the capacity is allowed once the bucket is full, and
+    leaves the bucket in debt, so that the long term rate is still `rate`.
+
+    Attributes:
+        rate (float): Tokens added per second
+        capacity (float): Maximum number of tokens held
+    '''
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._lastUpdate = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._lastUpdate, 0.0)
+        self._tokens = min(self._tokens + (elapsed * self.rate), self.capacity)
+        self._lastUpdate = now
+
+    def delay(self, cost: float, now: float) -> float:
+        '''
+        Return the time in seconds until `cost` tokens can be taken.
+        '''
+        self._refill(now)
+        needed = min(cost, self.capacity)
+
+        if self._tokens >= needed:
+            return 0.0
+
+        return (needed - self._tokens) / self.rate
+
+    def take(self, cost: float, now: float) -> None:
+        self._refill(now)
+        self._tokens -= cost
+
+
+class PacedSender:
+    '''
+    Queues packets and sends them on a datagram transport no faster than a
+    token bucket allows, without blocking the event loop.
+
+    Exactly one of bitRate and packetGap must be given.
+
+    If sending fails, the pacer stops, discards the packets still queued, and
+    the error is raised from the next call to enqueue() or drain().
+
+    Attributes:
+        transport (asyncio.DatagramTransport): The transport to send on
+        bitRate (float): Maximum send rate in bits per second
+        packetGap (float): Minimum time in seconds between packets
+        maxPacketSize (int): Largest expected packet in bytes. Sets the
+            bucket depth in bit rate mode.
+    '''
+
+    def __init__(
+       self,
+       transport: asyncio.DatagramTransport,
+       bitRate: Optional[float] = None,
+       packetGap: Optional[float] = None,
+       maxPacketSize: int = 1500) -> None:
+        if (bitRate is None) == (packetGap is None):
+            raise ValueError("Exactly one of bitRate and packetGap required")
+
+        if (bitRate is not None) and (bitRate <= 0):
+            raise ValueError("bitRate must be greater than 0")
+
+        if (packetGap is not None) and (packetGap <= 0):
+            raise ValueError("packetGap must be greater than 0")
+
+        if maxPacketSize < 1:
+            raise ValueError("maxPacketSize must be at least 1")
+
+        self._loop = asyncio.get_event_loop()
+        self._transport = transport
+        self._cost: Callable[[bytes], float]
+
+        if bitRate is not None:
+            self._bucket = TokenBucket(
+                bitRate, maxPacketSize * 8, self._loop.time())
+            self._cost = lambda packet: len(packet) * 8
+        else:
+            assert packetGap is not None
+            self._bucket = TokenBucket(1 / packetGap, 1, self._loop.time())
+            self._cost = lambda packet: 1
+
+        self._queue: Deque[Tuple[bytes, float]] = deque()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._error: Optional[Exception] = None
+
+        self._packetsSent = 0
+        self._maxQueueDepth = 0
+        self._pacingDelay = 0.0
+        self._maxPacingDelay = 0.0
+
+        self._task: Optional[asyncio.Task] = self._loop.create_task(
+            self._run())
+
+    @property
+    def queueDepth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def maxQueueDepth(self) -> int:
+        return self._maxQueueDepth
+
+    @property
+    def packetsSent(self) -> int:
+        return self._packetsSent
+
+    @property
+    def pacingDelay(self) -> float:
+        '''Total time in seconds that sent packets spent queued'''
+        return self._pacingDelay
+
+    @property
+    def maxPacingDelay(self) -> float:
+        return self._maxPacingDelay
+
+    def _raiseError(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Paced sending failed") from self._error
+
+    def enqueue(self, packets: Iterable[memoryview]) -> None:
+        self._raiseError()
+        now = self._loop.time()
+
+        # Copy out of the transmitter's reusable buffer
+        self._queue.extend((bytes(packet), now) for packet in packets)
+        self._maxQueueDepth = max(self._maxQueueDepth, len(self._queue))
+
+        if len(self._queue) > 0:
+            self._idle.clear()
+            self._wakeup.set()
+
+    async def drain(self) -> None:
+        '''
+        Wait until every queued packet has been sent.
+        '''
+        await self._idle.wait()
+        self._raiseError()
+
+    async def close(self) -> None:
+        try:
+            await self.drain()
+        finally:
+            if self._task is not None:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await self._sendQueued()
+        except Exception as e:
+            self._error = e
+            self._queue.clear()
+            self._idle.set()
+
+    async def _sendQueued(self) -> None:
+        while True:
+            if len(self._queue) == 0:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            packet, enqueuedAt = self._queue[0]
+            cost = self._cost(packet)
+
+            wait = self._bucket.delay(cost, self._loop.time())
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            now = self._loop.time()
+            self._bucket.take(cost, now)
+            self._queue.popleft()
+            self._transport.sendto(packet)
+
+            delay = now - enqueuedAt
+            self._packetsSent += 1
+            self._pacingDelay += delay
+            self._maxPacingDelay = max(self._maxPacingDelay, delay)
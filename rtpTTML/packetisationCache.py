@@ -0,0 +1,104 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Hashable, List, Optional, Tuple
+from collections import OrderedDict
+
+CacheEntry = Tuple[bytes, List[Tuple[int, int]]]
+
+
+class PacketisationCache:
+    '''
+    A least recently used cache of packetised documents, holding each
+    document's encoded payloads and their (offset, length) layout.
+
+    It is bounded both by number of entries and by the number of bytes held,
+    counting each entry's payloads and the size its key was given as. Entries
+    larger than maxBytes are never cached.
+
+    Attributes:
+        maxEntries (int): Maximum number of documents held
+        maxBytes (int): Maximum total size of the cached payloads and keys
+    '''
+
+    def __init__(self, maxEntries: int = 64, maxBytes: int = 2**22) -> None:
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        # Entries with their size in bytes
+        self._entries: OrderedDict[
+            Hashable, Tuple[CacheEntry, int]] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def cachedBytes(self) -> int:
+        return self._bytes
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def evictions(self) -> int:
+        return self._evictions
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        held = self._entries.get(key)
+
+        if held is None:
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+
+        return held[0]
+
+    def put(
+       self, key: Hashable, data: bytes, offsets: List[Tuple[int, int]],
+       keySize: int = 0) -> None:
+        '''
+        Cache `data` and its layout under `key`. keySize is the memory held by
+        the key, such as the document it contains, in bytes.
+        '''
+        size = len(data) + keySize
+        if (size > self.maxBytes) or (self.maxEntries < 1):
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+
+        self._entries[key] = ((data, offsets), size)
+        self._bytes += size
+
+        while (len(self._entries) > self.maxEntries) or (
+           self._bytes > self.maxBytes):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self._evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
@@ -0,0 +1,301 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Recording received datagrams to rtpdump files.
+"""
+
+from __future__ import annotations
+from typing import BinaryIO, List, Optional, Tuple, Union
+from datetime import datetime, timezone
+from time import monotonic, time
+import logging
+import os
+import socket
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+RTPDUMP_MAGIC = b"#!rtpplay1.0 "
+# Length including this header, packet length, and milliseconds since the
+# start of the file
+RTPDUMP_RECORD = struct.Struct("!HHI")
+# Longest time from the start of a file that a record can hold, in seconds
+MAX_RECORD_OFFSET = 0xffffffff / 1000
+# Start seconds and microseconds, source address and port, padding
+RTPDUMP_HEADER = struct.Struct("!IIIHH")
+
+
+class _Segment:
+    # Records for one file, built up on the receive path. Records are timed
+    # from `clock`, and the file is stamped with `start`.
+    __slots__ = ("start", "clock", "source", "data", "size")
+
+    def __init__(
+       self, start: float, clock: float, source: Tuple[str, int]) -> None:
+        self.start = start
+        self.clock = clock
+        self.source = source
+        self.data = bytearray()
+        # Bytes recorded to the file so far, including those already written
+        self.size = 0
+
+
+class RTPDumpRecorder:
+    '''
+    Records datagrams to rtpdump files, as written by rtpdump -F dump and read
+    by rtpplay and rtpTTML.capture. Pass it to a TTMLReceiver as `recorder`.
+
+    record() only appends to an in-memory buffer. Files are written from a
+    background thread, every flushInterval seconds or once bufferSize bytes
+    are waiting. If more than maxBuffered bytes are waiting, because writing
+    has fallen behind, further datagrams are dropped and counted.
+
+    If maxBytes or maxSeconds are set, a new file is started when the current
+    one would exceed that size or duration. A new file is also started
+    before records would be too far from the start of the file for their
+    offset to be recorded, after about 49 days. Rotated files are named after
+    `path` with the index and start time of each file added.
+
+    Failures to record datagrams, or to open or write files, are logged and
+    counted in `errors`, and the records involved are lost. They are never
+    raised to the receive path. A file that can't be opened is tried again
+    on the next write.
+
+    Attributes:
+        path (str): File to write
+        address (Tuple[str, int]): Address recorded in the file header as
+            the one listened on
+        maxBytes (int): Size at which to start a new file
+        maxSeconds (float): Duration at which to start a new file
+        bufferSize (int): Bytes waiting at which to write them
+        flushInterval (float): Seconds between writes
+        maxBuffered (int): Bytes waiting beyond which datagrams are dropped
+    '''
+
+    def __init__(
+       self,
+       path: str,
+       address: Tuple[str, int] = ("0.0.0.0", 0),
+       maxBytes: Optional[int] = None,
+       maxSeconds: Optional[float] = None,
+       bufferSize: int = 2**20,
+       flushInterval: float = 1.0,
+       maxBuffered: int = 2**26) -> None:
+        self._path = path
+        self._address = address
+        self._maxBytes = maxBytes
+        self._maxSeconds = maxSeconds
+        self._bufferSize = bufferSize
+        self._flushInterval = flushInterval
+        self._maxBuffered = maxBuffered
+
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._segments: List[_Segment] = []
+        self._buffered = 0
+        self._running = True
+
+        # Only used from the writer thread
+        self._file: Optional[BinaryIO] = None
+        self._fileSegment: Optional[_Segment] = None
+        self._index = 0
+        self.files: List[str] = []
+
+        self.recorded = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> RTPDumpRecorder:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record(
+       self,
+       data: Union[bytes, bytearray, memoryview],
+       addr: Optional[Tuple[str, int]] = None,
+       now: Optional[float] = None) -> None:
+        '''
+        Record a datagram that arrived at `now`, in seconds since the epoch.
+
+        By default, files are stamped with the current time and records are
+        timed by the monotonic clock, so that steps in the system clock
+        don't disturb them. A `now` given is used for both.
+        '''
+        with self._lock:
+            try:
+                self._record(data, addr, now)
+            except Exception:
+                self.errors += 1
+                logger.exception("Failed to record datagram")
+
+    def _record(
+       self,
+       data: Union[bytes, bytearray, memoryview],
+       addr: Optional[Tuple[str, int]],
+       now: Optional[float]) -> None:
+        # Called with the lock held
+        clock = monotonic() if now is None else now
+        length = len(data)
+        recordLen = RTPDUMP_RECORD.size + length
+
+        # Record lengths are 16 bits
+        if (not self._running) or (recordLen > 0xffff) or (
+           self._buffered + recordLen > self._maxBuffered):
+            self.dropped += 1
+            return
+
+        segment = self._segments[-1] if self._segments else None
+        if (segment is None) or self._rotate(segment, clock, recordLen):
+            segment = _Segment(
+                time() if now is None else now, clock,
+                addr or ("0.0.0.0", 0))
+            self._segments.append(segment)
+
+        # A clock that goes backwards repeats the previous offset
+        offset = max(0, int(1000 * (clock - segment.clock)))
+
+        segment.data += RTPDUMP_RECORD.pack(recordLen, length, offset)
+        segment.data += data
+        segment.size += recordLen
+        self._buffered += recordLen
+        self.recorded += 1
+
+        if self._buffered >= self._bufferSize:
+            self._wake.notify()
+
+    def _rotate(
+       self, segment: _Segment, clock: float, recordLen: int) -> bool:
+        if (self._maxBytes is not None) and (segment.size > 0) and (
+           segment.size + recordLen > self._maxBytes):
+            return True
+
+        elapsed = clock - segment.clock
+        if elapsed >= MAX_RECORD_OFFSET:
+            return True
+
+        return (self._maxSeconds is not None) and (
+            elapsed >= self._maxSeconds)
+
+    def _filename(self, start: float) -> str:
+        # Without rotation, only files after the first need telling apart
+        if (self._maxBytes is None) and (self._maxSeconds is None) and (
+           self._index == 0):
+            return self._path
+
+        root, ext = os.path.splitext(self._path)
+        stamp = datetime.fromtimestamp(start, timezone.utc).strftime(
+            "%Y%m%dT%H%M%SZ")
+
+        return "{}-{:04d}-{}{}".format(root, self._index, stamp, ext)
+
+    def _openFile(self, segment: _Segment) -> BinaryIO:
+        path = self._filename(segment.start)
+        recordFile = open(path, "wb")
+        self._index += 1
+        self.files.append(path)
+
+        recordFile.write(RTPDUMP_MAGIC + "{}/{}\n".format(
+            *self._address).encode("ascii"))
+
+        try:
+            source = struct.unpack(
+                "!I", socket.inet_aton(segment.source[0]))[0]
+        except OSError:
+            # IPv6 sources can't be recorded in the header
+            source = 0
+
+        recordFile.write(RTPDUMP_HEADER.pack(
+            int(segment.start), int(1e6 * (segment.start % 1)), source,
+            segment.source[1], 0))
+
+        return recordFile
+
+    def _closeFile(self) -> None:
+        # Forgotten first, so a failed close can't leave it in use
+        recordFile, self._file = self._file, None
+        if recordFile is not None:
+            recordFile.close()
+
+    def _write(self, segments: List[Tuple[_Segment, bytearray]]) -> None:
+        for segment, data in segments:
+            try:
+                if (self._file is None) or (self._fileSegment is not segment):
+                    self._closeFile()
+                    self._file = self._openFile(segment)
+                    self._fileSegment = segment
+
+                self._file.write(data)
+            except (OSError, ValueError):
+                self.errors += 1
+                logger.exception("Failed to write rtpdump records")
+
+        try:
+            if self._file is not None:
+                self._file.flush()
+        except (OSError, ValueError):
+            self.errors += 1
+            logger.exception("Failed to write rtpdump records")
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if self._running and (self._buffered < self._bufferSize):
+                    self._wake.wait(self._flushInterval)
+
+                # Take the waiting records, leaving the current segment to
+                # be added to
+                segments = []
+                for segment in self._segments:
+                    segments.append((segment, segment.data))
+                    segment.data = bytearray()
+                del self._segments[:-1]
+                self._buffered = 0
+                running = self._running
+
+            self._write(segments)
+
+            if not running:
+                break
+
+        try:
+            self._closeFile()
+        except OSError:
+            self.errors += 1
+            logger.exception("Failed to close rtpdump file")
+
+    def flush(self) -> None:
+        '''
+        Wake the writer thread to write waiting records now.
+        '''
+        with self._lock:
+            self._wake.notify()
+
+    def close(self) -> None:
+        '''
+        Write any waiting records and close the file.
+        '''
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._wake.notify()
+
+        self._thread.join()
@@ -0,0 +1,86 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Union
+from rtp import RTP
+from .ttmlTransmitter import RTP_HEADER, RTP_HEADER_LEN, RTP_VERSION
+
+# Either sort of packet can be reassembled
+Packet = Union[RTP, "RTPView"]
+
+
+class RTPView:
+    '''
+    The fields of an RTP packet needed for reassembly, parsed in place with
+    the payload as a view onto the datagram rather than a copy.
+
+    The view keeps the datagram's buffer alive, so the buffer must not be
+    written to while the packet is in use.
+
+    Attributes:
+        data (Union[bytes, bytearray, memoryview]): A whole RTP datagram
+    '''
+
+    __slots__ = (
+        "marker", "payloadType", "sequenceNumber", "timestamp", "ssrc",
+        "payload")
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        length = len(data)
+        if length < RTP_HEADER_LEN:
+            raise ValueError("Datagram is shorter than an RTP header")
+
+        first, second, self.sequenceNumber, self.timestamp, self.ssrc = (
+            RTP_HEADER.unpack_from(data))
+
+        if (first >> 6) != RTP_VERSION:
+            raise ValueError("Not an RTP version 2 packet")
+
+        self.marker = (second & 0x80) != 0
+        self.payloadType = second & 0x7f
+
+        # Skip any CSRCs and header extension
+        payloadStart = RTP_HEADER_LEN + 4 * (first & 0x0f)
+        if first & 0x10:
+            if length < payloadStart + 4:
+                raise ValueError("Datagram is shorter than its extension")
+            extLen = int.from_bytes(
+                data[payloadStart+2:payloadStart+4], byteorder='big')
+            payloadStart += 4 * (extLen + 1)
+
+        # The last byte of padding gives the padding length
+        payloadEnd = length
+        if first & 0x20:
+            payloadEnd -= data[length - 1]
+
+        if payloadEnd < payloadStart:
+            raise ValueError("Datagram is shorter than its headers")
+
+        self.payload = memoryview(data)[payloadStart:payloadEnd]
+
+    def copy(self) -> RTPView:
+        '''
+        Return the packet with its payload copied, so that it no longer keeps
+        the datagram's buffer alive.
+        '''
+        ret = RTPView.__new__(RTPView)
+        ret.marker = self.marker
+        ret.payloadType = self.payloadType
+        ret.sequenceNumber = self.sequenceNumber
+        ret.timestamp = self.timestamp
+        ret.ssrc = self.ssrc
+        ret.payload = memoryview(bytes(self.payload))
+
+        return ret
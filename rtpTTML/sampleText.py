@@ -0,0 +1,38 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Pseudo-random text in several scripts, for load generation and benchmarks.
+"""
+
+from typing import Dict
+from random import Random
+
+# Alphabets with characters of each encoded length
+SCRIPTS: Dict[str, str] = {
+    "latin": "abcdefghijklmnopqrstuvwxyz ",
+    "arabic": "ابتثجحخد من",
+    "cjk": "一中文字幕日本語。",
+    "emoji": "\U0001F600\U0001F602\U0001F44D\U0001F3AC ",
+    "mixed": "ab من 中文 \U0001F600",
+}
+
+
+def sampleText(size: int, script: str, rand: Random) -> str:
+    '''
+    Generate `size` characters drawn from one of the SCRIPTS alphabets.
+    '''
+    alphabet = SCRIPTS[script]
+
+    return "".join(rand.choice(alphabet) for _ in range(size))
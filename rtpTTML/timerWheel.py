@@ -0,0 +1,154 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Dict, Hashable, List, Optional
+import heapq
+
+DEFAULT_RESOLUTION = 0.01
+DEFAULT_SLOTS = 512
+
+
+class TimerWheel:
+    '''
+    A hashed timing wheel of deadlines for keys.
+
+    Deadlines are rounded up to the next multiple of `resolution` seconds
+    and kept in a ring of `slots` buckets, so scheduling a key is constant
+    time however many keys are waiting. Advancing visits one bucket per tick
+    passed, up to a full revolution. Deadlines more than a revolution ahead
+    wait in their bucket until their turn comes round. The earliest deadline
+    is kept on a heap of the distinct ticks that have keys waiting, which
+    costs the log of the number of those ticks when one is added or passed.
+
+    Entries are never cancelled. A key scheduled more than once is returned
+    once per bucket, and may be returned after its owner no longer needs
+    it, so callers should check the actual deadline of each key returned.
+
+    Attributes:
+        resolution (float): Seconds per tick
+        slots (int): Number of buckets in the ring
+    '''
+
+    def __init__(
+       self,
+       resolution: float = DEFAULT_RESOLUTION,
+       slots: int = DEFAULT_SLOTS) -> None:
+        self._resolution = resolution
+        self._slots = slots
+        self._buckets: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._tick: Optional[int] = None
+        self._count = 0
+        # Keys waiting for each tick, and a heap of those ticks. Ticks left
+        # on the heap once they have no keys are skipped when they reach the
+        # top.
+        self._pending: Dict[int, int] = {}
+        self._ticks: List[int] = []
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _tickOf(self, time: float) -> int:
+        # Tolerate rounding error, so times on a tick boundary fall in it
+        return int(time / self._resolution + 1e-6)
+
+    def schedule(self, key: Hashable, when: float) -> None:
+        '''
+        Return `key` from advance() once `when` has passed.
+        '''
+        tick = self._tickOf(when) + 1
+        if self._tick is not None:
+            tick = max(tick, self._tick + 1)
+
+        bucket = self._buckets[tick % self._slots]
+
+        existing = bucket.get(key)
+        if existing is None:
+            self._count += 1
+        elif existing <= tick:
+            return
+        else:
+            self._release(existing)
+        bucket[key] = tick
+
+        waiting = self._pending.get(tick, 0)
+        if waiting == 0:
+            heapq.heappush(self._ticks, tick)
+        self._pending[tick] = waiting + 1
+
+    def _release(self, tick: int) -> None:
+        waiting = self._pending[tick] - 1
+        if waiting > 0:
+            self._pending[tick] = waiting
+        else:
+            del self._pending[tick]
+
+    def _earliest(self) -> Optional[int]:
+        ticks = self._ticks
+        while ticks and (ticks[0] not in self._pending):
+            heapq.heappop(ticks)
+
+        return ticks[0] if ticks else None
+
+    def nextExpiry(self) -> Optional[float]:
+        '''
+        The time at which advance() will next return keys, or None if there
+        are none waiting.
+        '''
+        earliest = self._earliest()
+        if earliest is None:
+            return None
+
+        return earliest * self._resolution
+
+    def _expireBucket(
+       self, bucket: Dict[Hashable, int], tick: int,
+       due: List[Hashable]) -> None:
+        for key, keyTick in list(bucket.items()):
+            if keyTick <= tick:
+                due.append(key)
+                del bucket[key]
+                self._count -= 1
+                self._release(keyTick)
+
+    def advance(self, now: float) -> List[Hashable]:
+        '''
+        Move the wheel on to `now`, and return the keys whose deadlines have
+        passed.
+        '''
+        due: List[Hashable] = []
+        target = self._tickOf(now)
+
+        if (self._tick is not None) and (target <= self._tick):
+            return due
+
+        earliest = self._earliest()
+        if (earliest is None) or (earliest > target):
+            # Nothing is due, so skip straight there
+            self._tick = target
+            return due
+
+        if (self._tick is None) or (target - self._tick >= self._slots):
+            # Every bucket comes round at least once
+            for bucket in self._buckets:
+                self._expireBucket(bucket, target, due)
+        else:
+            # No keys are due before the earliest tick
+            for tick in range(max(self._tick + 1, earliest), target + 1):
+                self._expireBucket(
+                    self._buckets[tick % self._slots], tick, due)
+
+        self._tick = target
+
+        return due
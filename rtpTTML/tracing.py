@@ -0,0 +1,127 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Opt-in timing of the stages of sending and receiving, for finding where time
+goes on the hot path.
+"""
+
+from __future__ import annotations
+from typing import Dict, Optional, Sequence, TextIO
+from abc import ABC, abstractmethod
+import json
+import os
+import threading
+from .metrics import Histogram, HistogramSnapshot
+
+# Receive stages
+STAGE_PARSE = "parse"            # RTP header parse and stream lookup
+STAGE_REORDER = "reorder"        # Reorder buffer
+STAGE_PAYLOAD = "payload"        # Payload header check and fragment storage
+STAGE_REASSEMBLE = "reassemble"  # Joining and decoding a document
+STAGE_CALLBACK = "callback"      # The user callback
+
+# Transmit stages
+STAGE_FRAGMENT = "fragment"      # Encoding, fragmentation and payload layout
+STAGE_SERIALISE = "serialise"    # RTP headers
+STAGE_SEND = "send"              # Socket send, or enqueueing to a pacer
+
+STAGE_BUCKETS = (
+    250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000,
+    1000000, 10000000)
+
+
+class Tracer(ABC):
+    '''
+    Receives the timing of each stage a transmitter or receiver passes
+    through. Stages are timed with perf_counter_ns(), and only when a tracer
+    is set.
+    '''
+
+    @abstractmethod
+    def record(self, stage: str, start: int, end: int) -> None:
+        ...
+
+
+class HistogramTracer(Tracer):
+    '''
+    Aggregates stage timings into a histogram per stage.
+
+    Attributes:
+        bounds (Sequence[float]): Upper bounds of the buckets in nanoseconds
+    '''
+
+    def __init__(self, bounds: Sequence[float] = STAGE_BUCKETS) -> None:
+        self._bounds = bounds
+        self._histograms: Dict[str, Histogram] = {}
+
+    def record(self, stage: str, start: int, end: int) -> None:
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = Histogram(self._bounds)
+            self._histograms[stage] = histogram
+
+        histogram.observe(end - start)
+
+    def snapshot(self) -> Dict[str, HistogramSnapshot]:
+        return {
+            stage: histogram.snapshot()
+            for stage, histogram in self._histograms.items()}
+
+
+class ChromeTraceWriter(Tracer):
+    '''
+    Writes stage timings as Chrome trace events, in the JSON array format
+    loaded by chrome://tracing and Perfetto.
+
+    Attributes:
+        path (str): File to write
+    '''
+
+    def __init__(self, path: str) -> None:
+        self._file: Optional[TextIO] = open(path, "w")
+        self._file.write("[")
+        self._separator = "\n"
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> ChromeTraceWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record(self, stage: str, start: int, end: int) -> None:
+        # Trace event times are in microseconds
+        event = json.dumps({
+            "name": stage,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": self._pid,
+            "tid": threading.get_ident()})
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.write(self._separator + event)
+            self._separator = ",\n"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.write("\n]\n")
+                self._file.close()
+                self._file = None
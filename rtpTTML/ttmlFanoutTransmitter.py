@@ -0,0 +1,232 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, cast
+from datetime import datetime
+import socket
+import asyncio
+from random import randrange
+from rtp import PayloadType
+from .ttmlTransmitter import (
+    TTMLTransmitter, PacketBuffer, EPOCH, RTP_VERSION, RTP_HEADER,
+    RTP_HEADER_PATCH, MAX_SEQ_NUM)
+from .packetisationCache import PacketisationCache
+
+
+class TTMLDestination:
+    '''
+    The RTP stream sent to a single receiver by a TTMLFanoutTransmitter.
+
+    Attributes:
+        address (str): The receiver's address
+        port (int): The receiver's port
+        ssrc (int): The stream's Synchronization Source Identifier
+        nextSeqNum (int): The sequence number of the next packet
+        tsOffset (int): Offset added to this stream's RTP timestamps
+    '''
+
+    def __init__(
+       self,
+       address: str,
+       port: int,
+       payloadType: PayloadType,
+       initialSeqNum: Optional[int] = None,
+       tsOffset: Optional[int] = None,
+       ssrc: Optional[int] = None) -> None:
+        self.address = address
+        self.port = port
+        self._payloadType = payloadType
+
+        if initialSeqNum is not None:
+            self.nextSeqNum = initialSeqNum
+        else:
+            self.nextSeqNum = randrange(2**16)
+
+        if tsOffset is not None:
+            self.tsOffset = tsOffset
+        else:
+            self.tsOffset = randrange(2**32)
+
+        if ssrc is not None:
+            self.ssrc = ssrc
+        else:
+            self.ssrc = randrange(2**32)
+
+        self._rtpHeaderTemplate = RTP_HEADER.pack(
+            RTP_VERSION << 6, payloadType.value, 0, 0, self.ssrc)
+
+    def _writeRTPHeaders(
+       self, buffer: bytearray, offsets: List[Tuple[int, int]],
+       timeMs: int) -> None:
+        timestamp = (timeMs + self.tsOffset) % 2**32
+        lastIndex = len(offsets) - 1
+
+        for x in range(len(offsets)):
+            offset = offsets[x][0]
+            buffer[offset:offset+RTP_HEADER.size] = self._rtpHeaderTemplate
+            RTP_HEADER_PATCH.pack_into(
+                buffer,
+                offset + 1,
+                ((x == lastIndex) << 7) | self._payloadType.value,
+                self.nextSeqNum,
+                timestamp)
+            self.nextSeqNum = (self.nextSeqNum + 1) % (MAX_SEQ_NUM + 1)
+
+
+class AsyncTTMLFanoutConnection (object):
+    def __init__(self, parent: TTMLFanoutTransmitter) -> None:
+        self._parent = parent
+        self._transport: Optional[asyncio.DatagramTransport]
+        self._protocol: Optional[asyncio.DatagramProtocol]
+
+    async def _open(self) -> None:
+        loop = asyncio.get_event_loop()
+
+        # Typeshed incorrectly assumes Base Transport and Protocol types
+        self._transport, self._protocol = cast(
+            Tuple[asyncio.DatagramTransport, asyncio.DatagramProtocol],
+            await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol,
+                family=socket.AF_INET))
+
+    async def _close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    async def sendDoc(self, doc: str, time: datetime) -> None:
+        if self._transport is None:
+            return
+
+        for dest, packets in self._parent._fanoutDoc(doc, time):
+            for packet in packets:
+                self._transport.sendto(packet, (dest.address, dest.port))
+
+
+class SyncTTMLFanoutConnection (object):
+    def __init__(self, parent: TTMLFanoutTransmitter) -> None:
+        self._parent = parent
+        self._socket: Optional[socket.socket]
+
+    def _open(self) -> None:
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+
+    def sendDoc(self, doc: str, time: datetime) -> None:
+        if self._socket is None:
+            return
+
+        for dest, packets in self._parent._fanoutDoc(doc, time):
+            for packet in packets:
+                self._socket.sendto(packet, (dest.address, dest.port))
+
+
+class TTMLFanoutTransmitter:
+    '''
+    Sends the same documents to many receivers. Each document is packetised
+    once, and only the RTP headers are rewritten for each destination.
+
+    Destinations may be added and removed while documents are being sent.
+    '''
+
+    def __init__(
+       self,
+       destinations: Iterable[Tuple[str, int]] = (),
+       maxFragmentSize: int = 1200,
+       payloadType: PayloadType = PayloadType.DYNAMIC_96,
+       encoding: str = "UTF-8",
+       bom: bool = False,
+       cache: Optional[PacketisationCache] = None) -> None:
+        self._payloadType = payloadType
+        self._destinations: Dict[Tuple[str, int], TTMLDestination] = {}
+        self._packetBuffer = PacketBuffer()
+
+        # Only used to encode and fragment documents, never to send
+        self._packetiser = TTMLTransmitter(
+            "", 0, maxFragmentSize, payloadType, encoding=encoding, bom=bom,
+            cache=cache)
+
+        for address, port in destinations:
+            self.addDestination(address, port)
+
+        self._async_connection: Optional[AsyncTTMLFanoutConnection] = None
+        self._sync_connection: Optional[SyncTTMLFanoutConnection] = None
+
+    async def __aenter__(self) -> AsyncTTMLFanoutConnection:
+        self._async_connection = AsyncTTMLFanoutConnection(self)
+        await self._async_connection._open()
+        return self._async_connection
+
+    async def __aexit__(self, *args) -> None:
+        if self._async_connection is not None:
+            await self._async_connection._close()
+            self._async_connection = None
+
+    def __enter__(self) -> SyncTTMLFanoutConnection:
+        self._sync_connection = SyncTTMLFanoutConnection(self)
+        self._sync_connection._open()
+        return self._sync_connection
+
+    def __exit__(self, *args) -> None:
+        if self._sync_connection is not None:
+            self._sync_connection._close()
+            self._sync_connection = None
+
+    @property
+    def destinations(self) -> List[TTMLDestination]:
+        return list(self._destinations.values())
+
+    def addDestination(
+       self,
+       address: str,
+       port: int,
+       initialSeqNum: Optional[int] = None,
+       tsOffset: Optional[int] = None,
+       ssrc: Optional[int] = None) -> TTMLDestination:
+        key = (address, port)
+        if key in self._destinations:
+            raise ValueError("Destination {}:{} already added".format(
+                address, port))
+
+        dest = TTMLDestination(
+            address, port, self._payloadType, initialSeqNum, tsOffset, ssrc)
+        self._destinations[key] = dest
+
+        return dest
+
+    def removeDestination(self, address: str, port: int) -> None:
+        del self._destinations[(address, port)]
+
+    def _fanoutDoc(
+       self, doc: str,
+       time: datetime) -> Iterator[Tuple[TTMLDestination, List[memoryview]]]:
+        # Headers are patched in place, so each destination's packets must be
+        # sent before moving on to the next
+        self._packetBuffer.clear()
+        self._packetiser._layoutDocInto(doc, self._packetBuffer)
+
+        if len(self._packetBuffer) == 0:
+            return
+
+        timeMs = int((time - EPOCH).total_seconds() * 1000)
+        offsets = self._packetBuffer.offsets()
+        packets = self._packetBuffer.packets()
+
+        for dest in list(self._destinations.values()):
+            dest._writeRTPHeaders(self._packetBuffer.buffer, offsets, timeMs)
+            yield dest, packets
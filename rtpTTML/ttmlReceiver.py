@@ -13,64 +13,306 @@
 # limitations under the License.
 
 from __future__ import annotations
-from typing import List, Callable, Dict, Optional, Tuple, cast
+from typing import (
+    Any, AsyncIterator, Deque, List, Callable, Dict, Hashable, Iterable,
+    NamedTuple, Optional, Tuple, Union, cast)
 import socket
 import asyncio
-from collections import OrderedDict
-from rtp import RTP
-from rtpPayload_ttml import RTPPayload_TTML
+import threading
+from collections import OrderedDict, deque
+from time import monotonic, perf_counter_ns
+from rtpPayload_ttml import LengthError, utfDecode
+from .mmsg import MMsgReceiver, recvmmsgAvailable
+from .timerWheel import TimerWheel
+from .bufferPool import BufferPool
+from .rtpView import Packet, RTPView
+from .metrics import ReceiverMetrics, Snapshot
+from .recorder import RTPDumpRecorder
+from .dispatch import DocumentQueue, OVERFLOW_DROP_OLDEST
+from .tracing import (
+    Tracer, STAGE_PARSE, STAGE_REORDER, STAGE_PAYLOAD, STAGE_REASSEMBLE,
+    STAGE_CALLBACK)
+from .ttmlTransmitter import PAYLOAD_HEADER
 
 MAX_SEQ_NUM = (2**16) - 1
 
 
+# Limits and decay rate for adaptive reordering
+MIN_ADAPTIVE_DEPTH = 2
+MIN_ADAPTIVE_HOLD = 0.005
+ADAPTIVE_DECAY = 0.999
+
+
 class OrderedBuffer:
-    def __init__(self, maxSize: int = 5, maxKey: int = MAX_SEQ_NUM) -> None:
+    '''
+    Reorders packets by sequence number.
+
+    Packets are held in a ring of `maxSize` slots, indexed by sequence number
+    relative to the next one expected. A packet arriving `maxSize` or more
+    ahead of the next expected one moves the window forward in a single step,
+    giving up on any missing packets it passes, so a burst of loss costs no
+    more than a single lost packet.
+
+    If maxHold is set, packets are also released once the oldest of them has
+    been held for maxHold seconds, so that a missing packet on a low rate
+    stream doesn't hold up delivery until several more packets arrive.
+
+    If adaptive is set, the depth and hold time start small and follow the
+    reordering seen on the stream: twice the largest recent reorder distance
+    and gap-fill delay, up to maxSize and maxHold. Packets that arrive too
+    late grow them further.
+
+    Packets from behind the window are dropped, and counted as duplicates if
+    they were already received or as late otherwise. Packets arriving out of
+    order within the window are counted as reordered, and missing packets the
+    window moves past as lost.
+
+    Attributes:
+        maxSize (int): Number of packets that can be held awaiting a gap
+        maxKey (int): Largest key before keys wrap to 0
+        maxHold (float): Seconds a packet can be held awaiting a gap
+        adaptive (bool): Should depth and hold time follow measured reordering
+    '''
+
+    def __init__(
+       self,
+       maxSize: int = 5,
+       maxKey: int = MAX_SEQ_NUM,
+       maxHold: Optional[float] = None,
+       adaptive: bool = False) -> None:
+        if maxSize < 1:
+            raise ValueError("maxSize must be at least 1")
+
         self._initialised = False
         self._maxSize = maxSize
-        self._maxKey = maxKey
-        self._mostRecentKey = 0
-        self._buffer: Dict[int, RTP] = {}
+        self._keyRange = maxKey + 1
+        self._maxHold = maxHold
+        self._adaptive = adaptive
 
-    def _nextKey(self) -> int:
-        nextKey = self._mostRecentKey + 1
+        # Keys are unwrapped, so they keep increasing as sequence numbers wrap
+        self._nextKey = 0
+        self._highestKey = 0
+        self._keys: List[Optional[int]] = [None] * maxSize
+        self._values: List[Optional[Packet]] = [None] * maxSize
+        self._count = 0
 
-        return nextKey % (self._maxKey + 1)
+        # Only kept if there is a hold time. Packets in the order they arrived,
+        # which is oldest first as `now` never goes backwards. Released
+        # packets are skipped over lazily when the oldest is looked up.
+        self._arrivals: Deque[Tuple[int, float]] = deque()
 
-    def _ffwMostRecent(self) -> None:
-        if len(self._buffer) == 0:
-            return
+        self._depth = maxSize
+        self._hold = maxHold
+        self._reorderEstimate = 0.0
+        self._delayEstimate = 0.0
+        if adaptive:
+            self._depth = min(maxSize, MIN_ADAPTIVE_DEPTH)
+            if maxHold is not None:
+                self._hold = min(maxHold, MIN_ADAPTIVE_HOLD)
 
-        while self._nextKey() not in self._buffer:
-            self._mostRecentKey = self._nextKey()
+        self._duplicates = 0
+        self._late = 0
+        self._lost = 0
+        self._reordered = 0
 
-    def pop(self) -> Optional[RTP]:
-        ret = self._buffer.pop(self._nextKey(), None)
-        self._mostRecentKey = self._nextKey()
+    def __len__(self) -> int:
+        return self._count
 
-        return ret
+    @property
+    def duplicates(self) -> int:
+        return self._duplicates
+
+    @property
+    def late(self) -> int:
+        return self._late
+
+    @property
+    def lost(self) -> int:
+        return self._lost
+
+    @property
+    def reordered(self) -> int:
+        return self._reordered
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def hold(self) -> Optional[float]:
+        return self._hold
+
+    @property
+    def deadline(self) -> Optional[float]:
+        '''
+        The time at which held packets will be released regardless of gaps,
+        or None if no packets are held or there is no hold time.
+        '''
+        if (self._count == 0) or (self._hold is None):
+            return None
 
-    def push(self, key: int, value: RTP) -> None:
-        self._buffer[key] = value
+        return self._oldestArrival() + self._hold
 
+    @property
+    def _buffer(self) -> Dict[int, Packet]:
+        # Held packets by wrapped key
+        return {
+            cast(int, key) % self._keyRange: value
+            for key, value in zip(self._keys, self._values)
+            if value is not None}
+
+    def _unwrap(self, key: int) -> int:
+        distance = (key - self._nextKey) % self._keyRange
+        if distance >= self._keyRange // 2:
+            distance -= self._keyRange
+
+        return self._nextKey + distance
+
+    def _advance(
+       self, nextKey: int, released: Optional[List[Packet]]) -> None:
+        # Move the window forward, releasing held packets it passes if
+        # `released` is given, or dropping them otherwise
+
+        # Held packets can be no further ahead than the size of the ring
+        last = min(nextKey, self._nextKey + self._maxSize)
+        passed = 0
+
+        for key in range(self._nextKey, last):
+            slot = key % self._maxSize
+            value = self._values[slot]
+
+            if (value is not None) and (self._keys[slot] == key):
+                if released is not None:
+                    released.append(value)
+                self._values[slot] = None
+                self._count -= 1
+                passed += 1
+
+        self._lost += nextKey - self._nextKey - passed
+        self._nextKey = nextKey
+
+    def _firstHeldKey(self) -> int:
+        for key in range(self._nextKey, self._nextKey + self._maxSize):
+            slot = key % self._maxSize
+            if (self._values[slot] is not None) and (self._keys[slot] == key):
+                return key
+
+        return self._nextKey
+
+    def _oldestArrival(self) -> float:
+        # Arrival time of the oldest held packet
+        arrivals = self._arrivals
+
+        while arrivals:
+            key, arrival = arrivals[0]
+            slot = key % self._maxSize
+            if (self._values[slot] is not None) and (self._keys[slot] == key):
+                return arrival
+            arrivals.popleft()
+
+        return 0.0
+
+    def _adapt(self, distance: float, delay: float) -> None:
+        self._reorderEstimate = max(distance, self._reorderEstimate)
+        self._delayEstimate = max(delay, self._delayEstimate)
+
+        self._depth = min(self._maxSize, max(
+            MIN_ADAPTIVE_DEPTH, int(2 * self._reorderEstimate) + 1))
+        if self._maxHold is not None:
+            self._hold = min(self._maxHold, max(
+                MIN_ADAPTIVE_HOLD, 2 * self._delayEstimate))
+
+    def _push(
+       self, key: int, value: Packet, released: Optional[List[Packet]],
+       now: float) -> None:
         if not self._initialised:
-            self._mostRecentKey = key - 1
+            self._nextKey = key
+            self._highestKey = key
             self._initialised = True
 
-        if len(self._buffer) >= self._maxSize:
-            self._ffwMostRecent()
+        unwrapped = self._unwrap(key)
+        slot = unwrapped % self._maxSize
 
-        if len(self._buffer) > self._maxSize:
-            self.pop()
+        if self._adaptive:
+            # Let the estimates fall back as the stream stays clean
+            self._reorderEstimate *= ADAPTIVE_DECAY
+            self._delayEstimate *= ADAPTIVE_DECAY
+            self._adapt(0.0, 0.0)
 
-    def available(self) -> bool:
-        available = False
+        if unwrapped < self._nextKey:
+            if self._keys[slot] == unwrapped:
+                self._duplicates += 1
+            else:
+                self._late += 1
+                if self._adaptive:
+                    # We gave up on this packet too soon
+                    self._adapt(
+                        self._highestKey - unwrapped,
+                        2 * (self._hold or 0.0))
+            return
+
+        if unwrapped >= self._nextKey + self._depth:
+            self._advance(unwrapped - self._depth + 1, released)
 
-        if self._nextKey() in self._buffer:
-            available = True
+        if self._values[slot] is not None:
+            self._duplicates += 1
+            return
+
+        if unwrapped < self._highestKey:
+            self._reordered += 1
+
+            if self._adaptive:
+                self._adapt(
+                    self._highestKey - unwrapped,
+                    now - self._oldestArrival()
+                    if (self._count > 0) and (self._maxHold is not None)
+                    else 0.0)
+
+        self._highestKey = max(self._highestKey, unwrapped)
+
+        self._keys[slot] = unwrapped
+        self._values[slot] = value
+        self._count += 1
+
+        if self._maxHold is not None:
+            self._arrivals.append((unwrapped, now))
+
+            # Held keys span at most twice the ring once released packets
+            # are skipped, so this bounds the queue when nothing reads the
+            # deadline
+            if len(self._arrivals) > 2 * self._maxSize:
+                self._oldestArrival()
+
+    def pop(self) -> Optional[Packet]:
+        slot = self._nextKey % self._maxSize
+        ret = None
+
+        if self._keys[slot] == self._nextKey:
+            ret = self._values[slot]
+            if ret is not None:
+                # Keep the key, to recognise duplicates of this packet
+                self._values[slot] = None
+                self._count -= 1
+
+        if ret is None:
+            self._lost += 1
 
-        return available
+        self._nextKey += 1
 
-    def get(self) -> List[RTP]:
+        return ret
+
+    def push(
+       self, key: int, value: Packet, now: Optional[float] = None) -> None:
+        self._push(key, value, None, monotonic() if now is None else now)
+
+    def available(self) -> bool:
+        slot = self._nextKey % self._maxSize
+
+        return (
+            (self._values[slot] is not None) and
+            (self._keys[slot] == self._nextKey))
+
+    def get(self) -> List[Packet]:
         ret = []
 
         while self.available():
@@ -80,50 +322,184 @@ class OrderedBuffer:
 
         return ret
 
-    def pushGet(self, key: int, value: RTP) -> List[RTP]:
-        self.push(key, value)
-        return self.get()
+    def expire(self, now: Optional[float] = None) -> List[Packet]:
+        '''
+        Give up on missing packets that held packets have waited longer than
+        the hold time for, and return the packets that releases.
+        '''
+        if now is None:
+            now = monotonic()
 
+        ret: List[Packet] = []
+        deadline = self.deadline
 
-class TTMLDatagramProtocol(asyncio.DatagramProtocol):
-    def __init__(self, parent: TTMLReceiver) -> None:
-        self._parent = parent
-        super().__init__()
+        while (deadline is not None) and (deadline <= now):
+            self._advance(self._firstHeldKey(), None)
+            ret += self.get()
+            deadline = self.deadline
 
-    def datagram_received(self, data, addr) -> None:
-        self._parent._processData(data)
+        return ret
 
+    def pushGet(
+       self, key: int, value: Packet,
+       now: Optional[float] = None) -> List[Packet]:
+        if now is None:
+            now = monotonic()
+
+        # Packets the window moves past are returned rather than dropped
+        ret = self.expire(now)
+        self._push(key, value, ret, now)
+        ret += self.get()
+
+        return ret
+
+    def holds(self, key: int, value: Packet) -> bool:
+        '''
+        Is `value` held under `key`, rather than released or dropped?
+        '''
+        return self._values[self._unwrap(key) % self._maxSize] is value
+
+    def replace(self, key: int, value: Packet) -> None:
+        '''
+        Replace the packet held under `key` with `value`.
+        '''
+        slot = self._unwrap(key) % self._maxSize
+
+        if self._values[slot] is None:
+            raise KeyError(key)
+
+        self._values[slot] = value
+
+
+class StreamID(NamedTuple):
+    '''
+    Identifies a stream demultiplexed by a TTMLReceiver. Fields the receiver
+    isn't demultiplexing on are None.
+    '''
+    ssrc: Optional[int]
+    address: Optional[Tuple[str, int]]
+
+
+class TTMLStream:
+    '''
+    Reassembly state for a single RTP stream.
+
+    Fragment payloads are kept as undecoded views onto their packets, and the
+    range of sequence numbers seen is tracked as they arrive. A completed
+    document is joined and decoded once, so characters split across fragments
+    are decoded correctly.
+
+    A partial document is discarded if it isn't completed within docTimeout
+    seconds of its first fragment, or grows beyond maxDocSize bytes.
+
+    If copyHeld is set, packets and fragments held past the packet that
+    carried them are copied out of the datagram's buffer, so that they don't
+    keep a pooled receive buffer from being reused.
+
+    Completed documents are recorded in `metrics`, if given.
+    '''
+
+    __slots__ = (
+        "streamID", "lastSeen", "_encoding", "_bom", "_packetBuff",
+        "_fragments", "_minSeq", "_maxSeq", "_inOrder", "_curTimestamp",
+        "_docTimeout", "_maxDocSize", "_docStarted", "_docBytes",
+        "_dropTimestamp", "_docsTimedOut", "_docsOversize", "_docsIncomplete",
+        "_metrics", "_copyHeld")
 
-class TTMLReceiver:
     def __init__(
        self,
-       port: int,
-       callback: Callable[[str, int], None],
-       recvBufSize: Optional[int] = None,
-       timeout: Optional[float] = None,
+       streamID: StreamID = StreamID(None, None),
        encoding: str = "UTF-8",
-       bom: bool = False) -> None:
-        self._fragments: Dict[int, str] = OrderedDict()
-        self._curTimestamp = 0
-        self._port = port
-        self._callback = callback
+       bom: bool = False,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       adaptiveReorder: bool = False,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None,
+       metrics: Optional[ReceiverMetrics] = None,
+       copyHeld: bool = False) -> None:
+        self.streamID = streamID
+        self.lastSeen = 0.0
         self._encoding = encoding
         self._bom = bom
-        self._socket: Optional[socket.socket]
-        self._transport: Optional[asyncio.DatagramTransport]
-        self._protocol: Optional[TTMLDatagramProtocol]
+        self._packetBuff = OrderedBuffer(
+            reorderDepth, maxHold=maxHold, adaptive=adaptiveReorder)
+        self._fragments: Dict[int, memoryview] = {}
+        self._minSeq = 0
+        self._maxSeq = 0
+        self._inOrder = True
+        self._curTimestamp = 0
 
-        if recvBufSize is None:
-            self._recvBufSize = 2**16
-        else:
-            self._recvBufSize = recvBufSize
+        self._docTimeout = docTimeout
+        self._maxDocSize = maxDocSize
+        self._docStarted = 0.0
+        self._docBytes = 0
 
-        self._packetBuff = OrderedBuffer()
+        # Remaining fragments of a discarded document are ignored
+        self._dropTimestamp: Optional[int] = None
+        self._docsTimedOut = 0
+        self._docsOversize = 0
+        self._docsIncomplete = 0
+        self._metrics = metrics
+        self._copyHeld = copyHeld
 
-        if timeout is None:
-            self._timeout = 30.0
-        else:
-            self._timeout = timeout
+    @property
+    def timestamp(self) -> int:
+        return self._curTimestamp
+
+    @property
+    def duplicates(self) -> int:
+        return self._packetBuff.duplicates
+
+    @property
+    def late(self) -> int:
+        return self._packetBuff.late
+
+    @property
+    def lost(self) -> int:
+        return self._packetBuff.lost
+
+    @property
+    def reordered(self) -> int:
+        return self._packetBuff.reordered
+
+    @property
+    def docsIncomplete(self) -> int:
+        return self._docsIncomplete
+
+    @property
+    def docsTimedOut(self) -> int:
+        return self._docsTimedOut
+
+    @property
+    def docsOversize(self) -> int:
+        return self._docsOversize
+
+    @property
+    def docDeadline(self) -> Optional[float]:
+        if (self._docTimeout is None) or (len(self._fragments) == 0):
+            return None
+
+        return self._docStarted + self._docTimeout
+
+    @property
+    def deadline(self) -> Optional[float]:
+        '''
+        The earliest time at which expire() has work to do, or None.
+        '''
+        reorderDeadline = self._packetBuff.deadline
+        docDeadline = self.docDeadline
+
+        if reorderDeadline is None:
+            return docDeadline
+        if docDeadline is None:
+            return reorderDeadline
+
+        return min(reorderDeadline, docDeadline)
+
+    def _dropDoc(self) -> None:
+        self._fragments.clear()
+        self._dropTimestamp = self._curTimestamp
 
     def _unloopSeqNum(self, prevNum: int, thisNum: int) -> int:
         loopOffset = MAX_SEQ_NUM + 1
@@ -143,83 +519,811 @@ class TTMLReceiver:
         # Num has looped
         return thisNum + loopOffset + prevNumOffset
 
+    def _addFragment(self, seqNumber: int, data: memoryview) -> None:
+        if len(self._fragments) == 0:
+            self._minSeq = seqNumber
+            self._maxSeq = seqNumber
+            self._inOrder = True
+        else:
+            seqNumber = self._unloopSeqNum(self._maxSeq, seqNumber)
+
+            if seqNumber > self._maxSeq:
+                self._maxSeq = seqNumber
+            else:
+                self._inOrder = False
+                self._minSeq = min(self._minSeq, seqNumber)
+
+        self._fragments[seqNumber] = data
+
     def _keysComplete(self) -> bool:
         if len(self._fragments) == 0:
             return False
 
-        minKey = min(self._fragments)
-        maxKey = max(self._fragments)
-        expectedLen = maxKey - minKey + 1
+        expectedLen = self._maxSeq - self._minSeq + 1
 
         return len(self._fragments) == expectedLen
 
-    def _processFragments(self) -> None:
+    def _processFragments(self) -> Optional[str]:
         if not self._keysComplete():
             # Discard
+            if len(self._fragments) > 0:
+                self._docsIncomplete += 1
             self._fragments.clear()
-            return
+            return None
 
         # Reconstruct the document
-        doc = ""
+        if self._inOrder:
+            fragments: Iterable[memoryview] = self._fragments.values()
+        else:
+            fragments = [self._fragments[k] for k in sorted(self._fragments)]
 
-        for k, v in self._fragments.items():
-            doc += v
+        encoded = bytearray().join(fragments)
 
         # We've finished re-constructing this document.
         # Discard the fragments.
         self._fragments.clear()
 
-        self._callback(doc, self._curTimestamp)
+        return utfDecode(encoded, self._encoding)
 
-    def _processPacket(self, packet: RTP) -> None:
+    def _processPacket(self, packet: Packet, now: float = 0.0) -> None:
         # New TS means a new document
         if self._curTimestamp != packet.timestamp:
             # If we haven't processed by now, document is incomplete
             # so we discard it
+            if len(self._fragments) > 0:
+                self._docsIncomplete += 1
             self._fragments.clear()
 
             # Assume this packet is the first in doc. If we're wrong, the doc
             # won't be valid TTML when decoded anyway
             self._curTimestamp = packet.timestamp
 
-        seqNumber = packet.sequenceNumber
-        if len(self._fragments) > 0:
-            seqNumber = self._unloopSeqNum(
-                max(self._fragments), packet.sequenceNumber)
+        if packet.timestamp == self._dropTimestamp:
+            return
+
+        payload = packet.payload
+        if len(payload) < PAYLOAD_HEADER.size:
+            raise LengthError("Payload is shorter than its header")
+
+        reserved, length = PAYLOAD_HEADER.unpack_from(payload)
+        if reserved != 0:
+            raise ValueError(
+                "Reserved bits must be '\x00\x00' under RFC 8759")
+        if length != len(payload) - PAYLOAD_HEADER.size:
+            raise LengthError(
+                "Length field does not match length of userDataWords")
+
+        if len(self._fragments) == 0:
+            self._docStarted = now
+            self._docBytes = 0
+
+        self._docBytes += length
+        if (self._maxDocSize is not None) and (
+           self._docBytes > self._maxDocSize):
+            self._dropDoc()
+            self._docsOversize += 1
+            return
+
+        data = memoryview(payload)[PAYLOAD_HEADER.size:]
+
+        # Only a marker packet's fragment is done with straight away
+        if self._copyHeld and not packet.marker:
+            data = memoryview(bytes(data))
+
+        self._addFragment(packet.sequenceNumber, data)
+
+    def processPacket(
+       self, newPacket: Packet,
+       now: Optional[float] = None,
+       tracer: Optional[Tracer] = None) -> List[Tuple[str, int]]:
+        '''
+        Process a newly received packet, and return any (document, timestamp)
+        pairs that it completed. If `tracer` is given, the reorder, payload
+        and reassemble stages are timed.
+        '''
+        if now is None:
+            now = monotonic()
+
+        if tracer is None:
+            packets = self._packetBuff.pushGet(
+                newPacket.sequenceNumber, newPacket, now)
+        else:
+            start = perf_counter_ns()
+            packets = self._packetBuff.pushGet(
+                newPacket.sequenceNumber, newPacket, now)
+            tracer.record(STAGE_REORDER, start, perf_counter_ns())
+
+        if self._copyHeld and isinstance(newPacket, RTPView) and (
+           self._packetBuff.holds(newPacket.sequenceNumber, newPacket)):
+            # Held awaiting a gap
+            self._packetBuff.replace(
+                newPacket.sequenceNumber, newPacket.copy())
+
+        return self._processPackets(packets, now, tracer)
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        '''
+        Release packets held past the reorder deadline, and discard a partial
+        document past its deadline. Return any (document, timestamp) pairs
+        that completes.
+        '''
+        if now is None:
+            now = monotonic()
+
+        docs = self._processPackets(self._packetBuff.expire(now), now)
+
+        docDeadline = self.docDeadline
+        if (docDeadline is not None) and (docDeadline <= now):
+            self._dropDoc()
+            self._docsTimedOut += 1
 
-        payload = RTPPayload_TTML(
-            encoding=self._encoding, bom=self._bom)
-        payload.fromBytearray(packet.payload)
-        self._fragments[seqNumber] = payload.userDataWords
+        return docs
 
-    def _processData(self, data: bytes) -> None:
-        newPacket = RTP().fromBytes(data)
+    def _completeDoc(self, now: float) -> Optional[Tuple[str, int]]:
+        # Called on a marker packet
+        doc = self._processFragments()
+        if doc is None:
+            return None
 
-        packets = self._packetBuff.pushGet(
-            newPacket.sequenceNumber, newPacket)
+        if self._metrics is not None:
+            self._metrics.observeDocument(
+                self._maxSeq - self._minSeq + 1, now - self._docStarted)
+
+        return (doc, self._curTimestamp)
+
+    def _processPackets(
+       self, packets: List[Packet], now: float,
+       tracer: Optional[Tracer] = None) -> List[Tuple[str, int]]:
+        docs = []
+        start = 0
 
         for packet in packets:
-            self._processPacket(packet)
+            if tracer is not None:
+                start = perf_counter_ns()
+
+            self._processPacket(packet, now)
+
+            if tracer is not None:
+                end = perf_counter_ns()
+                tracer.record(STAGE_PAYLOAD, start, end)
+                start = end
 
             if packet.marker:
-                self._processFragments()
+                doc = self._completeDoc(now)
+
+                if tracer is not None:
+                    tracer.record(STAGE_REASSEMBLE, start, perf_counter_ns())
+
+                if doc is not None:
+                    docs.append(doc)
+
+        return docs
+
+
+# Per-stream counters, kept in total by a StreamTable
+STREAM_COUNTERS = (
+    "lost", "reordered", "duplicates", "late", "docsIncomplete",
+    "docsTimedOut", "docsOversize")
+
+
+class StreamTable:
+    '''
+    Reassembly state for many streams, ordered from least to most recently
+    active. Streams idle for longer than streamTimeout seconds are discarded,
+    as are the least recently active streams beyond maxStreams.
+
+    Streams with reorder or document deadlines are kept on a timer wheel, so
+    that finding those due is cheap however many streams there are.
+
+    Streams record completed documents in `metrics`, if given, and copy
+    packets and fragments they hold if `copyHeld` is set.
+
+    Adding and removing streams, and reading counters across them, are
+    locked, so counters can be read from another thread, such as a
+    MetricsExporter's, while packets are processed.
+    '''
+
+    def __init__(
+       self,
+       encoding: str = "UTF-8",
+       bom: bool = False,
+       streamTimeout: Optional[float] = 60.0,
+       maxStreams: Optional[int] = None,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       adaptiveReorder: bool = False,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None,
+       metrics: Optional[ReceiverMetrics] = None,
+       copyHeld: bool = False) -> None:
+        self.copyHeld = copyHeld
+        self._encoding = encoding
+        self._bom = bom
+        self._streamTimeout = streamTimeout
+        self._maxStreams = maxStreams
+        self._reorderDepth = reorderDepth
+        self._maxHold = maxHold
+        self._adaptiveReorder = adaptiveReorder
+        self._docTimeout = docTimeout
+        self._maxDocSize = maxDocSize
+        self._metrics = metrics
+        self._streams: OrderedDict[Hashable, TTMLStream] = OrderedDict()
+        self._lock = threading.Lock()
+        self._timers = TimerWheel()
+        self._nextEviction = 0.0
+        self._evicted = 0
+
+        # Counts from streams that have since been removed
+        self._removedCounts = dict.fromkeys(STREAM_COUNTERS, 0)
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    @property
+    def evicted(self) -> int:
+        return self._evicted
+
+    def total(self, counter: str) -> int:
+        '''
+        The total of one of the STREAM_COUNTERS over all streams, including
+        those since removed.
+        '''
+        with self._lock:
+            return self._removedCounts[counter] + sum(
+                getattr(stream, counter) for stream in self._streams.values())
+
+    @property
+    def duplicates(self) -> int:
+        return self.total("duplicates")
+
+    @property
+    def late(self) -> int:
+        return self.total("late")
+
+    @property
+    def docsTimedOut(self) -> int:
+        return self.total("docsTimedOut")
+
+    @property
+    def docsOversize(self) -> int:
+        return self.total("docsOversize")
+
+    def streamCounts(self) -> Dict[Hashable, Dict[str, int]]:
+        '''
+        The STREAM_COUNTERS of each current stream, by key.
+        '''
+        with self._lock:
+            return {
+                key: {counter: getattr(stream, counter)
+                      for counter in STREAM_COUNTERS}
+                for key, stream in self._streams.items()}
+
+    def _remove(self, key: Hashable) -> None:
+        stream = self._streams.pop(key)
+        for counter in STREAM_COUNTERS:
+            self._removedCounts[counter] += getattr(stream, counter)
+
+    def track(self, key: Hashable, stream: TTMLStream) -> None:
+        '''
+        Schedule a stream's next deadline, if it has one, after processing a
+        packet for it.
+        '''
+        deadline = stream.deadline
+        if deadline is not None:
+            self._timers.schedule(key, deadline)
+
+    def nextDeadline(self) -> Optional[float]:
+        '''
+        The time at which expire() next has work to do, or None if no
+        streams have deadlines.
+        '''
+        return self._timers.nextExpiry()
+
+    def expire(
+       self, now: float) -> List[Tuple[Hashable, TTMLStream, str, int]]:
+        '''
+        Act on streams whose reorder or document deadlines have passed, and
+        return any (key, stream, document, timestamp) that completes.
+        '''
+        docs = []
+
+        for key in self._timers.advance(now):
+            stream = self._streams.get(key)
+            if stream is None:
+                continue
+
+            for doc, timestamp in stream.expire(now):
+                docs.append((key, stream, doc, timestamp))
+            self.track(key, stream)
+
+        return docs
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._streams)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        '''
+        Remove every stream whose key matches `predicate`.
+        '''
+        with self._lock:
+            for key in [k for k in self._streams if predicate(k)]:
+                self._remove(key)
+
+    def _evictIdle(self, now: float) -> None:
+        assert self._streamTimeout is not None
+        idleSince = now - self._streamTimeout
+
+        while len(self._streams) > 0:
+            key, stream = next(iter(self._streams.items()))
+            if stream.lastSeen > idleSince:
+                break
+
+            self._remove(key)
+            self._evicted += 1
+
+        # No need to check more often than streams can expire
+        self._nextEviction = now + min(self._streamTimeout, 1.0)
+
+    def get(self, key: Hashable, streamID: StreamID) -> TTMLStream:
+        now = monotonic()
+
+        with self._lock:
+            if (self._streamTimeout is not None) and (
+               now >= self._nextEviction):
+                self._evictIdle(now)
+
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = TTMLStream(
+                    streamID, self._encoding, self._bom, self._reorderDepth,
+                    self._maxHold, self._adaptiveReorder, self._docTimeout,
+                    self._maxDocSize, self._metrics, self.copyHeld)
+                self._streams[key] = stream
+
+                if (self._maxStreams is not None) and (
+                   len(self._streams) > self._maxStreams):
+                    self._remove(next(iter(self._streams)))
+                    self._evicted += 1
+            else:
+                self._streams.move_to_end(key)
+
+        stream.lastSeen = now
+
+        return stream
+
+
+class ExpiryTimer:
+    '''
+    Calls `callback` on the running event loop at the earliest time it has
+    been scheduled for.
+    '''
+
+    def __init__(self, callback: Callable[[], None]) -> None:
+        self._callback = callback
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._when = 0.0
+
+    def schedule(self, when: float) -> None:
+        if (self._handle is not None) and (self._when <= when):
+            return
+
+        self.cancel()
+        self._when = when
+        self._handle = asyncio.get_event_loop().call_later(
+            max(0.0, when - monotonic()), self._fire)
+
+    def cancel(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self) -> None:
+        self._handle = None
+        self._callback()
+
+
+class TTMLDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, parent: TTMLReceiver) -> None:
+        self._parent = parent
+        super().__init__()
+
+    def datagram_received(self, data, addr) -> None:
+        self._parent._processData(data, addr)
+
+
+class TTMLReceiver:
+    '''
+    Receives TTML documents over RTP.
+
+    By default all packets arriving on the port are treated as one stream,
+    and `callback` is called as callback(doc, timestamp). If demuxSSRC or
+    demuxAddress are set, each SSRC and/or source address is reassembled
+    separately, and `callback` is called as
+    callback(doc, timestamp, streamID).
+
+    Streams that receive no packets for streamTimeout seconds are discarded,
+    as are the least recently active streams beyond maxStreams.
+
+    Each stream holds up to reorderDepth packets while waiting for a missing
+    one to arrive out of order, before giving up on it. If maxHold is set, it
+    also gives up once a packet has been held for maxHold seconds. If
+    adaptiveReorder is set, the depth and hold time follow the reordering
+    measured on each stream, up to those limits.
+
+    A partial document is discarded if it isn't completed within docTimeout
+    seconds, or grows beyond maxDocSize bytes of userDataWords.
+
+    metricsSnapshot() returns counters and histograms of the traffic
+    received, and streamStats() the counters of each stream.
+
+    If tracer is set, each stage of processing a packet is timed and passed
+    to it.
+
+    If recorder is set, each datagram is passed to it as it arrives, for
+    example to an RTPDumpRecorder to archive the raw stream.
+
+    run() receives datagrams into a pool of preallocated buffers, and
+    documents are reassembled from views onto them without copying. Packets
+    and fragments held for a later packet, awaiting a gap or the rest of
+    their document, are copied out, so a partial document pins only its own
+    bytes rather than a whole buffer.
+
+    The callback is called on the receive loop, so a slow consumer delays
+    reception. Wrap it in a CallbackDispatcher to queue documents to worker
+    threads instead. Alternatively, asyncio consumers can read documents from
+    documents() or documentBatches(), in which case callback may be None.
+    '''
+
+    def __init__(
+       self,
+       port: int,
+       callback: Optional[Callable[..., None]],
+       recvBufSize: Optional[int] = None,
+       timeout: Optional[float] = None,
+       encoding: str = "UTF-8",
+       bom: bool = False,
+       recvBatchSize: Optional[int] = None,
+       demuxSSRC: bool = False,
+       demuxAddress: bool = False,
+       streamTimeout: Optional[float] = 60.0,
+       maxStreams: Optional[int] = None,
+       reusePort: bool = False,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       adaptiveReorder: bool = False,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None,
+       tracer: Optional[Tracer] = None,
+       recorder: Optional[RTPDumpRecorder] = None) -> None:
+        self._port = port
+        self._callback = callback
+        self._encoding = encoding
+        self._bom = bom
+        self._socket: Optional[socket.socket] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._protocol: Optional[TTMLDatagramProtocol] = None
+
+        if recvBufSize is None:
+            self._recvBufSize = 2**16
+        else:
+            self._recvBufSize = recvBufSize
+
+        # Receive in batches with recvmmsg, if set
+        self._recvBatchSize = recvBatchSize
+
+        # Allow several receivers to share the port, with the kernel
+        # distributing flows between them
+        self._reusePort = reusePort
+
+        self._demuxSSRC = demuxSSRC
+        self._demuxAddress = demuxAddress
+        # Streams may have deadlines to wake for
+        self._timed = (maxHold is not None) or (docTimeout is not None)
+        self._metrics = ReceiverMetrics()
+        self._streams = StreamTable(
+            encoding, bom, streamTimeout, maxStreams, reorderDepth, maxHold,
+            adaptiveReorder, docTimeout, maxDocSize, self._metrics)
+        self._expiryTimer: Optional[ExpiryTimer] = None
+        self._tracer = tracer
+        self._recorder = recorder
+        self._queues: List[DocumentQueue] = []
+
+        if timeout is None:
+            self._timeout = 30.0
+        else:
+            self._timeout = timeout
+
+    @property
+    def streams(self) -> List[StreamID]:
+        return cast(List[StreamID], self._streams.keys())
+
+    @property
+    def streamsEvicted(self) -> int:
+        return self._streams.evicted
+
+    @property
+    def duplicatePackets(self) -> int:
+        return self._streams.duplicates
+
+    @property
+    def latePackets(self) -> int:
+        return self._streams.late
+
+    @property
+    def docsTimedOut(self) -> int:
+        return self._streams.docsTimedOut
+
+    @property
+    def docsOversize(self) -> int:
+        return self._streams.docsOversize
+
+    @property
+    def metrics(self) -> ReceiverMetrics:
+        return self._metrics
+
+    def metricsSnapshot(self) -> Snapshot:
+        '''
+        Receiver counters and histograms, with per-stream counters totalled
+        over all streams seen.
+        '''
+        snapshot = self._metrics.snapshot()
+        snapshot["streams"] = len(self._streams)
+        snapshot["streamsEvicted"] = self._streams.evicted
+
+        for counter in STREAM_COUNTERS:
+            snapshot[counter] = self._streams.total(counter)
+
+        return snapshot
+
+    def streamStats(self) -> Dict[StreamID, Dict[str, int]]:
+        return cast(
+            Dict[StreamID, Dict[str, int]], self._streams.streamCounts())
+
+    def _getStream(
+       self, packet: Packet, addr: Optional[Tuple[str, int]]) -> TTMLStream:
+        streamID = StreamID(
+            packet.ssrc if self._demuxSSRC else None,
+            addr if self._demuxAddress else None)
+
+        return self._streams.get(streamID, streamID)
+
+    def _deliver(self, stream: TTMLStream, doc: str, timestamp: int) -> None:
+        args: Tuple[Any, ...]
+        if self._demuxSSRC or self._demuxAddress:
+            args = (doc, timestamp, stream.streamID)
+        else:
+            args = (doc, timestamp)
+
+        if self._callback is not None:
+            self._callback(*args)
+
+        for queue in self._queues:
+            queue.put(args)
+
+    def _openQueue(self, maxQueue: int, overflow: str) -> DocumentQueue:
+        queue = DocumentQueue(maxQueue, overflow)
+        self._queues.append(queue)
+
+        return queue
+
+    def _closeQueue(self, queue: DocumentQueue) -> None:
+        queue.close()
+        if queue in self._queues:
+            self._queues.remove(queue)
+
+    def documents(
+       self,
+       maxQueue: int = 1024,
+       overflow: str = OVERFLOW_DROP_OLDEST) -> AsyncIterator[Tuple[Any, ...]]:
+        '''
+        Iterate over received documents, as the tuples the callback would be
+        called with:
+
+            async for doc, timestamp in receiver.documents():
+                await process(doc)
+
+        Documents received from now on wait in a queue of up to maxQueue,
+        with the oldest or newest dropped when it is full according to
+        `overflow`. Iteration ends when the receiver is closed.
+
+        Must be called from the event loop that iterates, which need not be
+        the one receiving. RuntimeError is raised if no loop is running.
+        '''
+        return self._iterate(self._openQueue(maxQueue, overflow))
+
+    def documentBatches(
+       self,
+       maxQueue: int = 1024,
+       overflow: str = OVERFLOW_DROP_OLDEST
+       ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        '''
+        As documents(), but yields lists of every document received since
+        the last iteration. Must also be called from the event loop that
+        iterates.
+        '''
+        return self._iterateBatches(self._openQueue(maxQueue, overflow))
+
+    async def _iterate(
+       self, queue: DocumentQueue) -> AsyncIterator[Tuple[Any, ...]]:
+        try:
+            async for item in queue:
+                yield item
+        finally:
+            self._closeQueue(queue)
+
+    async def _iterateBatches(
+       self, queue: DocumentQueue) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        try:
+            while True:
+                batch = await queue.getBatch()
+                if len(batch) == 0:
+                    return
+                yield batch
+        finally:
+            self._closeQueue(queue)
+
+    def _processData(
+       self,
+       data: Union[bytes, bytearray, memoryview],
+       addr: Optional[Tuple[str, int]] = None) -> None:
+        self._metrics.packets += 1
+        self._metrics.bytes += len(data)
+
+        if self._recorder is not None:
+            self._recorder.record(data, addr)
+
+        if self._tracer is not None:
+            stream = self._processDataTraced(self._tracer, data, addr)
+        else:
+            newPacket = RTPView(data)
+            stream = self._getStream(newPacket, addr)
+
+            for doc, timestamp in stream.processPacket(
+               newPacket, stream.lastSeen):
+                self._deliver(stream, doc, timestamp)
+
+        if self._timed:
+            self._streams.track(stream.streamID, stream)
+
+            deadline = stream.deadline
+            if (deadline is not None) and (self._expiryTimer is not None):
+                self._expiryTimer.schedule(deadline)
+
+    def _processDataTraced(
+       self,
+       tracer: Tracer,
+       data: Union[bytes, bytearray, memoryview],
+       addr: Optional[Tuple[str, int]]) -> TTMLStream:
+        # As _processData, timing the parse and each callback. The stream
+        # times its own stages.
+        start = perf_counter_ns()
+        newPacket = RTPView(data)
+        stream = self._getStream(newPacket, addr)
+        tracer.record(STAGE_PARSE, start, perf_counter_ns())
+
+        for doc, timestamp in stream.processPacket(
+           newPacket, stream.lastSeen, tracer):
+            start = perf_counter_ns()
+            self._deliver(stream, doc, timestamp)
+            tracer.record(STAGE_CALLBACK, start, perf_counter_ns())
+
+        return stream
+
+    def _expireStreams(self, now: float) -> None:
+        for _, stream, doc, timestamp in self._streams.expire(now):
+            self._deliver(stream, doc, timestamp)
+
+    def _onExpiryTimer(self) -> None:
+        self._expireStreams(monotonic())
+
+        deadline = self._streams.nextDeadline()
+        if (deadline is not None) and (self._expiryTimer is not None):
+            self._expiryTimer.schedule(deadline)
+
+    def _receiveLoop(
+       self, sock: socket.socket, receive: Callable[[], None]) -> None:
+        # Call receive() until the socket times out. If streams can have
+        # deadlines, wake for them too.
+        if not self._timed:
+            while True:
+                receive()
+
+        idleUntil = monotonic() + self._timeout
+
+        while True:
+            now = monotonic()
+            self._expireStreams(now)
+
+            wait = idleUntil - now
+            deadline = self._streams.nextDeadline()
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+
+            # A zero timeout would make the socket non-blocking
+            sock.settimeout(max(wait, 1e-3))
+
+            try:
+                receive()
+                idleUntil = monotonic() + self._timeout
+            except socket.timeout:
+                if monotonic() >= idleUntil:
+                    raise
+
+    def _processDataBatch(
+       self, datagrams: Iterable[Union[bytes, bytearray, memoryview]],
+       pool: BufferPool) -> None:
+        # The batch's buffers are reused by the next call, so payloads that
+        # are held on to are copied into the pool
+        for data in datagrams:
+            self._processData(pool.copy(data))
+
+    def _processDataFromBatch(
+       self,
+       datagrams: Iterable[Tuple[memoryview, Tuple[str, int]]],
+       pool: BufferPool) -> None:
+        for data, addr in datagrams:
+            self._processData(pool.copy(data), addr)
+
+    def _receiveInto(self, sock: socket.socket, pool: BufferPool) -> None:
+        length, addr = sock.recvfrom_into(pool.reserve())
+        self._processData(pool.commit(length), addr)
+
+    def _runBatched(self, sock: socket.socket, batchSize: int) -> None:
+        pool = BufferPool(self._recvBufSize)
+
+        if recvmmsgAvailable():
+            receiver = MMsgReceiver(sock, batchSize, self._recvBufSize)
+
+            if self._demuxAddress:
+                self._receiveLoop(
+                    sock,
+                    lambda: self._processDataFromBatch(
+                        receiver.recvFrom(), pool))
+            else:
+                self._receiveLoop(
+                    sock,
+                    lambda: self._processDataBatch(receiver.recv(), pool))
+
+        # Fall back to receiving one datagram at a time
+        self._receiveLoop(sock, lambda: self._receiveInto(sock, pool))
 
     def run(self) -> None:
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._socket.settimeout(self._timeout)
+        if self._reusePort:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._socket.bind(('', self._port))
 
-        while True:
-            data = self._socket.recv(self._recvBufSize)
-            self._processData(data)
+        # Held data mustn't keep pooled buffers from being reused
+        self._streams.copyHeld = True
+
+        if self._recvBatchSize is not None:
+            self._runBatched(self._socket, self._recvBatchSize)
+
+        # Datagrams are received into pooled buffers, and payloads are
+        # reassembled from views onto them without copying
+        pool = BufferPool(self._recvBufSize)
+        sock = self._socket
+        self._receiveLoop(sock, lambda: self._receiveInto(sock, pool))
 
     def async_close(self) -> None:
+        if self._expiryTimer is not None:
+            self._expiryTimer.cancel()
+
+        # End iteration over documents once those queued are read
+        for queue in self._queues:
+            queue.close()
+
         if self._transport is not None:
             self._transport.close()
 
     async def async_run(self) -> None:
         loop = asyncio.get_event_loop()
 
+        if self._timed:
+            self._expiryTimer = ExpiryTimer(self._onExpiryTimer)
+
         # Typeshed incorrectly assumes Base Transport and Protocol types
         # Typeshed also incorrectly says local_addr's address can't be None
         self._transport, self._protocol = cast(
@@ -227,4 +1331,5 @@ class TTMLReceiver:
             await loop.create_datagram_endpoint(
                 lambda: TTMLDatagramProtocol(self),
                 local_addr=(None, self._port),  # type: ignore
-                family=socket.AF_INET))
+                family=socket.AF_INET,
+                reuse_port=self._reusePort or None))
@@ -0,0 +1,222 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import multiprocessing
+import os
+import threading
+from time import monotonic
+from .ttmlReceiver import TTMLReceiver, TTMLStream
+
+STAT_FIELDS = ("packets", "bytes", "docs")
+
+# Seconds between workers checking whether they have been told to stop
+STOP_POLL_INTERVAL = 0.05
+
+
+class PoolWorkerReceiver(TTMLReceiver):
+    '''
+    A TTMLReceiver that counts its traffic into its own slots of an array
+    shared with the parent process.
+    '''
+
+    def __init__(self, stats: Any, statsBase: int, *args, **kwargs) -> None:
+        self._stats = stats
+        self._statsBase = statsBase
+        super().__init__(*args, **kwargs)
+
+    def _processData(
+       self,
+       data: Union[bytes, bytearray, memoryview],
+       addr: Optional[Tuple[str, int]] = None) -> None:
+        # Each slot only has one writer, so no lock is needed
+        self._stats[self._statsBase] += 1
+        self._stats[self._statsBase + 1] += len(data)
+        super()._processData(data, addr)
+
+    def _deliver(self, stream: TTMLStream, doc: str, timestamp: int) -> None:
+        self._stats[self._statsBase + 2] += 1
+        super()._deliver(stream, doc, timestamp)
+
+
+def _workerMain(
+       index: int,
+       port: int,
+       stats: Any,
+       ready: Any,
+       stopping: Any,
+       results: Any,
+       workerCallback: Optional[Callable[..., None]],
+       receiverArgs: Dict[str, Any]) -> None:
+    def forward(doc: str, timestamp: int, *streamID: Any) -> None:
+        results.put((index, doc, timestamp) + streamID)
+
+    callback: Callable[..., None]
+    if workerCallback is not None:
+        callback = workerCallback
+    else:
+        callback = forward
+
+    receiver = PoolWorkerReceiver(
+        stats, index * len(STAT_FIELDS), port, callback, reusePort=True,
+        **receiverArgs)
+
+    async def waitForStop() -> None:
+        while not stopping.is_set():
+            await asyncio.sleep(STOP_POLL_INTERVAL)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(receiver.async_run())
+    ready.set()
+    loop.run_until_complete(waitForStop())
+
+    # Stop receiving, then wait for documents already put to reach the pipe
+    receiver.async_close()
+    loop.close()
+    results.close()
+    results.join_thread()
+
+
+class TTMLReceiverPool:
+    '''
+    Shares one port between several worker processes, each running a
+    TTMLReceiver bound with SO_REUSEPORT, so that the kernel spreads flows
+    across CPU cores.
+
+    If workerCallback is given, it is called in the worker processes with
+    the receiver's usual arguments, and so must be picklable. Otherwise
+    documents are sent back to this process, and `callback` is called from a
+    background thread as callback(worker, doc, timestamp), with streamID
+    appended if demultiplexing.
+
+    Any other keyword arguments are passed to each worker's TTMLReceiver.
+    '''
+
+    def __init__(
+       self,
+       port: int,
+       workers: Optional[int] = None,
+       callback: Optional[Callable[..., None]] = None,
+       workerCallback: Optional[Callable[..., None]] = None,
+       **receiverArgs: Any) -> None:
+        if port == 0:
+            raise ValueError("Workers can't share an ephemeral port")
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self._port = port
+        self._workerCount = workers
+        self._callback = callback
+        self._workerCallback = workerCallback
+        self._receiverArgs = receiverArgs
+        self._stats = multiprocessing.Array(
+            'q', workers * len(STAT_FIELDS), lock=False)
+        self._results: Any = multiprocessing.Queue()
+        self._stopping = multiprocessing.Event()
+        self._workers: List[multiprocessing.Process] = []
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def __enter__(self) -> TTMLReceiverPool:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self, timeout: float = 10.0) -> None:
+        '''
+        Start the workers, and wait until they have all bound the port.
+        '''
+        readyEvents = []
+        self._stopping.clear()
+
+        for index in range(self._workerCount):
+            ready = multiprocessing.Event()
+            worker = multiprocessing.Process(
+                target=_workerMain,
+                args=(
+                    index, self._port, self._stats, ready, self._stopping,
+                    self._results, self._workerCallback, self._receiverArgs),
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+            readyEvents.append(ready)
+
+        if self._workerCallback is None:
+            self._dispatcher = threading.Thread(
+                target=self._dispatch, daemon=True)
+            self._dispatcher.start()
+
+        for ready in readyEvents:
+            if not ready.wait(timeout):
+                self.stop()
+                raise TimeoutError("Receiver worker failed to start")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        '''
+        Tell the workers to stop, and wait up to `timeout` seconds for them
+        to finish sending the documents they have received. Workers still
+        running after that are terminated.
+        '''
+        self._stopping.set()
+
+        # The dispatcher keeps reading results meanwhile, so workers aren't
+        # left waiting on a full pipe
+        deadline = monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - monotonic(), 0.0))
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers = []
+
+        if self._dispatcher is not None:
+            self._results.put(None)
+            self._dispatcher.join()
+            self._dispatcher = None
+
+    def _dispatch(self) -> None:
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+
+            if self._callback is not None:
+                self._callback(*result)
+
+    def workerStats(self) -> List[Dict[str, int]]:
+        fieldCount = len(STAT_FIELDS)
+
+        return [
+            dict(zip(
+                STAT_FIELDS,
+                self._stats[index*fieldCount:(index+1)*fieldCount]))
+            for index in range(self._workerCount)]
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Counters summed across all of the workers.
+        '''
+        totals = dict.fromkeys(STAT_FIELDS, 0)
+
+        for workerStats in self.workerStats():
+            for field in STAT_FIELDS:
+                totals[field] += workerStats[field]
+
+        return totals
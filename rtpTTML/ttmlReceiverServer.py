@@ -0,0 +1,227 @@
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union, cast
+import socket
+import asyncio
+from time import monotonic
+from rtpPayload_ttml import LengthError
+from .rtpView import RTPView
+from .ttmlReceiver import ExpiryTimer, StreamID, StreamTable
+
+
+class PortLoad:
+    '''
+    Traffic counters for one port of a TTMLReceiverServer.
+
+    Attributes:
+        packets (int): Datagrams received
+        bytes (int): Bytes received
+        docs (int): Documents delivered
+        errors (int): Datagrams discarded because they couldn't be parsed
+    '''
+
+    __slots__ = ("packets", "bytes", "docs", "errors")
+
+    def __init__(self) -> None:
+        self.packets = 0
+        self.bytes = 0
+        self.docs = 0
+        self.errors = 0
+
+
+class TTMLServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, parent: TTMLReceiverServer, port: int) -> None:
+        self._parent = parent
+        self._port = port
+        super().__init__()
+
+    def datagram_received(self, data, addr) -> None:
+        self._parent._processData(self._port, data, addr)
+
+
+class TTMLReceiverServer:
+    '''
+    Receives TTML streams on many ports from a single event loop, sharing one
+    table of per-stream reassembly state.
+
+    `callback` is called as callback(doc, timestamp, port, streamID). Ports
+    may be given as ints or ranges, and added or removed while running.
+
+    reorderDepth, maxHold and adaptiveReorder control how long packets are
+    held for reordering, and docTimeout and maxDocSize limit partial
+    documents, as for TTMLReceiver.
+    '''
+
+    def __init__(
+       self,
+       callback: Callable[[str, int, int, StreamID], None],
+       ports: Iterable[Union[int, range]] = (),
+       encoding: str = "UTF-8",
+       bom: bool = False,
+       demuxSSRC: bool = True,
+       demuxAddress: bool = False,
+       streamTimeout: Optional[float] = 60.0,
+       maxStreams: Optional[int] = None,
+       reorderDepth: int = 5,
+       maxHold: Optional[float] = None,
+       adaptiveReorder: bool = False,
+       docTimeout: Optional[float] = None,
+       maxDocSize: Optional[int] = None) -> None:
+        self._callback = callback
+        self._initialPorts = self._flattenPorts(ports)
+        self._demuxSSRC = demuxSSRC
+        self._demuxAddress = demuxAddress
+        self._timed = (maxHold is not None) or (docTimeout is not None)
+        self._streams = StreamTable(
+            encoding, bom, streamTimeout, maxStreams, reorderDepth, maxHold,
+            adaptiveReorder, docTimeout, maxDocSize)
+        self._expiryTimer = ExpiryTimer(self._onExpiryTimer)
+        self._transports: Dict[int, asyncio.DatagramTransport] = {}
+        self._load: Dict[int, PortLoad] = {}
+
+    @staticmethod
+    def _flattenPorts(ports: Iterable[Union[int, range]]) -> List[int]:
+        flattened: List[int] = []
+
+        for port in ports:
+            if isinstance(port, range):
+                flattened.extend(port)
+            else:
+                flattened.append(port)
+
+        return flattened
+
+    @property
+    def ports(self) -> List[int]:
+        return list(self._transports)
+
+    @property
+    def streamCount(self) -> int:
+        return len(self._streams)
+
+    @property
+    def streamsEvicted(self) -> int:
+        return self._streams.evicted
+
+    @property
+    def duplicatePackets(self) -> int:
+        return self._streams.duplicates
+
+    @property
+    def latePackets(self) -> int:
+        return self._streams.late
+
+    @property
+    def docsTimedOut(self) -> int:
+        return self._streams.docsTimedOut
+
+    @property
+    def docsOversize(self) -> int:
+        return self._streams.docsOversize
+
+    def portLoad(self) -> Dict[int, PortLoad]:
+        return dict(self._load)
+
+    async def start(self) -> None:
+        await self.addPorts(self._initialPorts)
+
+    async def addPort(self, port: int) -> int:
+        '''
+        Start receiving on `port`, and return the port bound. Port 0 binds an
+        ephemeral port.
+        '''
+        loop = asyncio.get_event_loop()
+
+        # Typeshed incorrectly assumes Base Transport and Protocol types
+        # Typeshed also incorrectly says local_addr's address can't be None
+        transport, _ = cast(
+            Tuple[asyncio.DatagramTransport, TTMLServerProtocol],
+            await loop.create_datagram_endpoint(
+                lambda: TTMLServerProtocol(self, port),
+                local_addr=(None, port),  # type: ignore
+                family=socket.AF_INET))
+
+        if port == 0:
+            port = transport.get_extra_info("sockname")[1]
+            cast(TTMLServerProtocol, transport.get_protocol())._port = port
+
+        self._transports[port] = transport
+        self._load[port] = PortLoad()
+
+        return port
+
+    async def addPorts(self, ports: Iterable[Union[int, range]]) -> List[int]:
+        return [
+            await self.addPort(port) for port in self._flattenPorts(ports)]
+
+    def removePort(self, port: int) -> None:
+        '''
+        Stop receiving on `port` and discard its streams' state.
+        '''
+        self._transports.pop(port).close()
+        del self._load[port]
+        self._streams.discard(lambda key: key[0] == port)  # type: ignore
+
+    def close(self) -> None:
+        self._expiryTimer.cancel()
+
+        for port in list(self._transports):
+            self.removePort(port)
+
+    def _onExpiryTimer(self) -> None:
+        for key, _, doc, timestamp in self._streams.expire(monotonic()):
+            port, streamID = cast(Tuple[int, StreamID], key)
+            load = self._load.get(port)
+            if load is not None:
+                load.docs += 1
+            self._callback(doc, timestamp, port, streamID)
+
+        deadline = self._streams.nextDeadline()
+        if deadline is not None:
+            self._expiryTimer.schedule(deadline)
+
+    def _processData(
+       self, port: int, data: bytes, addr: Tuple[str, int]) -> None:
+        load = self._load.get(port)
+        if load is None:
+            # Port removed with datagrams still queued
+            return
+
+        load.packets += 1
+        load.bytes += len(data)
+
+        try:
+            packet = RTPView(data)
+            streamID = StreamID(
+                packet.ssrc if self._demuxSSRC else None,
+                addr if self._demuxAddress else None)
+            key = (port, streamID)
+            stream = self._streams.get(key, streamID)
+            docs = stream.processPacket(packet, stream.lastSeen)
+        except (ValueError, AttributeError, IndexError, LengthError):
+            load.errors += 1
+            return
+
+        if self._timed:
+            self._streams.track(key, stream)
+
+            deadline = stream.deadline
+            if deadline is not None:
+                self._expiryTimer.schedule(deadline)
+
+        for doc, timestamp in docs:
+            load.docs += 1
+            self._callback(doc, timestamp, port, streamID)
@@ -13,27 +13,155 @@
 # limitations under the License.
 
 from __future__ import annotations
-from typing import List, Optional, Tuple, cast
+from typing import Iterable, List, Optional, Tuple, cast
 from datetime import datetime
 import socket
+import struct
+import sys
 import asyncio
 from random import randrange
-from rtp import RTP, PayloadType
-from rtpPayload_ttml import RTPPayload_TTML, utfEncode
+from time import perf_counter_ns
+from rtp import PayloadType
+from rtpPayload_ttml import LengthError, utfEncode
+from rtpPayload_ttml.utfUtils import BOMS
+from .mmsg import MMsgSender, sendmmsgAvailable
+from .pacing import PacedSender
+from .packetisationCache import PacketisationCache
+from .metrics import Snapshot, TransmitterMetrics
+from .tracing import Tracer, STAGE_FRAGMENT, STAGE_SERIALISE, STAGE_SEND
 
 EPOCH = datetime.utcfromtimestamp(0)
 
+RTP_VERSION = 2
+RTP_HEADER = struct.Struct("!BBHII")  # V/P/X/CC, M/PT, seq, ts, SSRC
+RTP_HEADER_LEN = RTP_HEADER.size
+RTP_HEADER_PATCH = struct.Struct("!BHI")  # M/PT, seq, ts from byte 1
+MAX_SEQ_NUM = (2**16) - 1
+PAYLOAD_HEADER = struct.Struct("!HH")  # Reserved bits, length
+
+
+def _utf8Boundary(encoded: bytearray, index: int) -> bool:
+    # UTF-8 continuation bytes are of the form 0b10xxxxxx
+    return (encoded[index] & 0xC0) != 0x80
+
+
+def _utf16beBoundary(encoded: bytearray, index: int) -> bool:
+    # Don't split code units, or a high surrogate from its low surrogate
+    return (index % 2 == 0) and not (0xDC <= encoded[index] <= 0xDF)
+
+
+def _utf16leBoundary(encoded: bytearray, index: int) -> bool:
+    return (index % 2 == 0) and not (0xDC <= encoded[index + 1] <= 0xDF)
+
+
+CHAR_BOUNDARY_CHECKS = {
+    "UTF-8": _utf8Boundary,
+    "UTF-16": _utf16beBoundary,
+    "UTF-16LE": _utf16leBoundary,
+    "UTF-16BE": _utf16beBoundary
+}
+
+
+class PacketBuffer:
+    '''
+    A reusable buffer holding serialised RTP packets back to back.
+
+    Packets are exposed as memoryviews onto the buffer, so are only valid
+    until the buffer is next cleared.
+    '''
+
+    def __init__(self, size: int = 2**16) -> None:
+        self._buffer = bytearray(size)
+        self._packets: List[Tuple[int, int]] = []
+        self._end = 0
+
+    def __len__(self) -> int:
+        return len(self._packets)
+
+    @property
+    def buffer(self) -> bytearray:
+        return self._buffer
+
+    @property
+    def byteLength(self) -> int:
+        return self._end
+
+    def clear(self) -> None:
+        self._packets.clear()
+        self._end = 0
+
+    def _grow(self, newEnd: int) -> None:
+        if newEnd > len(self._buffer):
+            # Grow into a new buffer rather than resizing in place, so that
+            # views onto earlier packets stay valid
+            newBuffer = bytearray(max(newEnd, 2 * len(self._buffer)))
+            newBuffer[:self._end] = memoryview(self._buffer)[:self._end]
+            self._buffer = newBuffer
+
+    def reserve(self, length: int) -> int:
+        '''
+        Reserve space for a packet of `length` bytes and return its offset.
+        '''
+        offset = self._end
+        self._grow(offset + length)
+
+        self._packets.append((offset, length))
+        self._end = offset + length
+
+        return offset
+
+    def extend(self, data: bytes, offsets: List[Tuple[int, int]]) -> None:
+        '''
+        Append packets previously taken from a buffer with `slice`.
+        '''
+        base = self._end
+        self._grow(base + len(data))
+
+        self._buffer[base:base+len(data)] = data
+        self._packets.extend(
+            (base + offset, length) for offset, length in offsets)
+        self._end = base + len(data)
+
+    def slice(self, firstPacket: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+        '''
+        Copy out the packets from `firstPacket` onwards, with offsets relative
+        to the start of the copy.
+        '''
+        if firstPacket >= len(self._packets):
+            return b"", []
+
+        base = self._packets[firstPacket][0]
+        data = bytes(memoryview(self._buffer)[base:self._end])
+        offsets = [
+            (offset - base, length)
+            for offset, length in self._packets[firstPacket:]]
+
+        return data, offsets
+
+    def offsets(self) -> List[Tuple[int, int]]:
+        return self._packets
+
+    def packets(self) -> List[memoryview]:
+        view = memoryview(self._buffer)
+
+        return [view[offset:offset+length] for offset, length in self._packets]
+
 
 class AsyncTTMLTransmitterConnection (object):
     def __init__(self, parent: TTMLTransmitter) -> None:
         self._parent = parent
         self._transport: Optional[asyncio.DatagramTransport]
         self._protocol: Optional[asyncio.DatagramProtocol]
+        self._pacer: Optional[PacedSender] = None
 
     @property
     def nextSeqNum(self):
         return self._parent._nextSeqNum
 
+    @property
+    def pacer(self) -> Optional[PacedSender]:
+        return self._pacer
+
     async def _open(self) -> None:
         loop = asyncio.get_event_loop()
 
@@ -45,43 +173,133 @@ class AsyncTTMLTransmitterConnection (object):
                 remote_addr=(self._parent._address, self._parent._port),
                 family=socket.AF_INET))
 
+        if (self._parent._bitRate is not None) or (
+           self._parent._packetGap is not None):
+            self._pacer = PacedSender(
+                self._transport,
+                bitRate=self._parent._bitRate,
+                packetGap=self._parent._packetGap,
+                maxPacketSize=(
+                    RTP_HEADER_LEN + PAYLOAD_HEADER.size +
+                    self._parent._maxFragmentSize))
+
     async def _close(self) -> None:
-        if self._transport is not None:
-            self._transport.close()
-            self._transport = None
+        try:
+            if self._pacer is not None:
+                await self._pacer.close()
+        finally:
+            self._pacer = None
+
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+
+    async def drain(self) -> None:
+        '''
+        Wait until all paced packets have been sent.
+        '''
+        if self._pacer is not None:
+            await self._pacer.drain()
 
     async def sendDoc(self, doc: str, time: datetime) -> None:
         if self._transport is None:
             return
 
-        for packet in self._parent._packetiseDoc(doc, time):
-            self._transport.sendto(packet.toBytes())
+        packets = self._parent._packetiseDocBuffer(doc, time)
+
+        tracer = self._parent._tracer
+        if tracer is not None:
+            start = perf_counter_ns()
+            self._send(packets)
+            tracer.record(STAGE_SEND, start, perf_counter_ns())
+        else:
+            self._send(packets)
+
+    def _send(self, packets: List[memoryview]) -> None:
+        assert self._transport is not None
+
+        if self._pacer is not None:
+            self._pacer.enqueue(packets)
+            return
+
+        for packet in packets:
+            self._transport.sendto(packet)
 
 
 class SyncTTMLTransmitterConnection (object):
     def __init__(self, parent: TTMLTransmitter) -> None:
         self._parent = parent
         self._socket: Optional[socket.socket]
+        self._mmsgSender: Optional[MMsgSender] = None
+        self._batchBuffer = PacketBuffer()
+        self._sendCalls = 0
 
     @property
     def nextSeqNum(self):
         return self._parent._nextSeqNum
 
+    @property
+    def batched(self) -> bool:
+        return self._mmsgSender is not None
+
+    @property
+    def sendCalls(self) -> int:
+        return self._sendCalls
+
     def _open(self) -> None:
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+        # Fall back to a sendto per packet if sendmmsg isn't available
+        if self._parent._batchSend and sendmmsgAvailable():
+            self._mmsgSender = MMsgSender(
+                self._socket, (self._parent._address, self._parent._port))
+
     def _close(self) -> None:
         if self._socket is not None:
             self._socket.close()
 
+    def _sendBuffer(self, packetBuffer: PacketBuffer) -> None:
+        tracer = self._parent._tracer
+        if tracer is not None:
+            start = perf_counter_ns()
+            self._sendBufferUntraced(packetBuffer)
+            tracer.record(STAGE_SEND, start, perf_counter_ns())
+        else:
+            self._sendBufferUntraced(packetBuffer)
+
+    def _sendBufferUntraced(self, packetBuffer: PacketBuffer) -> None:
+        assert self._socket is not None
+
+        if self._mmsgSender is not None:
+            self._sendCalls += self._mmsgSender.send(
+                packetBuffer.buffer, packetBuffer.offsets())
+            return
+
+        for packet in packetBuffer.packets():
+            self._socket.sendto(
+                packet, (self._parent._address, self._parent._port))
+            self._sendCalls += 1
+
     def sendDoc(self, doc: str, time: datetime) -> None:
         if self._socket is None:
             return
 
-        for packet in self._parent._packetiseDoc(doc, time):
-            self._socket.sendto(
-                packet.toBytes(),
-                (self._parent._address, self._parent._port))
+        self._parent._packetiseDocBuffer(doc, time)
+        self._sendBuffer(self._parent._packetBuffer)
+
+    def sendDocs(self, docs: Iterable[Tuple[str, datetime]]) -> None:
+        '''
+        Send several documents at once. In batched mode, the packets of all of
+        the documents are sent with as few syscalls as possible.
+        '''
+        if self._socket is None:
+            return
+
+        self._batchBuffer.clear()
+        for doc, time in docs:
+            self._parent._packetiseDocInto(doc, time, self._batchBuffer)
+
+        self._sendBuffer(self._batchBuffer)
 
 
 class TTMLTransmitter:
@@ -94,13 +312,35 @@ class TTMLTransmitter:
        initialSeqNum: Optional[int] = None,
        tsOffset: Optional[int] = None,
        encoding: str = "UTF-8",
-       bom: bool = False) -> None:
+       bom: bool = False,
+       ssrc: Optional[int] = None,
+       batchSend: bool = False,
+       bitRate: Optional[float] = None,
+       packetGap: Optional[float] = None,
+       cache: Optional[PacketisationCache] = None,
+       tracer: Optional[Tracer] = None) -> None:
         self._address = address
         self._port = port
         self._maxFragmentSize = maxFragmentSize
         self._payloadType = payloadType
         self._encoding = encoding
         self._bom = bom
+        self._batchSend = batchSend
+        self._cache = cache
+        self._tracer = tracer
+
+        if (bitRate is not None) and (packetGap is not None):
+            raise ValueError("Only one of bitRate and packetGap may be set")
+
+        if (bitRate is not None) and (bitRate <= 0):
+            raise ValueError("bitRate must be greater than 0")
+
+        if (packetGap is not None) and (packetGap <= 0):
+            raise ValueError("packetGap must be greater than 0")
+
+        # Pacing only applies to async connections
+        self._bitRate = bitRate
+        self._packetGap = packetGap
 
         if initialSeqNum is not None:
             self._nextSeqNum = initialSeqNum
@@ -112,6 +352,18 @@ class TTMLTransmitter:
         else:
             self._tsOffset = randrange(2**32)
 
+        if ssrc is not None:
+            self._ssrc = ssrc
+        else:
+            self._ssrc = randrange(2**32)
+
+        # Only marker, sequence number and timestamp change between packets
+        self._rtpHeaderTemplate = RTP_HEADER.pack(
+            RTP_VERSION << 6, self._payloadType.value, 0, 0, self._ssrc)
+
+        self._packetBuffer = PacketBuffer()
+        self._metrics = TransmitterMetrics()
+
         self._async_connection: Optional[AsyncTTMLTransmitterConnection] = None
         self._sync_connection: Optional[SyncTTMLTransmitterConnection] = None
 
@@ -139,25 +391,50 @@ class TTMLTransmitter:
     def nextSeqNum(self) -> int:
         return self._nextSeqNum
 
-    def _fragmentDoc(self, doc: str, maxLen: int) -> List[str]:
+    @property
+    def ssrc(self) -> int:
+        return self._ssrc
+
+    @property
+    def metrics(self) -> TransmitterMetrics:
+        return self._metrics
+
+    def metricsSnapshot(self) -> Snapshot:
+        return self._metrics.snapshot()
+
+    def _encodeDoc(self, doc: str) -> bytearray:
+        # The BOM is added per-packet, so isn't included here
+        return utfEncode(doc, self._encoding)
+
+    def _fragmentEncoded(
+       self, encoded: bytearray, maxLen: int) -> List[Tuple[int, int]]:
+        # Every fragment is sized as if it carries a BOM, so that fragment
+        # boundaries don't depend on fragment position
+        budget = maxLen
+        if self._bom:
+            budget -= len(BOMS[self._encoding])
+
+        isBoundary = CHAR_BOUNDARY_CHECKS[self._encoding]
+        docLen = len(encoded)
         fragments = []
         thisStart = 0
 
-        if doc == "":
-            return []
+        while thisStart < docLen:
+            thisEnd = thisStart + budget
 
-        while True:
-            thisEnd = thisStart + maxLen
-            while len(utfEncode(
-                    doc[thisStart:thisEnd], self._encoding, self._bom
-               )) > maxLen:
-                thisEnd -= 1
+            if thisEnd >= docLen:
+                thisEnd = docLen
+            else:
+                while (thisEnd > thisStart) and not isBoundary(
+                        encoded, thisEnd):
+                    thisEnd -= 1
 
-            fragments.append(doc[thisStart:thisEnd])
-
-            if thisEnd >= len(doc):
-                break
+                if thisEnd == thisStart:
+                    raise ValueError(
+                        "maxLen of {} is too small to hold a character".format(
+                            maxLen))
 
+            fragments.append((thisStart, thisEnd))
             thisStart = thisEnd
 
         return fragments
@@ -169,36 +446,114 @@ class TTMLTransmitter:
 
         return truncatedTS
 
-    def _generateRTPPacket(
-       self, doc: str, time: int, isFirst: bool, marker: bool) -> RTP:
-        # Only include bom in first packet for doc
-        thisBOM = (isFirst and self._bom)
-
-        packet = RTP(
-            timestamp=time,
-            sequenceNumber=self._nextSeqNum,
-            payload=RTPPayload_TTML(
-                    userDataWords=doc, encoding=self._encoding, bom=thisBOM
-                ).toBytearray(),
-            marker=marker,
-            payloadType=self._payloadType
-        )
-        self._nextSeqNum += 1
+    def _writeRTPHeader(
+       self, buffer: bytearray, offset: int, time: int, marker: bool) -> None:
+        buffer[offset:offset+RTP_HEADER_LEN] = self._rtpHeaderTemplate
+        RTP_HEADER_PATCH.pack_into(
+            buffer,
+            offset + 1,
+            (marker << 7) | self._payloadType.value,
+            self._nextSeqNum,
+            time)
+        self._nextSeqNum = (self._nextSeqNum + 1) % (MAX_SEQ_NUM + 1)
+
+    def _writeRTPHeaders(
+       self, buffer: bytearray, offsets: List[Tuple[int, int]],
+       time: int) -> None:
+        # The last packet of a document carries the marker
+        lastIndex = len(offsets) - 1
+        for x in range(len(offsets)):
+            self._writeRTPHeader(buffer, offsets[x][0], time, x == lastIndex)
+
+    def _layoutDocInto(self, doc: str, packetBuffer: PacketBuffer) -> None:
+        if self._cache is None:
+            self._layoutFragmentsInto(doc, packetBuffer)
+            return
 
-        return packet
+        # Keyed on everything that affects the layout, so that a cache can be
+        # shared between transmitters
+        key = (doc, self._encoding, self._bom, self._maxFragmentSize)
+        cached = self._cache.get(key)
 
-    def _packetiseDoc(self, doc, time):
-        packets = []
+        if cached is not None:
+            packetBuffer.extend(*cached)
+            return
 
-        rtpTs = self._datetimeToRTPTs(time)
-        docFragments = self._fragmentDoc(doc, self._maxFragmentSize)
+        firstPacket = len(packetBuffer)
+        self._layoutFragmentsInto(doc, packetBuffer)
+        # The document held by the key costs about as much as its payloads
+        self._cache.put(
+            key, *packetBuffer.slice(firstPacket), keySize=sys.getsizeof(doc))
+
+    def _layoutFragmentsInto(
+       self, doc: str, packetBuffer: PacketBuffer) -> None:
+        # Write each fragment's payload, leaving space for its RTP header
+        encoded = self._encodeDoc(doc)
+        encodedView = memoryview(encoded)
+        docFragments = self._fragmentEncoded(encoded, self._maxFragmentSize)
+
+        if self._bom:
+            bom = BOMS[self._encoding]
+        else:
+            bom = b""
 
-        lastIndex = len(docFragments) - 1
         for x in range(len(docFragments)):
-            isFirst = (x == 0)
-            isLast = (x == lastIndex)
-            packets.append(
-                self._generateRTPPacket(
-                    docFragments[x], rtpTs, isFirst, isLast))
-
-        return packets
+            start, end = docFragments[x]
+
+            # Only include bom in first packet for doc
+            thisBOM = bom if (x == 0) else b""
+            udwLen = len(thisBOM) + end - start
+            if udwLen >= 2**16:
+                raise LengthError(
+                    "userDataWords must be fewer than 2**16 bytes")
+
+            offset = packetBuffer.reserve(
+                RTP_HEADER_LEN + PAYLOAD_HEADER.size + udwLen)
+            buffer = packetBuffer.buffer
+            offset += RTP_HEADER_LEN
+
+            PAYLOAD_HEADER.pack_into(buffer, offset, 0, udwLen)
+            offset += PAYLOAD_HEADER.size
+
+            buffer[offset:offset+len(thisBOM)] = thisBOM
+            offset += len(thisBOM)
+
+            buffer[offset:offset+end-start] = encodedView[start:end]
+
+    def _packetiseDocInto(
+       self, doc: str, time: datetime, packetBuffer: PacketBuffer) -> None:
+        firstPacket = len(packetBuffer)
+        firstByte = packetBuffer.byteLength
+
+        if self._tracer is not None:
+            start = perf_counter_ns()
+            self._layoutDocInto(doc, packetBuffer)
+            laidOut = perf_counter_ns()
+            self._writeRTPHeaders(
+                packetBuffer.buffer,
+                packetBuffer.offsets()[firstPacket:],
+                self._datetimeToRTPTs(time))
+            end = perf_counter_ns()
+
+            self._tracer.record(STAGE_FRAGMENT, start, laidOut)
+            self._tracer.record(STAGE_SERIALISE, laidOut, end)
+        else:
+            self._layoutDocInto(doc, packetBuffer)
+            self._writeRTPHeaders(
+                packetBuffer.buffer,
+                packetBuffer.offsets()[firstPacket:],
+                self._datetimeToRTPTs(time))
+
+        packets = len(packetBuffer) - firstPacket
+        packetBytes = packetBuffer.byteLength - firstByte
+        self._metrics.observeDocument(
+            packets,
+            packetBytes,
+            packetBytes - packets * (RTP_HEADER_LEN + PAYLOAD_HEADER.size))
+
+    def _packetiseDocBuffer(self, doc: str, time: datetime) -> List[memoryview]:
+        # Packets are views onto a buffer that is reused by the next call
+        self._packetBuffer.clear()
+        self._packetiseDocInto(doc, time, self._packetBuffer)
+
+        return self._packetBuffer.packets()
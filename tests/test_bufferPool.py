@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from rtpTTML.bufferPool import BufferPool
+
+
+class TestBufferPool (TestCase):
+    def test_commit(self):
+        pool = BufferPool(maxDatagram=8, slabSize=32, count=1)
+
+        reserved = pool.reserve()
+        self.assertEqual(8, len(reserved))
+        reserved[:3] = b"abc"
+        first = pool.commit(3)
+
+        second = pool.copy(b"defg")
+
+        self.assertEqual(b"abc", bytes(first))
+        self.assertEqual(b"defg", bytes(second))
+        # Packed back to back
+        self.assertIs(first.obj, second.obj)
+
+    def test_reuse(self):
+        pool = BufferPool(maxDatagram=8, slabSize=16, count=2)
+
+        held = [pool.copy(bytes([x]) * 8) for x in range(4)]
+        # Both slabs are in use, so the next is allocated
+        held.append(pool.copy(b"x" * 8))
+        self.assertEqual(1, pool.allocated)
+        self.assertEqual(3, len(pool))
+
+        self.assertEqual(
+            [bytes([x]) * 8 for x in range(4)], [bytes(v) for v in held[:4]])
+
+        # Once the views are dropped, the slabs are reused
+        held.clear()
+        for x in range(20):
+            pool.copy(b"y" * 8)
+
+        self.assertEqual(1, pool.allocated)
+
+    def test_maxSlabs(self):
+        pool = BufferPool(maxDatagram=8, slabSize=8, count=1, maxSlabs=2)
+
+        held = [pool.copy(b"z" * 8) for x in range(4)]
+
+        self.assertEqual(2, len(pool))
+        self.assertEqual(3, pool.allocated)
+        self.assertEqual(4, len(held))
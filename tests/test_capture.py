@@ -0,0 +1,327 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime, timedelta
+import os
+import socket
+import struct
+import tempfile
+
+from rtpTTML import TTMLTransmitter
+from rtpTTML.capture import CaptureFlow, readCapture, replay
+
+SRC = ("192.0.2.1", 5000)
+EPOCH = datetime(2020, 1, 1)
+
+
+def udpIPv4(src, dst, payload):
+    udp = struct.pack("!HHHH", src[1], dst[1], 8 + len(payload), 0) + payload
+    ip = struct.pack(
+        "!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+        socket.inet_aton(src[0]), socket.inet_aton(dst[0]))
+    return ip + udp
+
+
+def ethernet(ip, vlan=False):
+    header = bytes(12)
+    if vlan:
+        header += struct.pack("!HH", 0x8100, 10)
+    return header + struct.pack("!H", 0x0800) + ip
+
+
+def writePcap(path, frames, linkType=1):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535,
+                            linkType))
+        for time, frame in frames:
+            f.write(struct.pack(
+                "<IIII", int(time), round((time % 1) * 1e6), len(frame),
+                len(frame)))
+            f.write(frame)
+
+
+def pcapngBlock(blockType, body):
+    body += bytes(-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack("<II", blockType, length) + body + struct.pack(
+        "<I", length)
+
+
+def writePcapng(path, frames):
+    with open(path, "wb") as f:
+        f.write(pcapngBlock(
+            0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+        # Nanosecond timestamps
+        options = struct.pack("<HHB3x", 9, 1, 9) + struct.pack("<HH", 0, 0)
+        f.write(pcapngBlock(1, struct.pack("<HHI", 1, 0, 65535) + options))
+        for time, frame in frames:
+            ts = round(time * 1e9)
+            f.write(pcapngBlock(6, struct.pack(
+                "<IIIII", 0, ts >> 32, ts & 0xffffffff, len(frame),
+                len(frame)) + frame))
+
+
+def writeRtpdump(path, packets, dst):
+    with open(path, "wb") as f:
+        f.write("#!rtpplay1.0 {}/{}\n".format(*dst).encode())
+        f.write(struct.pack(
+            "!IIIHH", 1577836800, 0,
+            struct.unpack("!I", socket.inet_aton(SRC[0]))[0], SRC[1], 0))
+        for ms, packet in packets:
+            f.write(struct.pack("!HHI", 8 + len(packet), len(packet), ms))
+            f.write(packet)
+        # An RTCP packet
+        f.write(struct.pack("!HHI", 12, 0, 0) + bytes(4))
+
+
+def makeStream(docs, ssrc, port, maxFragmentSize=100, interval=0.04):
+    transmitter = TTMLTransmitter(
+        "", port, ssrc=ssrc, maxFragmentSize=maxFragmentSize)
+    packets = []
+    for x, doc in enumerate(docs):
+        time = x * interval
+        for packet in transmitter._packetiseDocBuffer(
+           doc, EPOCH + timedelta(seconds=time)):
+            packets.append((time, bytes(packet)))
+
+    return transmitter, packets
+
+
+class TestCapture (TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.docs = ["document {} ".format(x) * 30 for x in range(5)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def check(self, path, expected, **kwargs):
+        received = []
+        stats = replay(
+            path, lambda doc, ts, flow: received.append((doc, ts, flow)),
+            **kwargs)
+
+        self.assertEqual(expected, sorted(received))
+        return stats
+
+    def test_pcap(self):
+        transmitter, packets = makeStream(self.docs, 1, 1234)
+        dst = ("198.51.100.1", 1234)
+        path = self.path("test.pcap")
+        writePcap(path, [
+            (1e9 + t, ethernet(udpIPv4(SRC, dst, p), vlan=x % 2 == 0))
+            for x, (t, p) in enumerate(packets)])
+
+        datagrams = list(readCapture(path))
+        self.assertEqual(len(packets), len(datagrams))
+        self.assertEqual(SRC, datagrams[0].src)
+        self.assertEqual(dst, datagrams[0].dst)
+        self.assertEqual(packets[0][1], bytes(datagrams[0].data))
+        self.assertAlmostEqual(1e9 + packets[-1][0], datagrams[-1].time,
+                               places=5)
+
+        flow = CaptureFlow(SRC, dst, 1)
+        stats = self.check(path, sorted(
+            (doc, transmitter._datetimeToRTPTs(
+                EPOCH + timedelta(seconds=x * 0.04)), flow)
+            for x, doc in enumerate(self.docs)))
+        self.assertEqual(len(self.docs), stats.docs)
+        self.assertEqual(1, stats.flows)
+
+    def test_pcapng(self):
+        _, packets = makeStream(self.docs, 1, 1234)
+        dst = ("198.51.100.1", 1234)
+        path = self.path("test.pcapng")
+        writePcapng(path, [
+            (1e6 + t, ethernet(udpIPv4(SRC, dst, p))) for t, p in packets])
+
+        datagrams = list(readCapture(path))
+        self.assertEqual(len(packets), len(datagrams))
+        self.assertAlmostEqual(1e6 + packets[1][0], datagrams[1].time,
+                               places=6)
+        stats = self.check(path, [], ports=[4321])
+        self.assertEqual(0, stats.matched)
+
+        received = []
+        replay(path, lambda doc, ts, flow: received.append(doc))
+        self.assertEqual(self.docs, received)
+
+    def test_rtpdump(self):
+        _, packets = makeStream(self.docs, 1, 1234)
+        dst = ("198.51.100.1", 1234)
+        path = self.path("test.rtpdump")
+        writeRtpdump(path, [(round(t * 1000), p) for t, p in packets], dst)
+
+        datagrams = list(readCapture(path))
+        self.assertEqual(len(packets), len(datagrams))
+        self.assertEqual(SRC, datagrams[0].src)
+        self.assertEqual(dst, datagrams[0].dst)
+        self.assertAlmostEqual(1577836800.16, datagrams[-1].time)
+
+        received = []
+        replay(path, lambda doc, ts, flow: received.append(doc))
+        self.assertEqual(self.docs, received)
+
+    def test_filter(self):
+        frames = []
+        for ssrc, port in ((1, 1234), (2, 1234), (3, 4321)):
+            _, packets = makeStream(self.docs, ssrc, port)
+            dst = ("198.51.100.1", port)
+            frames += [(t, udpIPv4(SRC, dst, p)) for t, p in packets]
+        # Interleave the flows by capture time
+        frames.sort(key=lambda frame: frame[0])
+
+        path = self.path("test.pcap")
+        writePcap(path, frames, linkType=101)
+
+        def ssrcsSeen(**kwargs):
+            seen = []
+            replay(path, lambda doc, ts, flow: seen.append(flow.ssrc),
+                   **kwargs)
+            return sorted(set(seen))
+
+        self.assertEqual([1, 2, 3], ssrcsSeen())
+        self.assertEqual([1, 2], ssrcsSeen(ports=[1234]))
+        self.assertEqual([2], ssrcsSeen(ports=[1234], ssrcs=[2, 3]))
+
+    def test_reordered(self):
+        transmitter, packets = makeStream(self.docs, 1, 1234)
+        dst = ("198.51.100.1", 1234)
+        # Swap pairs of packets after the first
+        swapped = packets[:1]
+        for x in range(1, len(packets) - 1, 2):
+            swapped += [packets[x + 1], packets[x]]
+        swapped += packets[len(swapped):]
+
+        path = self.path("test.pcap")
+        writePcap(path, [(t, udpIPv4(SRC, dst, p)) for t, p in swapped],
+                  linkType=101)
+
+        received = []
+        replay(path, lambda doc, ts, flow: received.append(doc))
+        self.assertEqual(self.docs, received)
+
+    def test_notRTP(self):
+        path = self.path("test.pcap")
+        dst = ("198.51.100.1", 1234)
+        writePcap(path, [(0.0, udpIPv4(SRC, dst, b"\x00" * 20))],
+                  linkType=101)
+
+        stats = replay(path, lambda doc, ts, flow: None)
+        self.assertEqual(1, stats.datagrams)
+        self.assertEqual(1, stats.errors)
+        self.assertEqual(0, stats.docs)
+
+    def test_badFile(self):
+        path = self.path("test.txt")
+        with open(path, "wb") as f:
+            f.write(b"not a capture file")
+
+        with self.assertRaises(ValueError):
+            readCapture(path)
+
+    def test_realTime(self):
+        _, packets = makeStream(self.docs, 1, 1234, interval=0.02)
+        path = self.path("test.pcap")
+        writePcap(path, [
+            (t, udpIPv4(SRC, ("198.51.100.1", 1234), p)) for t, p in packets],
+            linkType=101)
+
+        with self.assertRaises(ValueError):
+            replay(path, lambda doc, ts, flow: None, realTime=True, workers=2)
+
+        received = []
+        stats = replay(path, lambda doc, ts, flow: received.append(doc),
+                       realTime=True, speed=2.0)
+        self.assertEqual(self.docs, received)
+        self.assertEqual(len(self.docs), stats.docs)
+
+    def test_speed(self):
+        _, packets = makeStream(self.docs, 1, 1234)
+        path = self.path("test.pcap")
+        writePcap(path, [
+            (t, udpIPv4(SRC, ("198.51.100.1", 1234), p)) for t, p in packets],
+            linkType=101)
+
+        for speed in (0.0, -1.0):
+            with self.assertRaises(ValueError):
+                replay(path, lambda doc, ts, flow: None, realTime=True,
+                       speed=speed)
+
+    def test_workers(self):
+        frames = []
+        expected = []
+        for ssrc in range(1, 9):
+            _, packets = makeStream(self.docs, ssrc, 1234)
+            dst = ("198.51.100.1", 1234)
+            frames += [(t, udpIPv4(SRC, dst, p)) for t, p in packets]
+            expected += [(ssrc, doc) for doc in self.docs]
+        frames.sort(key=lambda frame: frame[0])
+
+        path = self.path("test.pcap")
+        writePcap(path, frames, linkType=101)
+
+        received = []
+        stats = replay(
+            path, lambda doc, ts, flow: received.append((flow.ssrc, doc)),
+            workers=3)
+
+        self.assertEqual(sorted(expected), sorted(received))
+        self.assertEqual(len(frames), stats.datagrams)
+        self.assertEqual(8, stats.flows)
+        # Documents within a flow stay in order
+        for ssrc in range(1, 9):
+            self.assertEqual(
+                self.docs, [doc for s, doc in received if s == ssrc])
+
+    def test_workerErrors(self):
+        # Reassembly errors are counted once, by the worker owning the flow,
+        # and parse errors once for all workers
+        dst = ("198.51.100.1", 1234)
+        _, packets = makeStream(self.docs, 1, 1234)
+        # The next packet, with reserved bits set in the payload header
+        bad = bytearray(packets[-1][1])
+        struct.pack_into(
+            "!H", bad, 2, (struct.unpack_from("!H", bad, 2)[0] + 1) % 2**16)
+        bad[12] = 1
+        frames = [(t, udpIPv4(SRC, dst, p)) for t, p in packets]
+        frames += [
+            (1.0, udpIPv4(SRC, dst, bytes(bad))),
+            (1.0, udpIPv4(SRC, dst, b"\x00" * 20))]
+
+        path = self.path("test.pcap")
+        writePcap(path, frames, linkType=101)
+
+        for workers in (1, 3):
+            stats = replay(path, lambda doc, ts, flow: None, workers=workers)
+            self.assertEqual(2, stats.errors)
+            self.assertEqual(1, stats.parseErrors)
+
+    def test_workerFailure(self):
+        # A worker that fails raises its exception rather than hanging
+        _, packets = makeStream(self.docs, 1, 1234)
+        path = self.path("test.pcapng")
+        writePcapng(path, [
+            (t, udpIPv4(SRC, ("198.51.100.1", 1234), p)) for t, p in packets])
+        with open(path, "ab") as f:
+            f.write(struct.pack("<III", 6, 8, 0))
+
+        with self.assertRaises(ValueError):
+            replay(path, lambda doc, ts, flow: None, workers=2)
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+
+from rtpTTML import CallbackDispatcher
+from rtpTTML.dispatch import DocumentQueue
+
+
+class TestCallbackDispatcher (TestCase):
+    def setUp(self):
+        self.received = []
+        self.gate = threading.Event()
+
+    def blockedCallback(self, *args):
+        self.gate.wait()
+        self.received.append(args)
+
+    def startBlocked(self, **kwargs):
+        dispatcher = CallbackDispatcher(self.blockedCallback, **kwargs)
+
+        # Wait for the worker to take the first call and block on the gate
+        dispatcher("first", 0)
+        while dispatcher.queueDepth != 0:
+            pass
+
+        return dispatcher
+
+    def test_dispatch(self):
+        dispatcher = CallbackDispatcher(
+            lambda *args: self.received.append(args), workers=2)
+
+        for n in range(100):
+            dispatcher("doc", n)
+        dispatcher.close()
+
+        self.assertEqual(
+            sorted(self.received), [("doc", n) for n in range(100)])
+        self.assertEqual(dispatcher.dispatched, 100)
+        self.assertEqual(dispatcher.dropped, 0)
+
+    def test_dropNewest(self):
+        dispatcher = self.startBlocked(maxQueue=2, overflow="drop-newest")
+
+        self.assertTrue(dispatcher.submit("a", 1))
+        self.assertTrue(dispatcher.submit("b", 2))
+        self.assertFalse(dispatcher.submit("c", 3))
+        self.assertEqual(dispatcher.queueDepth, 2)
+        self.assertEqual(dispatcher.dropped, 1)
+
+        self.gate.set()
+        dispatcher.close()
+
+        self.assertEqual(self.received, [("first", 0), ("a", 1), ("b", 2)])
+        self.assertEqual(dispatcher.maxQueueDepth, 2)
+
+    def test_dropOldest(self):
+        dispatcher = self.startBlocked(maxQueue=2, overflow="drop-oldest")
+
+        dispatcher("a", 1)
+        dispatcher("b", 2)
+        self.assertFalse(dispatcher.submit("c", 3))
+        self.assertEqual(dispatcher.dropped, 1)
+
+        self.gate.set()
+        dispatcher.close()
+
+        self.assertEqual(self.received, [("first", 0), ("b", 2), ("c", 3)])
+
+    def test_block(self):
+        dispatcher = self.startBlocked(maxQueue=1, overflow="block")
+        dispatcher("a", 1)
+
+        submitted = threading.Event()
+
+        def submit():
+            dispatcher("b", 2)
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+
+        self.assertFalse(submitted.wait(0.1))
+        self.gate.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        dispatcher.close()
+
+        self.assertEqual(self.received, [("first", 0), ("a", 1), ("b", 2)])
+        self.assertEqual(dispatcher.dropped, 0)
+
+    def test_closeWhileBlocked(self):
+        dispatcher = self.startBlocked(maxQueue=1, overflow="block")
+        dispatcher("a", 1)
+
+        errors = []
+
+        def submit():
+            try:
+                dispatcher("b", 2)
+            except RuntimeError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        while not dispatcher._notFull._waiters:
+            pass
+
+        # The blocked producer is released rather than queueing a call
+        # after close
+        dispatcher.close(wait=False)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(errors))
+        self.assertEqual(0, dispatcher.queueDepth)
+
+        self.gate.set()
+
+    def test_closeNoWait(self):
+        dispatcher = self.startBlocked(maxQueue=4)
+        dispatcher("a", 1)
+        dispatcher("b", 2)
+
+        dispatcher.close(wait=False)
+        self.assertEqual(dispatcher.dropped, 2)
+        self.assertEqual(dispatcher.queueDepth, 0)
+
+        with self.assertRaises(RuntimeError):
+            dispatcher("c", 3)
+
+        self.gate.set()
+
+    def test_errors(self):
+        def callback(doc, ts):
+            if ts % 2:
+                raise ValueError()
+            self.received.append((doc, ts))
+
+        dispatcher = CallbackDispatcher(callback)
+        with self.assertLogs("rtpTTML.dispatch"):
+            for n in range(4):
+                dispatcher("doc", n)
+            dispatcher.close()
+
+        self.assertEqual(dispatcher.errors, 2)
+        self.assertEqual(dispatcher.dispatched, 4)
+        self.assertEqual(self.received, [("doc", 0), ("doc", 2)])
+
+    def test_executor(self):
+        with ThreadPoolExecutor(2) as executor:
+            dispatcher = CallbackDispatcher(
+                lambda *args: self.received.append(args),
+                workers=2, executor=executor)
+
+            for n in range(10):
+                dispatcher("doc", n)
+            dispatcher.close()
+
+        self.assertEqual(
+            sorted(self.received), [("doc", n) for n in range(10)])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            CallbackDispatcher(print, overflow="sometimes")
+
+        with self.assertRaises(ValueError):
+            CallbackDispatcher(print, maxQueue=0)
+
+
+class TestDocumentQueue (TestCase):
+    def runAsync(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    async def async_test_iterate(self):
+        queue = DocumentQueue()
+        for x in range(3):
+            queue.put(("doc", x))
+        queue.close()
+        # Closed queues don't accept more
+        queue.put(("doc", 3))
+
+        self.assertEqual(
+            [("doc", 0), ("doc", 1), ("doc", 2)],
+            [item async for item in queue])
+
+    def test_iterate(self):
+        self.runAsync(self.async_test_iterate())
+
+    async def async_test_dropOldest(self):
+        queue = DocumentQueue(maxQueue=2)
+        for x in range(5):
+            queue.put(("doc", x))
+
+        self.assertEqual(3, queue.dropped)
+        self.assertEqual(2, queue.maxQueueDepth)
+        self.assertEqual([("doc", 3), ("doc", 4)], await queue.getBatch())
+
+    def test_dropOldest(self):
+        self.runAsync(self.async_test_dropOldest())
+
+    async def async_test_dropNewest(self):
+        queue = DocumentQueue(maxQueue=2, overflow="drop-newest")
+        for x in range(5):
+            queue.put(("doc", x))
+
+        self.assertEqual(3, queue.dropped)
+        self.assertEqual([("doc", 0), ("doc", 1)], await queue.getBatch())
+
+    def test_dropNewest(self):
+        self.runAsync(self.async_test_dropNewest())
+
+    def test_block(self):
+        with self.assertRaises(ValueError):
+            DocumentQueue(overflow="block")
+
+    def test_noLoop(self):
+        # Queues belong to the loop running when they are created
+        with self.assertRaises(RuntimeError):
+            DocumentQueue()
+
+    async def async_test_wait(self):
+        queue = DocumentQueue()
+        loop = asyncio.get_event_loop()
+        loop.call_soon(queue.put, ("doc", 0))
+        loop.call_soon(queue.put, ("doc", 1))
+
+        # Waits for the first document, then takes all that are queued
+        self.assertEqual(("doc", 0), await queue.get())
+        self.assertEqual([("doc", 1)], await queue.getBatch())
+
+        loop.call_soon(queue.close)
+        self.assertEqual([], await queue.getBatch())
+        with self.assertRaises(StopAsyncIteration):
+            await queue.get()
+
+    def test_wait(self):
+        self.runAsync(self.async_test_wait())
+
+    async def async_test_threaded(self):
+        queue = DocumentQueue()
+
+        def produce():
+            for x in range(100):
+                queue.put(("doc", x))
+            queue.close()
+
+        thread = threading.Thread(target=produce)
+        thread.start()
+        received = [item async for item in queue]
+        thread.join()
+
+        self.assertEqual([("doc", x) for x in range(100)], received)
+
+    def test_threaded(self):
+        self.runAsync(self.async_test_threaded())
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+import socket
+
+from rtpTTML import TTMLTransmitter
+from rtpTTML.impairment import Impairment, ImpairmentRelay, simulate
+
+
+def makeDocs(count):
+    return ["document {} ".format(x) * 50 for x in range(count)]
+
+
+class TestImpairment (TestCase):
+    def test_none(self):
+        impairment = Impairment()
+
+        for x in range(10):
+            impairment.send(bytes([x]), float(x))
+
+        self.assertEqual(
+            [bytes([x]) for x in range(5)], impairment.receive(4.0))
+        self.assertEqual(5.0, impairment.nextDelivery())
+
+    def test_seeded(self):
+        def run(seed):
+            impairment = Impairment(
+                loss=0.1, reorder=0.1, duplicate=0.1, jitter=0.01, seed=seed)
+            for x in range(100):
+                impairment.send(bytes([x]), x * 0.001)
+            impairment.flush(1.0)
+            return impairment.receive(2.0)
+
+        self.assertEqual(run(1), run(1))
+        self.assertNotEqual(run(1), run(2))
+
+    def test_reorder(self):
+        impairment = Impairment(reorder=1.0, reorderDepth=2)
+
+        for x in range(3):
+            impairment.send(bytes([x]), 0.0)
+
+        # Each datagram is held back until two more have been sent
+        self.assertEqual([bytes([0])], impairment.receive(0.0))
+        impairment.flush(0.0)
+        self.assertEqual([bytes([1]), bytes([2])], impairment.receive(0.0))
+        self.assertEqual(3, impairment.reordered)
+
+    def test_burstLoss(self):
+        impairment = Impairment(burstLoss=0.01, burstLength=10, seed=3)
+
+        for x in range(10000):
+            impairment.send(bytes(1), 0.0)
+
+        received = 10000 - impairment.dropped
+        self.assertEqual(received, len(impairment.receive(0.0)))
+        self.assertGreater(impairment.dropped, 400)
+        self.assertLess(impairment.dropped, 1600)
+
+    def test_delay(self):
+        impairment = Impairment(
+            delay=0.1, jitter=0.05, jitterDistribution="exponential")
+
+        impairment.send(b"a", 0.0)
+        self.assertEqual([], impairment.receive(0.1 - 1e-9))
+        self.assertGreaterEqual(impairment.nextDelivery(), 0.1)
+
+        with self.assertRaises(ValueError):
+            Impairment(jitterDistribution="pareto")
+
+
+class TestSimulate (TestCase):
+    def test_clean(self):
+        report = simulate(
+            makeDocs(20), Impairment(), TTMLTransmitter(
+                "", 0, maxFragmentSize=100))
+
+        self.assertEqual(20, report.docsCompleted)
+        self.assertEqual(1.0, report.completionRate)
+        self.assertEqual(0.0, report.latencyMax)
+
+    def test_reorderRecovered(self):
+        report = simulate(
+            makeDocs(20),
+            Impairment(reorder=0.2, reorderDepth=2, duplicate=0.1, seed=5),
+            TTMLTransmitter("", 0, maxFragmentSize=100),
+            reorderDepth=5)
+
+        self.assertGreater(report.packetsReordered, 0)
+        self.assertEqual(20, report.docsCompleted)
+        self.assertEqual(0, report.docsCorrupt)
+
+    def test_lossDeterministic(self):
+        def run():
+            return simulate(
+                makeDocs(50),
+                Impairment(loss=0.02, seed=7),
+                TTMLTransmitter(
+                    "", 0, maxFragmentSize=100, initialSeqNum=0, tsOffset=0),
+                maxHold=0.02)
+
+        report = run()
+        self.assertEqual(report, run())
+        self.assertLess(report.docsCompleted, 50)
+        self.assertGreater(report.docsCompleted, 0)
+        self.assertEqual(0, report.docsCorrupt)
+        self.assertLessEqual(report.latencyMax, 0.02 + 1e-9)
+
+    def test_reorderDepth(self):
+        # Jitter reorders the six packets of each document. A reorder buffer
+        # too small to hold a document gives up on packets still to come.
+        def run(reorderDepth):
+            return simulate(
+                makeDocs(50),
+                Impairment(jitter=0.005, seed=7),
+                TTMLTransmitter("", 0, maxFragmentSize=100),
+                reorderDepth=reorderDepth,
+                maxHold=0.02)
+
+        shallow = run(5)
+        deep = run(8)
+        self.assertGreater(deep.completionRate, shallow.completionRate)
+        self.assertGreater(deep.completionRate, 0.95)
+
+
+class TestImpairmentRelay (TestCase):
+    def test_relay(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(1.0)
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        with ImpairmentRelay(
+           receiver.getsockname(), Impairment(duplicate=1.0)) as relay:
+            sender.sendto(b"abc", ("127.0.0.1", relay.port))
+            received = [receiver.recv(100), receiver.recv(100)]
+
+        sender.close()
+        receiver.close()
+        self.assertEqual([b"abc", b"abc"], received)
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime
+from urllib.request import urlopen
+import threading
+
+from rtpTTML import MetricsExporter, TTMLReceiver, TTMLTransmitter
+from rtpTTML.metrics import Histogram, HistogramSnapshot, formatPrometheus
+
+
+class TestHistogram (TestCase):
+    def test_observe(self):
+        histogram = Histogram([10, 1, 5])
+
+        for value in (0, 1, 2, 5, 6, 100):
+            histogram.observe(value)
+
+        self.assertEqual(
+            HistogramSnapshot((1, 5, 10), (2, 2, 1, 1), 114.0, 6),
+            histogram.snapshot())
+
+    def test_merge(self):
+        histogram = Histogram([1, 5])
+        other = Histogram([1, 5])
+        histogram.observe(0)
+        other.observe(2)
+        other.observe(6)
+
+        histogram.merge(other.snapshot())
+        self.assertEqual(
+            HistogramSnapshot((1, 5), (1, 1, 1), 8.0, 3),
+            histogram.snapshot())
+
+        with self.assertRaises(ValueError):
+            histogram.merge(Histogram([1]).snapshot())
+
+
+class TestPrometheus (TestCase):
+    def test_format(self):
+        histogram = Histogram([1, 2])
+        histogram.observe(1.5)
+
+        text = formatPrometheus({
+            "a": lambda: {"packets": 3, "size": histogram.snapshot()},
+            "b": lambda: {"packets": 4, "streams": 2}})
+
+        self.assertEqual(
+            "# TYPE rtpttml_packets_total counter\n"
+            'rtpttml_packets_total{source="a"} 3\n'
+            'rtpttml_packets_total{source="b"} 4\n'
+            "# TYPE rtpttml_size histogram\n"
+            'rtpttml_size_bucket{source="a",le="1"} 0\n'
+            'rtpttml_size_bucket{source="a",le="2"} 1\n'
+            'rtpttml_size_bucket{source="a",le="+Inf"} 1\n'
+            'rtpttml_size_sum{source="a"} 1.5\n'
+            'rtpttml_size_count{source="a"} 1\n'
+            "# TYPE rtpttml_streams gauge\n"
+            'rtpttml_streams{source="b"} 2\n',
+            text)
+
+    def test_exporter(self):
+        with MetricsExporter({"a": lambda: {"packets": 3}}, port=0) as exporter:
+            with urlopen(
+               "http://127.0.0.1:{}/metrics".format(exporter.port)) as resp:
+                body = resp.read().decode("utf-8")
+
+        self.assertIn('rtpttml_packets_total{source="a"} 3\n', body)
+
+
+class TestMetrics (TestCase):
+    def test_transmitter(self):
+        tx = TTMLTransmitter("", 0, maxFragmentSize=4)
+        tx._packetiseDocBuffer("abcdefghij", datetime.now())
+
+        snapshot = tx.metricsSnapshot()
+        self.assertEqual(1, snapshot["docs"])
+        self.assertEqual(3, snapshot["packets"])
+        self.assertEqual(3 * 16 + 10, snapshot["bytes"])
+        self.assertEqual(10, snapshot["docBytes"].sum)
+        self.assertEqual(3, snapshot["fragmentsPerDoc"].sum)
+
+    def test_receiver(self):
+        tx = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, initialSeqNum=0, tsOffset=0)
+        packets = []
+        for second, doc in enumerate(["abcdefgh", "ijkl", "mnop", "qrst"]):
+            time = datetime(2020, 1, 1, 0, 0, second)
+            packets += [bytes(p) for p in tx._packetiseDocBuffer(doc, time)]
+
+        docs = []
+        receiver = TTMLReceiver(0, lambda doc, ts: docs.append(doc))
+
+        # Swap the second and third documents
+        for index in (0, 1, 3, 2, 4):
+            receiver._processData(packets[index])
+
+        snapshot = receiver.metricsSnapshot()
+        self.assertEqual(["abcdefgh", "ijkl", "mnop", "qrst"], docs)
+        self.assertEqual(5, snapshot["packets"])
+        self.assertEqual(sum(len(p) for p in packets), snapshot["bytes"])
+        self.assertEqual(4, snapshot["docs"])
+        self.assertEqual(1, snapshot["reordered"])
+        self.assertEqual(0, snapshot["lost"])
+        self.assertEqual(1, snapshot["streams"])
+        self.assertEqual(5, snapshot["fragmentsPerDoc"].sum)
+
+        stats = receiver.streamStats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual(1, list(stats.values())[0]["reordered"])
+
+    def test_scrapeWhileChurning(self):
+        # Snapshots are taken from an exporter's thread while streams are
+        # added and evicted
+        packets = []
+        for ssrc in range(2000):
+            tx = TTMLTransmitter("", 0, maxFragmentSize=4, ssrc=ssrc)
+            packets += [
+                bytes(p) for p in tx._packetiseDocBuffer(
+                    "abcdefgh", datetime(2020, 1, 1))]
+
+        receiver = TTMLReceiver(
+            0, lambda *args: None, demuxSSRC=True, maxStreams=200)
+        done = threading.Event()
+        errors = []
+        scrapes = []
+
+        def scrape():
+            while not done.is_set():
+                try:
+                    formatPrometheus({"rx": receiver.metricsSnapshot})
+                    receiver.streamStats()
+                    scrapes.append(1)
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=scrape)
+        thread.start()
+        try:
+            for _ in range(3):
+                for packet in packets:
+                    receiver._processData(packet)
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertGreater(len(scrapes), 0)
+        self.assertEqual(200, receiver.metricsSnapshot()["streams"])
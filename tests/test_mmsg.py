@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase, skipUnless
+import socket
+
+from rtpTTML.mmsg import (
+    MMsgSender, MMsgReceiver, sendmmsgAvailable, recvmmsgAvailable,
+    MAX_BATCH)
+
+
+@skipUnless(sendmmsgAvailable(), "sendmmsg not available")
+class TestMMsgSender (TestCase):
+    def setUp(self):
+        self.rxSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rxSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
+        self.rxSocket.bind(("127.0.0.1", 0))
+        self.rxSocket.settimeout(1.0)
+        self.txSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender = MMsgSender(
+            self.txSocket, self.rxSocket.getsockname())
+
+    def tearDown(self):
+        self.rxSocket.close()
+        self.txSocket.close()
+
+    def test_send(self):
+        buffer = bytearray(b"abcdefghij")
+        packets = [(0, 3), (3, 1), (4, 6)]
+
+        calls = self.sender.send(buffer, packets)
+
+        self.assertEqual(1, calls)
+        received = [self.rxSocket.recv(2**16) for _ in packets]
+        self.assertEqual([b"abc", b"d", b"efghij"], received)
+
+    def test_sendLargeBatch(self):
+        count = MAX_BATCH + 10
+        buffer = bytearray(x % 256 for x in range(count))
+        packets = [(x, 1) for x in range(count)]
+
+        calls = self.sender.send(buffer, packets)
+
+        self.assertEqual(2, calls)
+        received = [self.rxSocket.recv(2**16) for _ in packets]
+        self.assertEqual([bytes([x % 256]) for x in range(count)], received)
+
+    def test_sendEmpty(self):
+        self.assertEqual(0, self.sender.send(bytearray(), []))
+
+
+@skipUnless(recvmmsgAvailable(), "recvmmsg not available")
+class TestMMsgReceiver (TestCase):
+    def setUp(self):
+        self.rxSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rxSocket.bind(("127.0.0.1", 0))
+        self.txSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.rxSocket.close()
+        self.txSocket.close()
+
+    def test_recv(self):
+        self.rxSocket.settimeout(1.0)
+        receiver = MMsgReceiver(self.rxSocket, batchSize=4, bufSize=16)
+        sent = [bytes([x]) * (x + 1) for x in range(6)]
+        for data in sent:
+            self.txSocket.sendto(data, self.rxSocket.getsockname())
+
+        received = [bytes(d) for d in receiver.recv()]
+        received += [bytes(d) for d in receiver.recv()]
+
+        self.assertEqual(sent, received)
+        self.assertEqual(2, receiver.syscalls)
+
+    def test_recvFrom(self):
+        self.rxSocket.settimeout(1.0)
+        receiver = MMsgReceiver(self.rxSocket, batchSize=4, bufSize=16)
+        self.txSocket.sendto(b"abc", self.rxSocket.getsockname())
+        self.txSocket.sendto(b"def", self.rxSocket.getsockname())
+        txAddr = ("127.0.0.1", self.txSocket.getsockname()[1])
+
+        self.assertEqual(
+            [(b"abc", txAddr), (b"def", txAddr)],
+            [(bytes(d), a) for d, a in receiver.recvFrom()])
+
+    def test_recvBlocking(self):
+        self.rxSocket.settimeout(None)
+        receiver = MMsgReceiver(self.rxSocket, batchSize=4, bufSize=16)
+        self.txSocket.sendto(b"abc", self.rxSocket.getsockname())
+
+        self.assertEqual([b"abc"], [bytes(d) for d in receiver.recv()])
+
+    def test_recvTimeout(self):
+        self.rxSocket.settimeout(0.01)
+        receiver = MMsgReceiver(self.rxSocket)
+
+        with self.assertRaises(socket.timeout):
+            receiver.recv()
@@ -155,3 +155,184 @@ class TestOrderedBuffer (TestCase):
 
         self.assertEqual(len(expectedList), len(receivedList))
         self.assertEqual(expectedList, receivedList)
+
+    @given(st.integers(min_value=0, max_value=MAX_SEQ_NUM))
+    def test_duplicates(self, startKey):
+        packets = []
+        for x in range(3):
+            seqNum = (startKey + x) % (MAX_SEQ_NUM + 1)
+            packets.append((seqNum, RTP(sequenceNumber=seqNum)))
+
+        # Duplicate of a packet already delivered, and of one still held
+        self.buffer.pushGet(*packets[0])
+        self.buffer.pushGet(*packets[0])
+        self.buffer.pushGet(*packets[2])
+        self.buffer.pushGet(*packets[2])
+
+        self.assertEqual(2, self.buffer.duplicates)
+        self.assertEqual(0, self.buffer.late)
+        self.assertEqual([packets[1][1], packets[2][1]],
+                         self.buffer.pushGet(*packets[1]))
+
+    @given(st.integers(min_value=0, max_value=MAX_SEQ_NUM))
+    def test_late(self, startKey):
+        packets = []
+        for x in range(7):
+            seqNum = (startKey + x) % (MAX_SEQ_NUM + 1)
+            packets.append((seqNum, RTP(sequenceNumber=seqNum)))
+
+        received = self.buffer.pushGet(*packets[0])
+        for seqNum, packet in packets[2:]:
+            received += self.buffer.pushGet(seqNum, packet)
+
+        # The window has moved past packet 1 by the time it arrives
+        received += self.buffer.pushGet(*packets[1])
+
+        self.assertEqual(1, self.buffer.late)
+        self.assertEqual(0, self.buffer.duplicates)
+        self.assertEqual(
+            [p for i, (_, p) in enumerate(packets) if i != 1], received)
+
+    @given(
+        st.integers(min_value=0, max_value=MAX_SEQ_NUM),
+        st.integers(min_value=5, max_value=(MAX_SEQ_NUM + 1) // 2 - 3))
+    def test_pushGetGap(self, startKey, gap):
+        # Held packets are released, in order, when a packet arrives far
+        # enough ahead to move the window past them
+        keys = [(startKey + x) % (MAX_SEQ_NUM + 1) for x in (0, 2, 3)]
+        packets = [RTP(sequenceNumber=k) for k in keys]
+
+        received = []
+        for key, packet in zip(keys, packets):
+            received += self.buffer.pushGet(key, packet)
+        self.assertEqual(packets[:1], received)
+
+        farKey = (startKey + gap + 3) % (MAX_SEQ_NUM + 1)
+        farPacket = RTP(sequenceNumber=farKey)
+
+        self.assertEqual(packets[1:], self.buffer.pushGet(farKey, farPacket))
+        self.assertEqual({farKey: farPacket}, self.buffer._buffer)
+
+    def test_maxSize(self):
+        buffer = OrderedBuffer(maxSize=2)
+        packets = [RTP(sequenceNumber=x) for x in range(4)]
+
+        self.assertEqual([packets[0]], buffer.pushGet(0, packets[0]))
+        self.assertEqual([], buffer.pushGet(2, packets[2]))
+        # Packet 3 moves the window past the missing packet 1
+        self.assertEqual(
+            [packets[2], packets[3]], buffer.pushGet(3, packets[3]))
+
+        with self.assertRaises(ValueError):
+            OrderedBuffer(maxSize=0)
+
+    def test_maxHold(self):
+        buffer = OrderedBuffer(maxHold=0.1)
+        packets = [RTP(sequenceNumber=x) for x in range(4)]
+
+        buffer.pushGet(0, packets[0], now=0.0)
+        self.assertEqual([], buffer.pushGet(2, packets[2], now=1.0))
+        self.assertEqual(1.1, buffer.deadline)
+
+        self.assertEqual([], buffer.expire(1.05))
+        self.assertEqual([packets[2]], buffer.expire(1.1))
+        self.assertIsNone(buffer.deadline)
+
+        # Packet 1 has been given up on
+        self.assertEqual([], buffer.pushGet(1, packets[1], now=1.2))
+        self.assertEqual(1, buffer.late)
+        self.assertEqual([packets[3]], buffer.pushGet(3, packets[3], now=1.2))
+
+    def test_maxHoldPushGet(self):
+        # Overdue packets are released by the next push
+        buffer = OrderedBuffer(maxHold=0.1)
+        packets = [RTP(sequenceNumber=x) for x in range(4)]
+
+        buffer.pushGet(0, packets[0], now=0.0)
+        buffer.pushGet(2, packets[2], now=1.0)
+
+        self.assertEqual(
+            packets[2:], buffer.pushGet(3, packets[3], now=1.5))
+
+    def test_maxHoldOldest(self):
+        # The deadline follows the oldest held packet as others are released
+        buffer = OrderedBuffer(maxSize=8, maxHold=10.0)
+        packets = [RTP(sequenceNumber=x) for x in range(6)]
+
+        buffer.pushGet(0, packets[0], now=0.0)
+        buffer.pushGet(3, packets[3], now=1.0)
+        buffer.pushGet(5, packets[5], now=2.0)
+        buffer.pushGet(2, packets[2], now=2.5)
+        self.assertEqual(11.0, buffer.deadline)
+
+        self.assertEqual(
+            packets[1:4], buffer.pushGet(1, packets[1], now=2.5))
+        self.assertEqual(12.0, buffer.deadline)
+
+    def test_noHoldArrivals(self):
+        # Arrival times are only kept when there is a hold time
+        buffer = OrderedBuffer(maxSize=8)
+        for x in range(0, 20, 2):
+            buffer.pushGet(x, RTP(sequenceNumber=x), now=float(x))
+
+        self.assertEqual(0, len(buffer._arrivals))
+        self.assertIsNone(buffer.deadline)
+
+    def test_adaptive(self):
+        buffer = OrderedBuffer(maxSize=16, maxHold=1.0, adaptive=True)
+        self.assertEqual(2, buffer.depth)
+        self.assertEqual(0.005, buffer.hold)
+
+        received = []
+        for seqNum in (0, 2, 3, 4, 1):
+            received += buffer.pushGet(
+                seqNum, RTP(sequenceNumber=seqNum), now=seqNum * 0.001)
+
+        # Packet 1 was given up on, so depth and hold grow to tolerate
+        # the same reordering next time
+        self.assertEqual(1, buffer.late)
+        self.assertGreater(buffer.depth, 4)
+        self.assertGreater(buffer.hold, 0.005)
+
+        for seqNum in (5, 7, 8, 9, 6):
+            received += buffer.pushGet(
+                seqNum, RTP(sequenceNumber=seqNum), now=0.01)
+
+        self.assertEqual(1, buffer.late)
+        self.assertEqual(
+            [0, 2, 3, 4, 5, 6, 7, 8, 9],
+            [p.sequenceNumber for p in received])
+
+        # And fall back as the stream stays clean
+        for seqNum in range(10, 10000):
+            buffer.pushGet(seqNum, RTP(sequenceNumber=seqNum), now=1.0)
+
+        self.assertEqual(2, buffer.depth)
+        self.assertEqual(0.005, buffer.hold)
+
+    def test_lostReordered(self):
+        packets = [RTP(sequenceNumber=x) for x in range(10)]
+
+        for seqNum in (0, 2, 1, 4, 9):
+            self.buffer.pushGet(seqNum, packets[seqNum])
+
+        # Packet 3 is passed over when 9 moves the window on
+        self.assertEqual(1, self.buffer.reordered)
+        self.assertEqual(1, self.buffer.lost)
+
+    def test_replace(self):
+        packets = [RTP(sequenceNumber=x) for x in range(3)]
+        replacement = RTP(sequenceNumber=2)
+
+        self.buffer.pushGet(0, packets[0])
+        self.buffer.pushGet(2, packets[2])
+        self.assertFalse(self.buffer.holds(0, packets[0]))
+        self.assertTrue(self.buffer.holds(2, packets[2]))
+
+        self.buffer.replace(2, replacement)
+        self.assertFalse(self.buffer.holds(2, packets[2]))
+        with self.assertRaises(KeyError):
+            self.buffer.replace(1, replacement)
+
+        self.assertEqual(
+            [packets[1], replacement], self.buffer.pushGet(1, packets[1]))
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase, mock
+from unittest.mock import MagicMock
+from hypothesis import given, strategies as st  # type: ignore
+from datetime import datetime
+import asyncio
+
+from rtpTTML import TTMLTransmitter
+from rtpTTML.pacing import TokenBucket, PacedSender
+
+
+class TestTokenBucket (TestCase):
+    def test_delay(self):
+        bucket = TokenBucket(100, 10, 0.0)
+
+        self.assertEqual(0, bucket.delay(10, 0.0))
+        bucket.take(10, 0.0)
+        self.assertAlmostEqual(0.05, bucket.delay(5, 0.0))
+        self.assertEqual(0, bucket.delay(5, 0.05))
+
+    def test_oversizedCost(self):
+        bucket = TokenBucket(100, 10, 0.0)
+
+        # Can be taken when full, leaving the bucket in debt
+        self.assertEqual(0, bucket.delay(30, 0.0))
+        bucket.take(30, 0.0)
+        self.assertAlmostEqual(0.3, bucket.delay(30, 0.0))
+
+    @given(
+        st.floats(min_value=1, max_value=1e9),
+        st.lists(st.floats(min_value=1, max_value=1e4), min_size=1))
+    def test_rate(self, rate, costs):
+        bucket = TokenBucket(rate, max(costs), 0.0)
+        now = 0.0
+
+        for cost in costs:
+            now += bucket.delay(cost, now)
+            bucket.take(cost, now)
+
+        # Everything after the initially full bucket is sent at the rate
+        self.assertLessEqual(
+            sum(costs) - max(costs), (now * rate) * (1 + 1e-9) + 1e-6)
+
+    def test_invalidRate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0, 1, 0.0)
+
+        with self.assertRaises(ValueError):
+            TokenBucket(1, 0, 0.0)
+
+
+class TestPacedSender (TestCase):
+    async def async_test_packetGap(self):
+        loop = asyncio.get_event_loop()
+        transport = MagicMock()
+        sendTimes = []
+        transport.sendto.side_effect = lambda p: sendTimes.append(
+            (p, loop.time()))
+
+        sender = PacedSender(transport, packetGap=0.02)
+        packets = [memoryview(bytes([x])) for x in range(5)]
+        sender.enqueue(packets)
+        self.assertEqual(5, sender.queueDepth)
+
+        await sender.close()
+
+        self.assertEqual([bytes(p) for p in packets], [p for p, _ in sendTimes])
+        for (_, prev), (_, this) in zip(sendTimes, sendTimes[1:]):
+            self.assertGreaterEqual(this - prev, 0.015)
+
+        self.assertEqual(0, sender.queueDepth)
+        self.assertEqual(5, sender.maxQueueDepth)
+        self.assertEqual(5, sender.packetsSent)
+        self.assertGreater(sender.pacingDelay, 0)
+        self.assertGreaterEqual(sender.maxPacingDelay, 0.06)
+
+    def test_packetGap(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.async_test_packetGap())
+
+    async def async_test_bitRate(self):
+        transport = MagicMock()
+        loop = asyncio.get_event_loop()
+
+        sender = PacedSender(transport, bitRate=8000, maxPacketSize=10)
+        start = loop.time()
+        sender.enqueue([memoryview(bytes(10))] * 6)
+        await sender.drain()
+
+        # 50 bytes beyond the initial bucket at 1000 bytes/s
+        self.assertGreaterEqual(loop.time() - start, 0.045)
+        self.assertEqual(6, transport.sendto.call_count)
+        await sender.close()
+
+    def test_bitRate(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.async_test_bitRate())
+
+    def test_invalidArgs(self):
+        with self.assertRaises(ValueError):
+            PacedSender(MagicMock())
+
+        for kwargs in (
+           {"bitRate": 0}, {"bitRate": -1}, {"packetGap": 0},
+           {"bitRate": 1e6, "maxPacketSize": 0}):
+            with self.assertRaises(ValueError):
+                PacedSender(MagicMock(), **kwargs)
+
+    async def async_test_sendError(self):
+        transport = MagicMock()
+        transport.sendto.side_effect = [None, OSError("unreachable")]
+
+        sender = PacedSender(transport, packetGap=0.001)
+        sender.enqueue([memoryview(bytes([x])) for x in range(5)])
+
+        # The failure is passed back rather than drain() waiting forever
+        with self.assertRaises(RuntimeError) as context:
+            await asyncio.wait_for(sender.drain(), 1)
+        self.assertIsInstance(context.exception.__cause__, OSError)
+        self.assertEqual(0, sender.queueDepth)
+
+        with self.assertRaises(RuntimeError):
+            sender.enqueue([memoryview(bytes(1))])
+
+        with self.assertRaises(RuntimeError):
+            await sender.close()
+        self.assertEqual(1, sender.packetsSent)
+
+    def test_sendError(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.async_test_sendError())
+
+
+class TestPacedTransmitter (TestCase):
+    async def async_test_pacedSendDoc(self, endpoint):
+        mockTransport = MagicMock()
+        endpoint.return_value = (mockTransport, MagicMock())
+
+        async with TTMLTransmitter(
+                "", 0, maxFragmentSize=4, packetGap=0.001) as transmitter:
+            await transmitter.sendDoc("abcdefghijkl", datetime.now())
+            self.assertEqual(3, transmitter.pacer.queueDepth)
+
+        # Queued packets are sent before the transport is closed
+        self.assertEqual(3, mockTransport.sendto.call_count)
+        mockTransport.close.assert_called_once()
+
+    @mock.patch(
+        "asyncio.unix_events._UnixSelectorEventLoop.create_datagram_endpoint")
+    def test_pacedSendDoc(self, endpoint):
+        asyncio.get_event_loop().run_until_complete(
+            self.async_test_pacedSendDoc(endpoint))
+
+    def test_invalidArgs(self):
+        with self.assertRaises(ValueError):
+            TTMLTransmitter("", 0, bitRate=1e6, packetGap=0.01)
+
+        with self.assertRaises(ValueError):
+            TTMLTransmitter("", 0, bitRate=0)
+
+        with self.assertRaises(ValueError):
+            TTMLTransmitter("", 0, packetGap=0)
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime
+import sys
+from hypothesis import given, strategies as st  # type: ignore
+from rtpPayload_ttml import SUPPORTED_ENCODINGS
+
+from rtpTTML import TTMLTransmitter
+from rtpTTML.packetisationCache import PacketisationCache
+
+
+class TestPacketisationCache (TestCase):
+    def test_getPut(self):
+        cache = PacketisationCache()
+
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", b"abc", [(0, 3)])
+
+        self.assertEqual((b"abc", [(0, 3)]), cache.get("a"))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(3, cache.cachedBytes)
+
+    def test_evictEntries(self):
+        cache = PacketisationCache(maxEntries=2)
+
+        cache.put("a", b"a", [(0, 1)])
+        cache.put("b", b"b", [(0, 1)])
+        cache.get("a")
+        cache.put("c", b"c", [(0, 1)])
+
+        # "b" was least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(2, len(cache))
+
+    def test_evictBytes(self):
+        cache = PacketisationCache(maxBytes=5)
+
+        cache.put("a", b"aa", [(0, 2)])
+        cache.put("b", b"bb", [(0, 2)])
+        cache.put("c", b"cc", [(0, 2)])
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(4, cache.cachedBytes)
+        self.assertEqual(1, cache.evictions)
+
+        # Too big to cache at all
+        cache.put("d", b"dddddd", [(0, 6)])
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(2, len(cache))
+
+    def test_keySize(self):
+        cache = PacketisationCache(maxBytes=9)
+
+        cache.put("a", b"aa", [(0, 2)], keySize=3)
+        self.assertEqual(5, cache.cachedBytes)
+        cache.put("b", b"bb", [(0, 2)], keySize=3)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(5, cache.cachedBytes)
+
+        # Too big to cache with its key
+        cache.put("c", b"cc", [(0, 2)], keySize=9)
+        self.assertIsNone(cache.get("c"))
+
+    def test_transmitterKeySize(self):
+        cache = PacketisationCache()
+        doc = "abc" * 100
+        transmitter = TTMLTransmitter("", 0, cache=cache)
+        packets = transmitter._packetiseDocBuffer(doc, datetime.now())
+        payloads = sum(len(p) for p in packets)
+
+        # The document is counted as well as the packets
+        self.assertEqual(payloads + sys.getsizeof(doc), cache.cachedBytes)
+
+    def test_replace(self):
+        cache = PacketisationCache()
+
+        cache.put("a", b"aa", [(0, 2)])
+        cache.put("a", b"a", [(0, 1)])
+
+        self.assertEqual(1, len(cache))
+        self.assertEqual(1, cache.cachedBytes)
+
+    def test_clear(self):
+        cache = PacketisationCache()
+        cache.put("a", b"aa", [(0, 2)])
+
+        cache.clear()
+
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.cachedBytes)
+
+    @given(
+        st.lists(st.sampled_from(["", "abc", "\U0001F600" * 300]), max_size=6),
+        st.sampled_from(SUPPORTED_ENCODINGS),
+        st.booleans(),
+        st.datetimes())
+    def test_cachedTransmitter(self, docs, encoding, bom, time):
+        cache = PacketisationCache(maxEntries=3)
+        refTransmitter = TTMLTransmitter(
+            "", 0, maxFragmentSize=100, encoding=encoding, bom=bom)
+        thisTransmitter = TTMLTransmitter(
+            "", 0, maxFragmentSize=100, encoding=encoding, bom=bom,
+            initialSeqNum=refTransmitter.nextSeqNum,
+            tsOffset=refTransmitter._tsOffset, ssrc=refTransmitter.ssrc,
+            cache=cache)
+
+        for doc in docs:
+            expected = [
+                bytes(p) for p in refTransmitter._packetiseDocBuffer(
+                    doc, time)]
+            packets = [
+                bytes(p) for p in thisTransmitter._packetiseDocBuffer(
+                    doc, time)]
+            self.assertEqual(expected, packets)
+
+        self.assertEqual(len(docs), cache.hits + cache.misses)
+        self.assertEqual(len(docs) - len(set(docs)), cache.hits)
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from unittest import mock
+import os
+
+from rtpTTML import RTPDumpRecorder, TTMLReceiver, TTMLTransmitter
+from rtpTTML.capture import readCapture, replay
+
+SRC = ("192.0.2.1", 5000)
+
+
+class TestRTPDumpRecorder (TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_receiver(self):
+        transmitter = TTMLTransmitter("", 0, maxFragmentSize=100)
+        docs = ["document {} ".format(x) * 30 for x in range(3)]
+        packets = []
+        for x, doc in enumerate(docs):
+            packets += [
+                bytes(p) for p in transmitter._packetiseDocBuffer(
+                    doc, datetime.fromtimestamp(x))]
+
+        received = []
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(path, ("0.0.0.0", 1234)) as recorder:
+            receiver = TTMLReceiver(
+                1234, lambda doc, ts: received.append(doc),
+                recorder=recorder)
+            for packet in packets:
+                receiver._processData(packet, SRC)
+
+        self.assertEqual(docs, received)
+        self.assertEqual(len(packets), recorder.recorded)
+        self.assertEqual([path], recorder.files)
+
+        datagrams = list(readCapture(path))
+        self.assertEqual(packets, [bytes(d.data) for d in datagrams])
+        self.assertEqual(SRC, datagrams[0].src)
+        self.assertEqual(("0.0.0.0", 1234), datagrams[0].dst)
+
+        replayed = []
+        replay(path, lambda doc, ts, flow: replayed.append(doc))
+        self.assertEqual(docs, replayed)
+
+    def test_timestamps(self):
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(path) as recorder:
+            recorder.record(b"\x80" * 20, SRC, now=1000.5)
+            recorder.record(b"\x80" * 20, SRC, now=1001.75)
+
+        times = [d.time for d in readCapture(path)]
+        self.assertEqual([1000.5, 1001.75], times)
+
+    def test_clockBackwards(self):
+        # A record from before the start of the file is given the file's
+        # start time, rather than failing
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(path) as recorder:
+            recorder.record(b"\x80" * 20, SRC, now=1000.5)
+            recorder.record(b"\x80" * 20, SRC, now=999.0)
+            recorder.record(b"\x80" * 20, SRC, now=1001.0)
+
+        self.assertEqual(3, recorder.recorded)
+        self.assertEqual(0, recorder.errors)
+        times = [d.time for d in readCapture(path)]
+        self.assertEqual([1000.5, 1000.5, 1001.0], times)
+
+    def test_offsetLimit(self):
+        # A new file is started before offsets outgrow their 32 bits
+        path = self.path("test.rtpdump")
+        later = 1000.0 + 2**32 / 1000
+        with RTPDumpRecorder(path) as recorder:
+            recorder.record(b"\x80" * 20, SRC, now=1000.0)
+            recorder.record(b"\x81" * 20, SRC, now=later)
+
+        self.assertEqual(2, recorder.recorded)
+        self.assertEqual(0, recorder.errors)
+        self.assertEqual(2, len(recorder.files))
+        self.assertEqual(path, recorder.files[0])
+
+        datagrams = [list(readCapture(f)) for f in recorder.files]
+        self.assertEqual([1, 1], [len(d) for d in datagrams])
+        self.assertEqual(later, datagrams[1][0].time)
+
+    def test_recordFailure(self):
+        # Datagrams that can't be recorded are counted, not raised
+        path = self.path("test.rtpdump")
+        with self.assertLogs("rtpTTML.recorder"):
+            with RTPDumpRecorder(path) as recorder:
+                recorder.record(None, SRC)
+                recorder.record(b"\x80" * 20, SRC)
+
+        self.assertEqual(1, recorder.errors)
+        self.assertEqual(1, recorder.recorded)
+        self.assertEqual(1, len(list(readCapture(path))))
+
+    def test_rotateSize(self):
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(path, maxBytes=100) as recorder:
+            for x in range(10):
+                recorder.record(bytes([x]) * 40, SRC, now=1000.0 + x)
+
+        # Two 48 byte records fit in each file
+        self.assertEqual(5, len(recorder.files))
+        self.assertEqual(
+            self.path("test-0000-19700101T001640Z.rtpdump"),
+            recorder.files[0])
+
+        data = []
+        for recorded in recorder.files:
+            datagrams = list(readCapture(recorded))
+            self.assertEqual(2, len(datagrams))
+            data += [bytes(d.data) for d in datagrams]
+
+        self.assertEqual([bytes([x]) * 40 for x in range(10)], data)
+
+    def test_openFailure(self):
+        # A file that can't be opened loses its records, but recording
+        # carries on into the next one
+        path = self.path("test.rtpdump")
+
+        def failSecond(name, *args):
+            # The second file, starting at 1002 seconds
+            if name.endswith("T001642Z.rtpdump"):
+                raise OSError("No space left on device")
+            return open(name, *args)
+
+        with mock.patch("rtpTTML.recorder.open", failSecond, create=True):
+            with self.assertLogs("rtpTTML.recorder"):
+                with RTPDumpRecorder(path, maxBytes=100) as recorder:
+                    for x in range(6):
+                        recorder.record(bytes([x]) * 40, SRC, now=1000.0 + x)
+
+        self.assertEqual(1, recorder.errors)
+        self.assertEqual(2, len(recorder.files))
+
+        data = []
+        for recorded in recorder.files:
+            data += [bytes(d.data) for d in readCapture(recorded)]
+        self.assertEqual([bytes([x]) * 40 for x in (0, 1, 4, 5)], data)
+
+    def test_rotateTime(self):
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(path, maxSeconds=60) as recorder:
+            for x in range(10):
+                recorder.record(b"\x80" * 20, SRC, now=1000.0 + 20 * x)
+                # Rotation doesn't depend on when records are written
+                if x % 3 == 0:
+                    recorder.flush()
+
+        self.assertEqual(4, len(recorder.files))
+        counts = [len(list(readCapture(f))) for f in recorder.files]
+        self.assertEqual([3, 3, 3, 1], counts)
+
+    def test_overflow(self):
+        path = self.path("test.rtpdump")
+        with RTPDumpRecorder(
+           path, maxBuffered=100, flushInterval=60) as recorder:
+            for x in range(5):
+                recorder.record(b"\x80" * 40, SRC)
+            # Too long for an rtpdump record
+            recorder.record(bytes(2**16), SRC)
+
+        self.assertEqual(2, recorder.recorded)
+        self.assertEqual(4, recorder.dropped)
+        self.assertEqual(2, len(list(readCapture(path))))
+
+    def test_closed(self):
+        path = self.path("test.rtpdump")
+        recorder = RTPDumpRecorder(path)
+        recorder.close()
+        recorder.record(b"\x80" * 20, SRC)
+
+        self.assertEqual(1, recorder.dropped)
+        self.assertEqual([], recorder.files)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from hypothesis import given, strategies as st  # type: ignore
+from rtp import RTP, PayloadType, Extension  # type: ignore
+
+from rtpTTML.rtpView import RTPView
+
+
+class TestRTPView (TestCase):
+    @given(
+        st.integers(min_value=0, max_value=2**16 - 1),
+        st.integers(min_value=0, max_value=2**32 - 1),
+        st.integers(min_value=0, max_value=2**32 - 1),
+        st.booleans(),
+        st.lists(
+            st.integers(min_value=0, max_value=2**32 - 1), max_size=15),
+        st.binary())
+    def test_matchesRTP(
+       self, sequenceNumber, timestamp, ssrc, marker, csrcList, payload):
+        packet = RTP(
+            sequenceNumber=sequenceNumber,
+            timestamp=timestamp,
+            ssrc=ssrc,
+            marker=marker,
+            payloadType=PayloadType.DYNAMIC_96,
+            csrcList=csrcList,
+            payload=bytearray(payload))
+        data = packet.toBytes()
+
+        view = RTPView(data)
+
+        self.assertEqual(sequenceNumber, view.sequenceNumber)
+        self.assertEqual(timestamp, view.timestamp)
+        self.assertEqual(ssrc, view.ssrc)
+        self.assertEqual(marker, view.marker)
+        self.assertEqual(PayloadType.DYNAMIC_96.value, view.payloadType)
+        self.assertEqual(payload, bytes(view.payload))
+
+    def test_extension(self):
+        packet = RTP(
+            extension=Extension(
+                startBits=bytearray(b"\xbe\xde"),
+                headerExtension=bytearray(8)),
+            payload=bytearray(b"payload"))
+
+        self.assertEqual(b"payload", bytes(RTPView(packet.toBytes()).payload))
+
+    def test_padding(self):
+        data = bytearray(RTP(payload=bytearray(b"payload")).toBytes())
+        data[0] |= 0x20
+        data += b"\x00\x00\x03"
+
+        self.assertEqual(b"payload", bytes(RTPView(data).payload))
+
+    def test_view(self):
+        data = bytearray(RTP(payload=bytearray(b"payload")).toBytes())
+        view = RTPView(data)
+
+        # The payload is a view onto the datagram, not a copy
+        data[-1:] = b"!"
+        self.assertEqual(b"payloa!", bytes(view.payload))
+
+    def test_copy(self):
+        data = bytearray(RTP(
+            sequenceNumber=7, marker=True,
+            payload=bytearray(b"payload")).toBytes())
+        view = RTPView(data).copy()
+
+        # The copy no longer refers to the datagram
+        data[-1:] = b"!"
+        self.assertEqual(b"payload", bytes(view.payload))
+        self.assertEqual(7, view.sequenceNumber)
+        self.assertTrue(view.marker)
+
+    def test_invalid(self):
+        data = RTP(payload=bytearray(b"payload")).toBytes()
+
+        with self.assertRaises(ValueError):
+            RTPView(data[:11])
+
+        with self.assertRaises(ValueError):
+            RTPView(bytes([0x40]) + data[1:])
+
+        with self.assertRaises(ValueError):
+            RTPView(bytes([data[0] | 0x0f]) + data[1:])
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from random import Random
+
+from rtpTTML.sampleText import SCRIPTS, sampleText
+
+
+class TestSampleText (TestCase):
+    def test_sampleText(self):
+        for script, alphabet in SCRIPTS.items():
+            text = sampleText(50, script, Random(1))
+
+            self.assertEqual(50, len(text))
+            self.assertTrue(set(text) <= set(alphabet))
+            # Seeded, so repeatable
+            self.assertEqual(text, sampleText(50, script, Random(1)))
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from hypothesis import given, strategies as st  # type: ignore
+
+from rtpTTML.timerWheel import TimerWheel
+
+
+class TestTimerWheel (TestCase):
+    def test_advance(self):
+        wheel = TimerWheel(resolution=0.1, slots=8)
+        wheel.schedule("a", 10.25)
+        wheel.schedule("b", 10.0)
+        self.assertEqual(2, len(wheel))
+
+        self.assertEqual([], wheel.advance(9.9))
+        self.assertEqual(["b"], wheel.advance(10.1))
+        self.assertAlmostEqual(10.3, wheel.nextExpiry())
+        self.assertEqual([], wheel.advance(10.2))
+        self.assertEqual(["a"], wheel.advance(10.3))
+
+        self.assertEqual(0, len(wheel))
+        self.assertIsNone(wheel.nextExpiry())
+
+    def test_reschedule(self):
+        # A key is returned once for its earliest deadline in a bucket
+        wheel = TimerWheel(resolution=0.1, slots=8)
+        wheel.schedule("a", 1.05)
+        wheel.schedule("a", 1.05)
+        wheel.schedule("a", 1.01)
+
+        self.assertEqual(["a"], wheel.advance(2.0))
+        self.assertEqual([], wheel.advance(3.0))
+
+    def test_rescheduleNextExpiry(self):
+        # The next expiry follows a key moved to an earlier deadline, a
+        # revolution ahead in the same bucket
+        wheel = TimerWheel(resolution=0.1, slots=8)
+        wheel.schedule("a", 1.75)
+        wheel.schedule("a", 0.95)
+        self.assertAlmostEqual(1.0, wheel.nextExpiry())
+
+        self.assertEqual(["a"], wheel.advance(1.0))
+        self.assertIsNone(wheel.nextExpiry())
+
+    def test_pastDeadline(self):
+        wheel = TimerWheel(resolution=0.1, slots=8)
+        wheel.advance(5.0)
+        wheel.schedule("a", 1.0)
+
+        self.assertEqual(["a"], wheel.advance(5.1))
+
+    @given(
+        st.lists(st.floats(min_value=0.0, max_value=20.0), min_size=1),
+        st.lists(st.floats(min_value=0.0, max_value=25.0), min_size=1))
+    def test_beyondRevolution(self, deadlines, steps):
+        # Keys are all returned, and no earlier than their deadline, however
+        # far ahead they were scheduled
+        wheel = TimerWheel(resolution=0.1, slots=8)
+        for key, deadline in enumerate(deadlines):
+            wheel.schedule(key, deadline)
+
+        returned = {}
+        for now in sorted(steps) + [25.0]:
+            for key in wheel.advance(now):
+                returned[key] = now
+
+        self.assertEqual(set(range(len(deadlines))), set(returned))
+        for key, deadline in enumerate(deadlines):
+            self.assertGreaterEqual(returned[key], deadline)
+
+        self.assertEqual(0, len(wheel))
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime
+from tempfile import TemporaryDirectory
+import json
+import os
+
+from rtpTTML import (
+    ChromeTraceWriter, HistogramTracer, TTMLReceiver, TTMLTransmitter)
+from rtpTTML.tracing import (
+    STAGE_CALLBACK, STAGE_FRAGMENT, STAGE_PARSE, STAGE_PAYLOAD,
+    STAGE_REASSEMBLE, STAGE_REORDER, STAGE_SERIALISE, Tracer)
+
+
+class TestHistogramTracer (TestCase):
+    def test_record(self):
+        tracer = HistogramTracer(bounds=[100, 1000])
+
+        tracer.record("a", 0, 50)
+        tracer.record("a", 1000, 1500)
+        tracer.record("b", 0, 5000)
+
+        snapshot = tracer.snapshot()
+        self.assertEqual((1, 1, 0), snapshot["a"].counts)
+        self.assertEqual((0, 0, 1), snapshot["b"].counts)
+
+    def test_abstract(self):
+        # Tracers must implement record()
+        class Incomplete (Tracer):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_stages(self):
+        tracer = HistogramTracer()
+        tx = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, initialSeqNum=0, tsOffset=0,
+            tracer=tracer)
+
+        packets = []
+        for second, doc in enumerate(["abcdefgh", "ijkl"]):
+            time = datetime(2020, 1, 1, 0, 0, second)
+            packets += [bytes(p) for p in tx._packetiseDocBuffer(doc, time)]
+
+        docs = []
+        receiver = TTMLReceiver(
+            0, lambda doc, ts: docs.append(doc), tracer=tracer)
+
+        for index in (0, 2, 1):
+            receiver._processData(packets[index])
+
+        self.assertEqual(["abcdefgh", "ijkl"], docs)
+
+        samples = {
+            stage: histogram.samples
+            for stage, histogram in tracer.snapshot().items()}
+        self.assertEqual({
+            STAGE_FRAGMENT: 2,
+            STAGE_SERIALISE: 2,
+            STAGE_PARSE: 3,
+            STAGE_REORDER: 3,
+            STAGE_PAYLOAD: 3,
+            STAGE_REASSEMBLE: 2,
+            STAGE_CALLBACK: 2}, samples)
+
+
+class TestChromeTraceWriter (TestCase):
+    def test_write(self):
+        with TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, "trace.json")
+
+            with ChromeTraceWriter(path) as tracer:
+                tracer.record("parse", 1000, 3000)
+                tracer.record("reorder", 3000, 3500)
+
+            with open(path) as traceFile:
+                events = json.load(traceFile)
+
+        self.assertEqual(["parse", "reorder"], [e["name"] for e in events])
+        self.assertEqual(1.0, events[0]["ts"])
+        self.assertEqual(2.0, events[0]["dur"])
+        self.assertEqual("X", events[1]["ph"])
+
+    def test_empty(self):
+        with TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, "trace.json")
+            ChromeTraceWriter(path).close()
+
+            with open(path) as traceFile:
+                self.assertEqual([], json.load(traceFile))
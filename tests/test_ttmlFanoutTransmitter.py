@@ -0,0 +1,123 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase, mock
+from unittest.mock import MagicMock
+from hypothesis import given, strategies as st  # type: ignore
+from rtpPayload_ttml import SUPPORTED_ENCODINGS
+from datetime import datetime
+import asyncio
+
+from rtpTTML import TTMLTransmitter, TTMLFanoutTransmitter
+
+
+class TestTTMLFanoutTransmitter (TestCase):
+    @given(
+        st.text(),
+        st.sampled_from(SUPPORTED_ENCODINGS),
+        st.booleans(),
+        st.datetimes(),
+        st.integers(min_value=7, max_value=1500),
+        st.integers(min_value=1, max_value=5))
+    def test_fanoutDoc(self, doc, encoding, bom, time, maxLen, destCount):
+        fanout = TTMLFanoutTransmitter(
+            maxFragmentSize=maxLen, encoding=encoding, bom=bom)
+        references = []
+        for port in range(destCount):
+            dest = fanout.addDestination("127.0.0.1", port)
+            references.append(TTMLTransmitter(
+                "127.0.0.1", port, maxFragmentSize=maxLen, encoding=encoding,
+                bom=bom, initialSeqNum=dest.nextSeqNum,
+                tsOffset=dest.tsOffset, ssrc=dest.ssrc))
+
+        sent = [
+            (dest.port, [bytes(p) for p in packets])
+            for dest, packets in fanout._fanoutDoc(doc, time)]
+
+        if doc == "":
+            self.assertEqual([], sent)
+            return
+
+        self.assertEqual(
+            [(ref._port, [bytes(p) for p in ref._packetiseDocBuffer(doc, time)])
+             for ref in references],
+            sent)
+        for dest, ref in zip(fanout.destinations, references):
+            self.assertEqual(ref.nextSeqNum, dest.nextSeqNum)
+
+    def test_addRemoveDestination(self):
+        fanout = TTMLFanoutTransmitter([("127.0.0.1", 1), ("127.0.0.1", 2)])
+
+        with self.assertRaises(ValueError):
+            fanout.addDestination("127.0.0.1", 1)
+
+        sends = fanout._fanoutDoc("abc", datetime.now())
+        dest, _ = next(sends)
+        self.assertEqual(1, dest.port)
+
+        # Changes apply from the next document
+        fanout.removeDestination("127.0.0.1", 1)
+        fanout.addDestination("127.0.0.1", 3)
+        self.assertEqual([2], [d.port for d, _ in sends])
+
+        self.assertEqual(
+            [2, 3],
+            [d.port for d, _ in fanout._fanoutDoc(
+                "abc", datetime.now())])
+
+        with self.assertRaises(KeyError):
+            fanout.removeDestination("127.0.0.1", 1)
+
+
+class TestTTMLFanoutTransmitterContexts (TestCase):
+    async def async_test_async(self, endpoint, doc, time):
+        mockTransport = MagicMock()
+        endpoint.return_value = (mockTransport, MagicMock())
+        destinations = [("127.0.0.1", 1), ("127.0.0.1", 2)]
+
+        async with TTMLFanoutTransmitter(destinations) as transmitter:
+            await transmitter.sendDoc(doc, time)
+            if len(doc) > 0:
+                addrs = {c.args[1] for c in mockTransport.sendto.mock_calls}
+                self.assertEqual(set(destinations), addrs)
+            else:
+                mockTransport.sendto.assert_not_called()
+
+        mockTransport.close.assert_called_once()
+
+    @mock.patch(
+        "asyncio.unix_events._UnixSelectorEventLoop.create_datagram_endpoint")
+    @given(st.text(), st.datetimes())
+    def test_async(self, endpoint, doc, time):
+        asyncio.get_event_loop().run_until_complete(
+            self.async_test_async(endpoint, doc, time))
+
+    @mock.patch("socket.socket")
+    @given(st.text(), st.datetimes())
+    def test_sync(self, socket, doc, time):
+        socket.reset_mock()
+        sockInst = socket()
+        destinations = [("127.0.0.1", 1), ("127.0.0.1", 2)]
+
+        with TTMLFanoutTransmitter(destinations) as transmitter:
+            transmitter.sendDoc(doc, time)
+            if len(doc) > 0:
+                addrs = {c.args[1] for c in sockInst.sendto.mock_calls}
+                self.assertEqual(set(destinations), addrs)
+            else:
+                sockInst.sendto.assert_not_called()
+
+        sockInst.close.assert_called_once()
@@ -17,23 +17,21 @@
 from unittest import TestCase, mock
 from hypothesis import given, assume, strategies as st  # type: ignore
 
-from rtpTTML.ttmlReceiver import MAX_SEQ_NUM
-from rtpTTML import TTMLReceiver
+from rtpTTML.ttmlReceiver import (
+    MAX_SEQ_NUM, TTMLStream, StreamID, StreamTable)
+from rtpTTML import TTMLReceiver, TTMLTransmitter
+from rtpTTML.bufferPool import BufferPool
+from datetime import datetime
+import asyncio
+import socket
 from rtp import RTP
 from rtpPayload_ttml import (
-    RTPPayload_TTML, SUPPORTED_ENCODINGS, utfEncode)
+    RTPPayload_TTML, LengthError, SUPPORTED_ENCODINGS, utfEncode)
 
 
-class TestTTMLReceiver (TestCase):
-    def callback(self, doc, timestamp):
-        self.callbackCallCount += 1
-        self.callbackValues.append((doc, timestamp))
-
-    @mock.patch("socket.socket")
-    def setUp(self, mockSocket):
-        self.callbackCallCount = 0
-        self.callbackValues = []
-        self.receiver = TTMLReceiver(0, self.callback)
+class TestTTMLStream (TestCase):
+    def setUp(self):
+        self.stream = TTMLStream()
 
     def setup_example(self):
         self.setUp()
@@ -56,7 +54,7 @@ class TestTTMLReceiver (TestCase):
             [msnPlus1, 2, msnPlus1 + 2]]
 
         for test in tests:
-            ret = self.receiver._unloopSeqNum(test[0], test[1])
+            ret = self.stream._unloopSeqNum(test[0], test[1])
             self.assertEqual(ret, test[2], msg="Failing test: {}".format(test))
 
     @given(
@@ -67,7 +65,9 @@ class TestTTMLReceiver (TestCase):
 
         for keyOffset in range(10):
             if keepList[keyOffset]:
-                self.receiver._fragments[startKey + keyOffset] = None
+                self.stream._addFragment(
+                    (startKey + keyOffset) % (MAX_SEQ_NUM + 1),
+                    memoryview(b""))
 
         complete = True
 
@@ -79,10 +79,10 @@ class TestTTMLReceiver (TestCase):
                 if seenFalse:
                     complete = False
 
-        self.assertEqual(complete, self.receiver._keysComplete())
+        self.assertEqual(complete, self.stream._keysComplete())
 
     def test_keysCompleteEmpty(self):
-        self.assertFalse(self.receiver._keysComplete())
+        self.assertFalse(self.stream._keysComplete())
 
     @given(
         st.integers(min_value=0, max_value=MAX_SEQ_NUM),
@@ -92,19 +92,46 @@ class TestTTMLReceiver (TestCase):
 
         for x in range(len(docFragments)):
             expectedDoc += docFragments[x]
-            self.receiver._fragments[startKey+x] = docFragments[x]
+            self.stream._addFragment(
+                (startKey + x) % (MAX_SEQ_NUM + 1),
+                memoryview(utfEncode(docFragments[x])))
 
-        self.receiver._processFragments()
+        doc = self.stream._processFragments()
 
-        self.assertEqual(0, len(self.receiver._fragments))
-        self.assertEqual(1, self.callbackCallCount)
+        self.assertEqual(0, len(self.stream._fragments))
+        self.assertEqual(expectedDoc, doc)
 
-        self.assertEqual(expectedDoc, self.callbackValues[0][0])
+    @given(
+        st.text(min_size=1),
+        st.sampled_from(SUPPORTED_ENCODINGS),
+        st.booleans(),
+        st.lists(st.integers(min_value=1, max_value=7), min_size=1))
+    def test_processFragmentsSplitChars(self, doc, encoding, bom, sizes):
+        # Fragments split at arbitrary byte offsets, including within
+        # multi-byte characters
+        self.stream = TTMLStream(encoding=encoding, bom=bom)
+        encoded = utfEncode(doc, encoding, bom)
 
-    def test_processFragmentsEmpty(self):
-        self.receiver._processFragments()
+        start = 0
+        seq = 0
+        while start < len(encoded):
+            end = start + sizes[seq % len(sizes)]
+            self.stream._addFragment(seq, memoryview(encoded[start:end]))
+            start = end
+            seq += 1
 
-        self.assertEqual(0, self.callbackCallCount)
+        self.assertEqual(doc, self.stream._processFragments())
+
+    def test_processFragmentsOutOfOrder(self):
+        self.stream._addFragment(MAX_SEQ_NUM, memoryview(b"a"))
+        self.stream._addFragment(1, memoryview(b"c"))
+        self.stream._addFragment(0, memoryview(b"b"))
+
+        self.assertTrue(self.stream._keysComplete())
+        self.assertEqual("abc", self.stream._processFragments())
+
+    def test_processFragmentsEmpty(self):
+        self.assertIsNone(self.stream._processFragments())
 
     @given(st.tuples(
         st.text(min_size=1),
@@ -116,17 +143,39 @@ class TestTTMLReceiver (TestCase):
 
         payload = RTPPayload_TTML(
             userDataWords=doc, encoding=encoding, bom=bom).toBytearray()
-        packet = RTP(payload=payload, marker=True)
+        packet = RTP(payload=payload, marker=True, sequenceNumber=10)
+
+        thisStream = TTMLStream(encoding=encoding, bom=bom)
+        thisStream._processPacket(packet)
 
-        with mock.patch(
-           "rtpTTML.ttmlReceiver.RTPPayload_TTML") as mockTTML:
+        self.assertEqual(
+            thisStream._fragments[10], utfEncode(doc, encoding, bom))
+        self.assertEqual(doc, thisStream._processFragments())
 
-            thisReceiver = TTMLReceiver(
-                0, self.callback, encoding=encoding, bom=bom)
+    def test_processPacketInvalid(self):
+        invalid = [
+            (bytearray(b"\x00"), LengthError),
+            (bytearray(b"\x00\x01\x00\x01a"), ValueError),
+            (bytearray(b"\x00\x00\x00\x02a"), LengthError)]
 
-            thisReceiver._processPacket(packet)
+        for payload, error in invalid:
+            with self.assertRaises(error):
+                self.stream._processPacket(RTP(payload=payload))
 
-            mockTTML.assert_called_once_with(encoding=encoding, bom=bom)
+
+class TestTTMLReceiver (TestCase):
+    def callback(self, doc, timestamp):
+        self.callbackCallCount += 1
+        self.callbackValues.append((doc, timestamp))
+
+    @mock.patch("socket.socket")
+    def setUp(self, mockSocket):
+        self.callbackCallCount = 0
+        self.callbackValues = []
+        self.receiver = TTMLReceiver(0, self.callback)
+
+    def setup_example(self):
+        self.setUp()
 
     @given(st.tuples(
         st.text(min_size=1),
@@ -140,11 +189,387 @@ class TestTTMLReceiver (TestCase):
             userDataWords=doc, encoding=encoding, bom=bom).toBytearray()
         packet = RTP(payload=payload, marker=True)
         packetBytes = packet.toBytes()
-        with mock.patch(
-           "rtpTTML.ttmlReceiver.RTPPayload_TTML") as mockTTML:
-            thisReceiver = TTMLReceiver(
-                0, self.callback, encoding=encoding, bom=bom)
+        thisReceiver = TTMLReceiver(
+            0, self.callback, encoding=encoding, bom=bom)
+
+        thisReceiver._processData(packetBytes)
+
+        self.assertEqual([(doc, packet.timestamp)], self.callbackValues)
+
+    def interleavedPackets(self):
+        now = datetime.now()
+        txA = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, ssrc=1, initialSeqNum=0, tsOffset=0)
+        txB = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, ssrc=2, initialSeqNum=100,
+            tsOffset=1000)
+        packetsA = [bytes(p) for p in txA._packetiseDocBuffer("aaaabbbb", now)]
+        packetsB = [bytes(p) for p in txB._packetiseDocBuffer("ccccdddd", now)]
+
+        return [p for pair in zip(packetsA, packetsB) for p in pair]
+
+    def test_demuxSSRC(self):
+        docs = []
+        receiver = TTMLReceiver(
+            0, lambda *args: docs.append(args), demuxSSRC=True)
+
+        for packet in self.interleavedPackets():
+            receiver._processData(packet, ("127.0.0.1", 1))
+
+        self.assertEqual(
+            [doc for doc, _, _ in docs], ["aaaabbbb", "ccccdddd"])
+        self.assertEqual(
+            [StreamID(1, None), StreamID(2, None)],
+            [streamID for _, _, streamID in docs])
+        self.assertEqual(2, len(receiver.streams))
+
+    def test_demuxAddress(self):
+        docs = []
+        receiver = TTMLReceiver(
+            0, lambda *args: docs.append(args), demuxSSRC=True,
+            demuxAddress=True)
+        packets = self.interleavedPackets()
+
+        for packet in packets:
+            receiver._processData(packet, ("127.0.0.1", 1))
+        for packet in packets:
+            receiver._processData(packet, ("127.0.0.1", 2))
+
+        self.assertEqual(4, len(docs))
+        self.assertEqual(
+            {StreamID(ssrc, ("127.0.0.1", port))
+             for ssrc in (1, 2) for port in (1, 2)},
+            {streamID for _, _, streamID in docs})
+
+    def test_noDemux(self):
+        # Interleaved streams interfere without demultiplexing
+        for packet in self.interleavedPackets():
+            self.receiver._processData(packet, ("127.0.0.1", 1))
+
+        self.assertLess(self.callbackCallCount, 2)
+        self.assertGreater(self.receiver.latePackets, 0)
+        self.assertEqual([StreamID(None, None)], self.receiver.streams)
+
+    @mock.patch("rtpTTML.ttmlReceiver.monotonic")
+    def test_evictIdleStreams(self, monotonic):
+        receiver = TTMLReceiver(
+            0, lambda *args: None, demuxSSRC=True, streamTimeout=10.0)
+        packets = self.interleavedPackets()
+
+        monotonic.return_value = 100.0
+        receiver._processData(packets[0])
+        monotonic.return_value = 105.0
+        receiver._processData(packets[1])
+        self.assertEqual(2, len(receiver.streams))
+
+        monotonic.return_value = 112.0
+        receiver._processData(packets[3])
+        self.assertEqual([StreamID(2, None)], receiver.streams)
+        self.assertEqual(1, receiver.streamsEvicted)
+
+    @mock.patch("rtpTTML.ttmlReceiver.monotonic")
+    def test_maxHold(self, monotonic):
+        tx = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, ssrc=1, initialSeqNum=0, tsOffset=0)
+        now = datetime.now()
+        packets = [
+            bytes(tx._packetiseDocBuffer(doc, now)[0])
+            for doc in ("abcd", "efgh", "ijkl")]
+
+        receiver = TTMLReceiver(0, self.callback, maxHold=0.1)
+
+        monotonic.return_value = 100.0
+        receiver._processData(packets[0])
+        receiver._processData(packets[2])
+        self.assertEqual(["abcd"], [doc for doc, _ in self.callbackValues])
+
+        monotonic.return_value = 100.05
+        receiver._expireStreams(monotonic())
+        self.assertEqual(1, self.callbackCallCount)
+
+        # Deadlines are checked at the timer wheel's resolution
+        monotonic.return_value = 100.11
+        receiver._expireStreams(monotonic())
+        self.assertEqual(
+            ["abcd", "ijkl"], [doc for doc, _ in self.callbackValues])
+        self.assertIsNone(receiver._streams.nextDeadline())
+
+    @mock.patch("rtpTTML.ttmlReceiver.monotonic")
+    def test_docTimeout(self, monotonic):
+        tx = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, ssrc=1, initialSeqNum=0, tsOffset=0)
+        packets = [
+            bytes(p) for p in tx._packetiseDocBuffer("abcdefgh", datetime.now())]
+
+        receiver = TTMLReceiver(0, self.callback, docTimeout=1.0)
+
+        # The marker packet is lost
+        monotonic.return_value = 100.0
+        receiver._processData(packets[0])
+        self.assertAlmostEqual(101.01, receiver._streams.nextDeadline())
+
+        monotonic.return_value = 100.5
+        receiver._expireStreams(monotonic())
+        self.assertEqual(0, receiver.docsTimedOut)
+
+        monotonic.return_value = 101.01
+        receiver._expireStreams(monotonic())
+        self.assertEqual(1, receiver.docsTimedOut)
+        self.assertEqual(0, len(receiver._streams._streams[
+            StreamID(None, None)]._fragments))
+
+        # The late marker packet doesn't deliver a truncated document
+        receiver._processData(packets[1])
+        self.assertEqual(0, self.callbackCallCount)
+
+    def test_maxDocSize(self):
+        tx = TTMLTransmitter("", 0, maxFragmentSize=4, ssrc=1)
+        now = datetime.now()
+        receiver = TTMLReceiver(0, self.callback, maxDocSize=8)
+
+        for doc in ("abcdefghijkl", "abcdefgh"):
+            for packet in tx._packetiseDocBuffer(doc, now):
+                receiver._processData(bytes(packet))
+            now = now.replace(second=(now.second + 1) % 60)
+
+        self.assertEqual(["abcdefgh"], [doc for doc, _ in self.callbackValues])
+        self.assertEqual(1, receiver.docsOversize)
+
+
+class TestStreamTable (TestCase):
+    def test_maxStreams(self):
+        table = StreamTable(maxStreams=2)
+
+        streamA = table.get("a", StreamID(1, None))
+        table.get("b", StreamID(2, None))
+        self.assertIs(streamA, table.get("a", StreamID(1, None)))
+        table.get("c", StreamID(3, None))
+
+        # "b" was least recently active
+        self.assertEqual(["a", "c"], table.keys())
+        self.assertEqual(1, table.evicted)
+
+    def test_discard(self):
+        table = StreamTable()
+        for key in [(1, "a"), (1, "b"), (2, "a")]:
+            table.get(key, StreamID(None, None))
+
+        table.discard(lambda key: key[0] == 1)
+
+        self.assertEqual([(2, "a")], table.keys())
+        self.assertEqual(0, table.evicted)
+
+    def test_packetCounts(self):
+        table = StreamTable(reorderDepth=2)
+        stream = table.get("a", StreamID(None, None))
+        for seqNum in (0, 0, 3, 1):
+            stream._packetBuff.pushGet(seqNum, RTP(sequenceNumber=seqNum))
+
+        self.assertEqual(1, table.duplicates)
+        self.assertEqual(1, table.late)
+
+        # Counts are kept after the stream is removed
+        table.discard(lambda key: True)
+        self.assertEqual(1, table.duplicates)
+        self.assertEqual(1, table.late)
+
+
+class TestTTMLReceiverBatched (TestCase):
+    def callback(self, doc, timestamp, streamID=None):
+        self.docs.append(doc)
+
+    def setUp(self):
+        self.docs = []
+        self.rxSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rxSocket.bind(("127.0.0.1", 0))
+        self.rxSocket.settimeout(0.1)
+
+    def tearDown(self):
+        self.rxSocket.close()
+
+    def sendDocs(self, docs):
+        address, port = self.rxSocket.getsockname()
+        with TTMLTransmitter(address, port, maxFragmentSize=8) as tx:
+            for doc in docs:
+                tx.sendDoc(doc, datetime.now())
+
+    def test_runBatched(self):
+        docs = ["doc {}".format(x) * 5 for x in range(10)]
+        self.sendDocs(docs)
+        receiver = TTMLReceiver(0, self.callback, recvBatchSize=8)
+
+        with self.assertRaises(socket.timeout):
+            receiver._runBatched(self.rxSocket, 8)
+
+        self.assertEqual(docs, self.docs)
+
+    @mock.patch("rtpTTML.ttmlReceiver.recvmmsgAvailable")
+    def test_runBatchedFallback(self, available):
+        available.return_value = False
+        docs = ["doc {}".format(x) * 5 for x in range(10)]
+        self.sendDocs(docs)
+        receiver = TTMLReceiver(0, self.callback, recvBatchSize=8)
+
+        with self.assertRaises(socket.timeout):
+            receiver._runBatched(self.rxSocket, 8)
+
+        self.assertEqual(docs, self.docs)
+
+    def test_receiveInto(self):
+        # Small slabs, so that they are reused while documents are part
+        # received
+        docs = ["doc {}".format(x) * 5 for x in range(50)]
+        self.sendDocs(docs)
+        receiver = TTMLReceiver(0, self.callback)
+        pool = BufferPool(maxDatagram=64, slabSize=256, count=4)
+
+        with self.assertRaises(socket.timeout):
+            while True:
+                receiver._receiveInto(self.rxSocket, pool)
+
+        self.assertEqual(docs, self.docs)
+        self.assertEqual(0, pool.allocated)
+
+    def sendPartialDocs(self, streams, seqNums):
+        address, port = self.rxSocket.getsockname()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as tx:
+            for ssrc in range(streams):
+                for seqNum in seqNums:
+                    tx.sendto(RTP(
+                        ssrc=ssrc, sequenceNumber=seqNum, timestamp=ssrc,
+                        marker=(seqNum == 2),
+                        payload=RTPPayload_TTML(
+                            userDataWords=str(seqNum)).toBytearray()
+                        ).toBytes(), (address, port))
+
+    def receivePartialDocs(self, copyHeld):
+        receiver = TTMLReceiver(0, self.callback, demuxSSRC=True)
+        receiver._streams.copyHeld = copyHeld
+        pool = BufferPool(maxDatagram=64, slabSize=256, count=4)
+
+        # Each stream holds a fragment awaiting the rest of its document,
+        # and a packet awaiting the gap before it
+        self.sendPartialDocs(50, (0, 2))
+        with self.assertRaises(socket.timeout):
+            while True:
+                receiver._receiveInto(self.rxSocket, pool)
+
+        allocated = pool.allocated
+
+        self.sendPartialDocs(50, (1,))
+        with self.assertRaises(socket.timeout):
+            while True:
+                receiver._receiveInto(self.rxSocket, pool)
+
+        self.assertEqual(["012"] * 50, self.docs)
+
+        return allocated
+
+    def test_receiveIntoPartialDocs(self):
+        # Held data is copied, so doesn't keep slabs from being reused
+        self.assertEqual(0, self.receivePartialDocs(True))
+
+        self.docs = []
+        self.assertGreater(self.receivePartialDocs(False), 0)
+
+
+class TestTTMLReceiverDocuments (TestCase):
+    def runAsync(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def packets(self, docs, ssrc=None):
+        transmitter = TTMLTransmitter("", 0, maxFragmentSize=8, ssrc=ssrc)
+        packets = []
+        for x, doc in enumerate(docs):
+            packets += [
+                bytes(p) for p in transmitter._packetiseDocBuffer(
+                    doc, datetime.fromtimestamp(x))]
+
+        return packets
+
+    async def async_test_documents(self):
+        docs = ["doc {}".format(x) * 5 for x in range(5)]
+        callbackDocs = []
+        receiver = TTMLReceiver(
+            0, lambda doc, timestamp: callbackDocs.append(doc))
+        documents = receiver.documents()
+
+        # Documents are queued from when documents() is called
+        for packet in self.packets(docs):
+            receiver._processData(packet)
+        receiver.async_close()
+
+        received = [doc async for doc, timestamp in documents]
+        self.assertEqual(docs, received)
+        self.assertEqual(docs, callbackDocs)
+        self.assertEqual([], receiver._queues)
+
+    def test_documents(self):
+        self.runAsync(self.async_test_documents())
+
+    async def async_test_demux(self):
+        receiver = TTMLReceiver(0, None, demuxSSRC=True)
+        documents = receiver.documents()
+
+        for packet in self.packets(["abcdefgh"], ssrc=7):
+            receiver._processData(packet)
+        receiver.async_close()
+
+        received = [item async for item in documents]
+        self.assertEqual(1, len(received))
+        self.assertEqual("abcdefgh", received[0][0])
+        self.assertEqual(StreamID(7, None), received[0][2])
+
+    def test_demux(self):
+        self.runAsync(self.async_test_demux())
+
+    async def async_test_batches(self):
+        docs = ["doc {}".format(x) * 5 for x in range(8)]
+        packets = self.packets(docs)
+        receiver = TTMLReceiver(0, None)
+        batches = receiver.documentBatches(maxQueue=4)
+
+        for packet in packets[:len(packets) // 4]:
+            receiver._processData(packet)
+        first = await batches.__anext__()
+
+        # Beyond maxQueue, the oldest documents are dropped
+        for packet in packets[len(packets) // 4:]:
+            receiver._processData(packet)
+        receiver.async_close()
+        rest = [batch async for batch in batches]
+
+        self.assertEqual(docs[:2], [doc for doc, _ in first])
+        self.assertEqual([docs[4:]], [[doc for doc, _ in b] for b in rest])
+
+    def test_batches(self):
+        self.runAsync(self.async_test_batches())
+
+    async def async_test_asyncRun(self):
+        docs = ["doc {}".format(x) * 5 for x in range(5)]
+        receiver = TTMLReceiver(0, None)
+        await receiver.async_run()
+        port = receiver._transport.get_extra_info("sockname")[1]
+
+        async def consume():
+            received = []
+            async for doc, timestamp in receiver.documents():
+                # The consumer can await without stalling reception
+                await asyncio.sleep(0.01)
+                received.append(doc)
+                if len(received) == len(docs):
+                    return received
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        with TTMLTransmitter("127.0.0.1", port, maxFragmentSize=8) as tx:
+            for doc in docs:
+                tx.sendDoc(doc, datetime.now())
+
+        received = await asyncio.wait_for(consumer, 5)
+        receiver.async_close()
 
-            thisReceiver._processData(packetBytes)
+        self.assertEqual(docs, received)
 
-            mockTTML.assert_called_once_with(encoding=encoding, bom=bom)
+    def test_asyncRun(self):
+        self.runAsync(self.async_test_asyncRun())
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase, skipUnless
+from datetime import datetime
+from time import sleep
+import socket
+import threading
+
+from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlReceiverPool import TTMLReceiverPool
+
+
+def freePort():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+@skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT not available")
+class TestTTMLReceiverPool (TestCase):
+    def callback(self, worker, doc, timestamp, streamID):
+        with self.lock:
+            self.docs.append((worker, doc, streamID.ssrc))
+
+    def setUp(self):
+        self.docs = []
+        self.lock = threading.Lock()
+
+    def waitForDocs(self, count):
+        for _ in range(200):
+            with self.lock:
+                if len(self.docs) >= count:
+                    return
+            sleep(0.01)
+
+    def test_pool(self):
+        port = freePort()
+        streams = 8
+
+        with TTMLReceiverPool(
+                port, workers=2, callback=self.callback,
+                demuxSSRC=True) as pool:
+            for ssrc in range(streams):
+                # A socket per stream, so the kernel can spread the flows
+                with TTMLTransmitter(
+                        "127.0.0.1", port, maxFragmentSize=4,
+                        ssrc=ssrc) as tx:
+                    tx.sendDoc("doc {}".format(ssrc), datetime.now())
+
+            self.waitForDocs(streams)
+            stats = pool.stats()
+            workerStats = pool.workerStats()
+            workers = list(pool._workers)
+
+        # Workers are asked to stop rather than terminated
+        self.assertEqual([0, 0], [worker.exitcode for worker in workers])
+
+        self.assertEqual(
+            {("doc {}".format(ssrc), ssrc) for ssrc in range(streams)},
+            {(doc, ssrc) for _, doc, ssrc in self.docs})
+        self.assertEqual(streams, stats["docs"])
+        self.assertEqual(streams * 2, stats["packets"])
+        self.assertEqual(2, len(workerStats))
+        self.assertEqual(
+            stats["bytes"], sum(w["bytes"] for w in workerStats))
+
+    def test_ephemeralPort(self):
+        with self.assertRaises(ValueError):
+            TTMLReceiverPool(0)
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+#
+# James Sandford, copyright BBC 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from datetime import datetime
+import asyncio
+
+from rtpTTML import TTMLReceiverServer, TTMLTransmitter
+from rtpTTML.ttmlReceiver import StreamID
+
+
+class TestTTMLReceiverServer (TestCase):
+    def callback(self, doc, timestamp, port, streamID):
+        self.docs.append((doc, port, streamID))
+
+    def setUp(self):
+        self.docs = []
+
+    def send(self, port, doc, ssrc):
+        with TTMLTransmitter(
+                "127.0.0.1", port, maxFragmentSize=4, ssrc=ssrc) as tx:
+            tx.sendDoc(doc, datetime.now())
+
+    async def waitForDocs(self, count):
+        for _ in range(100):
+            if len(self.docs) >= count:
+                return
+            await asyncio.sleep(0.01)
+
+    async def async_test_ports(self):
+        server = TTMLReceiverServer(self.callback)
+        await server.start()
+        portA, portB = await server.addPorts([0, 0])
+        self.assertEqual([portA, portB], server.ports)
+
+        self.send(portA, "abcdefgh", 1)
+        self.send(portA, "ijklmnop", 2)
+        self.send(portB, "qrstuvwx", 1)
+        await self.waitForDocs(3)
+
+        self.assertEqual(
+            {("abcdefgh", portA, StreamID(1, None)),
+             ("ijklmnop", portA, StreamID(2, None)),
+             ("qrstuvwx", portB, StreamID(1, None))},
+            set(self.docs))
+        self.assertEqual(3, server.streamCount)
+
+        load = server.portLoad()
+        self.assertEqual(4, load[portA].packets)
+        self.assertEqual(2, load[portA].docs)
+        self.assertEqual(2, load[portB].packets)
+        self.assertEqual(1, load[portB].docs)
+        self.assertGreater(load[portA].bytes, load[portB].bytes)
+
+        server.removePort(portA)
+        self.assertEqual([portB], server.ports)
+        self.assertEqual(1, server.streamCount)
+
+        server.close()
+        self.assertEqual([], server.ports)
+
+    def test_ports(self):
+        asyncio.get_event_loop().run_until_complete(self.async_test_ports())
+
+    async def async_test_errors(self):
+        server = TTMLReceiverServer(self.callback)
+        port = await server.addPort(0)
+        transport, _ = await asyncio.get_event_loop(
+            ).create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=("127.0.0.1", port))
+        transport.sendto(b"\x00")
+        self.send(port, "abcd", 1)
+        await self.waitForDocs(1)
+
+        self.assertEqual([("abcd", port, StreamID(1, None))], self.docs)
+        self.assertEqual(1, server.portLoad()[port].errors)
+
+        transport.close()
+        server.close()
+
+    def test_errors(self):
+        asyncio.get_event_loop().run_until_complete(self.async_test_errors())
+
+    async def async_test_maxHold(self):
+        server = TTMLReceiverServer(self.callback, maxHold=0.05)
+        port = await server.addPort(0)
+        transport, _ = await asyncio.get_event_loop(
+            ).create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=("127.0.0.1", port))
+
+        # The second document's packet is lost, leaving the third held until
+        # the hold time expires
+        tx = TTMLTransmitter("", 0, maxFragmentSize=4, ssrc=1)
+        now = datetime.now()
+        packets = [
+            bytes(tx._packetiseDocBuffer(doc, now)[0])
+            for doc in ("abcd", "efgh", "ijkl")]
+        transport.sendto(packets[0])
+        transport.sendto(packets[2])
+        await self.waitForDocs(2)
+
+        self.assertEqual(
+            ["abcd", "ijkl"], [doc for doc, _, _ in self.docs])
+        self.assertEqual(2, server.portLoad()[port].docs)
+
+        transport.close()
+        server.close()
+
+    def test_maxHold(self):
+        asyncio.get_event_loop().run_until_complete(self.async_test_maxHold())
+
+    def test_flattenPorts(self):
+        self.assertEqual(
+            [1, 5, 6, 7],
+            TTMLReceiverServer._flattenPorts([1, range(5, 8)]))
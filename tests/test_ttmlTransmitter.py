@@ -14,15 +14,59 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from unittest import TestCase, mock
+from unittest import TestCase, mock, skipUnless
 from unittest.mock import MagicMock
 from hypothesis import given, strategies as st  # type: ignore
 from rtpPayload_ttml import (
     RTPPayload_TTML, SUPPORTED_ENCODINGS, utfEncode)
-from rtpPayload_ttml.utfUtils import BOMS
+from rtpPayload_ttml.utfUtils import BOMS, ENCODING_ALIASES
+
+from rtp import RTP, PayloadType
 
 from rtpTTML import TTMLTransmitter
+from rtpTTML.ttmlTransmitter import PacketBuffer
+from rtpTTML.mmsg import sendmmsgAvailable
+from datetime import datetime
 import asyncio
+import os
+import socket
+import sys
+
+# The reference fragmenter is shared with the benchmarks
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "benchmarks"))
+from benchUtils import shrinkingFragmentDoc  # noqa: E402
+
+
+def fragmentDoc(transmitter, doc, maxLen):
+    # Decode the fragments the transmitter would send
+    encoded = transmitter._encodeDoc(doc)
+    codec = ENCODING_ALIASES[transmitter._encoding]
+
+    return [
+        encoded[start:end].decode(codec)
+        for start, end in transmitter._fragmentEncoded(encoded, maxLen)]
+
+
+def rtpPacketiseDoc(transmitter, doc, time):
+    # The original packetiser, building an RTP object per fragment, used as a
+    # reference
+    fragments = shrinkingFragmentDoc(
+        doc, transmitter._maxFragmentSize, transmitter._encoding,
+        transmitter._bom)
+    rtpTs = transmitter._datetimeToRTPTs(time)
+
+    return [
+        RTP(
+            timestamp=rtpTs,
+            sequenceNumber=(transmitter.nextSeqNum + x) % 2**16,
+            payload=RTPPayload_TTML(
+                userDataWords=fragments[x], encoding=transmitter._encoding,
+                bom=transmitter._bom and (x == 0)).toBytearray(),
+            marker=(x == len(fragments) - 1),
+            payloadType=transmitter._payloadType,
+            ssrc=transmitter.ssrc)
+        for x in range(len(fragments))]
 
 
 class TestTTMLTransmitter (TestCase):
@@ -36,7 +80,7 @@ class TestTTMLTransmitter (TestCase):
         st.text(min_size=1),
         st.integers(min_value=4))
     def test_fragmentDoc(self, doc, maxLen):
-        fragments = self.transmitter._fragmentDoc(doc, maxLen)
+        fragments = fragmentDoc(self.transmitter, doc, maxLen)
 
         reconstructedDoc = ""
         for fragment in fragments:
@@ -45,6 +89,37 @@ class TestTTMLTransmitter (TestCase):
 
         self.assertEqual(doc, reconstructedDoc)
 
+    @given(
+        st.text(),
+        st.sampled_from(SUPPORTED_ENCODINGS),
+        st.booleans(),
+        st.integers(min_value=7, max_value=64))
+    def test_fragmentDocMatchesReference(self, doc, encoding, bom, maxLen):
+        thisTransmitter = TTMLTransmitter("", 0, encoding=encoding, bom=bom)
+
+        self.assertEqual(
+            shrinkingFragmentDoc(doc, maxLen, encoding, bom),
+            fragmentDoc(thisTransmitter, doc, maxLen))
+
+    def test_fragmentDocMultiByte(self):
+        doc = "a\u0645\u4e2d\U0001F600" * 50
+
+        for encoding in SUPPORTED_ENCODINGS:
+            thisTransmitter = TTMLTransmitter("", 0, encoding=encoding)
+            for maxLen in range(4, 20):
+                fragments = fragmentDoc(thisTransmitter, doc, maxLen)
+
+                self.assertEqual(doc, "".join(fragments))
+                for fragment in fragments:
+                    self.assertLessEqual(
+                        len(utfEncode(fragment, encoding)), maxLen)
+
+    def test_fragmentDocTooSmall(self):
+        thisTransmitter = TTMLTransmitter("", 0, bom=True)
+
+        with self.assertRaises(ValueError):
+            fragmentDoc(thisTransmitter, "\U0001F600", 4)
+
     @given(st.datetimes())
     def test_datetimeToRTPTs(self, time):
         rtpTs = self.transmitter._datetimeToRTPTs(time)
@@ -53,31 +128,6 @@ class TestTTMLTransmitter (TestCase):
         self.assertGreaterEqual(rtpTs, 0)
         self.assertLess(rtpTs, 2**32)
 
-    @given(st.tuples(
-        st.text(min_size=1),
-        st.sampled_from(SUPPORTED_ENCODINGS),
-        st.booleans(),
-        st.integers(min_value=0, max_value=(2**32)-1),
-        st.booleans(),
-        st.booleans()).filter(
-            lambda x: len(utfEncode(x[0], x[1], x[2])) < 2**16))
-    def test_generateRTPPacket(self, data):
-        doc, encoding, bom, time, isFirst, marker = data
-        thisTransmitter = TTMLTransmitter("", 0, encoding=encoding, bom=bom)
-        expectedSeqNum = thisTransmitter._nextSeqNum
-
-        packet = thisTransmitter._generateRTPPacket(
-            doc, time, isFirst, marker)
-        payload = RTPPayload_TTML(
-            encoding=encoding, bom=bom).fromBytearray(packet.payload)
-
-        self.assertEqual(packet.timestamp, time)
-        self.assertEqual(packet.sequenceNumber, expectedSeqNum)
-        self.assertEqual(packet.marker, marker)
-        self.assertEqual(payload.userDataWords, doc)
-
-        self.assertEqual(thisTransmitter._nextSeqNum, expectedSeqNum + 1)
-
     @given(st.tuples(
         st.text(min_size=1),
         st.sampled_from(SUPPORTED_ENCODINGS),
@@ -90,7 +140,9 @@ class TestTTMLTransmitter (TestCase):
         thisTransmitter = TTMLTransmitter("", 0, encoding=encoding, bom=bom)
         expectedSeqNum = thisTransmitter._nextSeqNum
 
-        packets = thisTransmitter._packetiseDoc(doc, time)
+        packets = [
+            RTP().fromBytes(bytes(p))
+            for p in thisTransmitter._packetiseDocBuffer(doc, time)]
 
         for x in range(len(packets)):
             payload = RTPPayload_TTML(
@@ -98,7 +150,8 @@ class TestTTMLTransmitter (TestCase):
 
             self.assertEqual(
                 packets[x].timestamp, thisTransmitter._datetimeToRTPTs(time))
-            self.assertEqual(packets[x].sequenceNumber, expectedSeqNum + x)
+            self.assertEqual(
+                packets[x].sequenceNumber, (expectedSeqNum + x) % 2**16)
             self.assertIn(payload.userDataWords, doc)
             self.assertLess(len(utfEncode(payload.userDataWords)), 2**16)
 
@@ -114,7 +167,78 @@ class TestTTMLTransmitter (TestCase):
                 self.assertFalse(packets[x].marker)
 
         self.assertEqual(
-            thisTransmitter.nextSeqNum, expectedSeqNum + len(packets))
+            thisTransmitter.nextSeqNum,
+            (expectedSeqNum + len(packets)) % 2**16)
+
+    @given(st.tuples(
+        st.text(),
+        st.sampled_from(SUPPORTED_ENCODINGS),
+        st.booleans(),
+        st.datetimes(),
+        st.integers(min_value=7, max_value=1500)))
+    def test_packetiseDocBuffer(self, data):
+        doc, encoding, bom, time, maxLen = data
+        refTransmitter = TTMLTransmitter(
+            "", 0, maxFragmentSize=maxLen, encoding=encoding, bom=bom)
+        thisTransmitter = TTMLTransmitter(
+            "", 0, maxFragmentSize=maxLen, encoding=encoding, bom=bom,
+            initialSeqNum=refTransmitter.nextSeqNum,
+            tsOffset=refTransmitter._tsOffset,
+            ssrc=refTransmitter.ssrc)
+
+        expected = [
+            p.toBytes() for p in rtpPacketiseDoc(refTransmitter, doc, time)]
+        refTransmitter._nextSeqNum = (
+            refTransmitter.nextSeqNum + len(expected)) % 2**16
+        packets = thisTransmitter._packetiseDocBuffer(doc, time)
+
+        self.assertEqual(expected, [bytes(p) for p in packets])
+        self.assertEqual(refTransmitter.nextSeqNum, thisTransmitter.nextSeqNum)
+
+    @given(
+        st.integers(min_value=0, max_value=(2**32)-1),
+        st.sampled_from(PayloadType),
+        st.datetimes())
+    def test_packetiseDocBufferHeader(self, ssrc, payloadType, time):
+        thisTransmitter = TTMLTransmitter(
+            "", 0, maxFragmentSize=4, payloadType=payloadType,
+            initialSeqNum=(2**16)-2, ssrc=ssrc)
+
+        packets = [
+            RTP().fromBytes(bytes(p))
+            for p in thisTransmitter._packetiseDocBuffer("abcdefghijkl", time)]
+
+        self.assertEqual(
+            [(2**16)-2, (2**16)-1, 0], [p.sequenceNumber for p in packets])
+        self.assertEqual([False, False, True], [p.marker for p in packets])
+        for packet in packets:
+            self.assertEqual(ssrc, packet.ssrc)
+            self.assertEqual(payloadType, packet.payloadType)
+            self.assertEqual(
+                thisTransmitter._datetimeToRTPTs(time), packet.timestamp)
+        self.assertEqual(1, thisTransmitter.nextSeqNum)
+
+
+class TestPacketBuffer (TestCase):
+    def test_reserve(self):
+        packetBuffer = PacketBuffer(4)
+
+        offset = packetBuffer.reserve(3)
+        packetBuffer.buffer[offset:offset+3] = b"abc"
+        firstPacket = packetBuffer.packets()[0]
+
+        # Grows the buffer, but earlier views must stay valid
+        offset = packetBuffer.reserve(5)
+        packetBuffer.buffer[offset:offset+5] = b"defgh"
+
+        self.assertEqual(2, len(packetBuffer))
+        self.assertEqual(b"abc", firstPacket)
+        self.assertEqual(
+            [b"abc", b"defgh"], [bytes(p) for p in packetBuffer.packets()])
+
+        packetBuffer.clear()
+        self.assertEqual(0, len(packetBuffer))
+        self.assertEqual([], packetBuffer.packets())
 
 
 class TestTTMLTransmitterContexts (TestCase):
@@ -159,3 +283,49 @@ class TestTTMLTransmitterContexts (TestCase):
                 sockInst.sendto.assert_not_called()
 
         sockInst.close.assert_called_once()
+
+    @mock.patch("rtpTTML.ttmlTransmitter.sendmmsgAvailable")
+    @mock.patch("socket.socket")
+    def test_syncBatchFallback(self, socket, available):
+        available.return_value = False
+        sockInst = socket()
+        now = datetime.now()
+
+        with TTMLTransmitter(
+                "", 0, maxFragmentSize=4, batchSend=True) as transmitter:
+            self.assertFalse(transmitter.batched)
+            transmitter.sendDocs([("abcdefgh", now), ("ijkl", now)])
+
+            self.assertEqual(3, sockInst.sendto.call_count)
+            self.assertEqual(3, transmitter.sendCalls)
+
+    @skipUnless(sendmmsgAvailable(), "sendmmsg not available")
+    def test_syncBatch(self):
+        rxSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rxSocket.bind(("127.0.0.1", 0))
+        rxSocket.settimeout(1.0)
+        address, port = rxSocket.getsockname()
+        now = datetime.now()
+        docs = [("abcdefgh", now), ("ijkl", now)]
+
+        refTransmitter = TTMLTransmitter(
+            address, port, maxFragmentSize=4, initialSeqNum=100)
+        expected = []
+        for doc, time in docs:
+            expected += [
+                bytes(p) for p in refTransmitter._packetiseDocBuffer(
+                    doc, time)]
+
+        with TTMLTransmitter(
+                address, port, maxFragmentSize=4, batchSend=True,
+                initialSeqNum=100,
+                tsOffset=refTransmitter._tsOffset,
+                ssrc=refTransmitter.ssrc) as transmitter:
+            self.assertTrue(transmitter.batched)
+            transmitter.sendDocs(docs)
+            self.assertEqual(1, transmitter.sendCalls)
+
+        received = [rxSocket.recv(2**16) for _ in expected]
+        rxSocket.close()
+
+        self.assertEqual(expected, received)